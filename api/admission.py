@@ -0,0 +1,193 @@
+"""Control de admisión y cola con prioridades delante de Ollama.
+
+En CPU Ollama genera para pocos requests a la vez (OLLAMA_NUM_PARALLEL); lo que excede espera dentro
+de Ollama sin que sepamos cuánto. Aquí cada modelo tiene un límite de generaciones simultáneas y una
+cola acotada ordenada por prioridad: los chats de usuarios pasan antes que el precalentamiento y el
+trabajo en lote, y el ping de keepalive nunca espera (si el modelo está ocupado ya está cargado).
+Con la cola llena se responde 429 y si la espera supera ADMISSION_WAIT_TIMEOUT, 503; ambos con
+Retry-After estimado a partir del tiempo de servicio observado. Un request de más prioridad que llega
+con la cola llena desplaza al de menor prioridad en espera.
+
+El controlador vive en cada proceso. Con varios workers de uvicorn los límites y la cola configurados
+son totales y se reparten entre ADMISSION_WORKERS (por defecto WEB_CONCURRENCY): cada worker admite
+su parte. Las prioridades y el desplazamiento se aplican dentro de cada worker.
+"""
+import os
+import math
+import time
+import heapq
+import asyncio
+import itertools
+
+from context_packer import parse_map
+from metrics import metrics
+
+# Generaciones simultáneas por modelo; OLLAMA_MODEL_LIMITS="qwen2.5:1.5b=4,deepseek-r1:14b=1"
+OLLAMA_MODEL_CONCURRENCY = int(os.getenv("OLLAMA_MODEL_CONCURRENCY", "2"))
+OLLAMA_MODEL_LIMITS = os.getenv("OLLAMA_MODEL_LIMITS", "")
+ADMISSION_QUEUE_MAX = int(os.getenv("ADMISSION_QUEUE_MAX", "32"))  # requests en espera por modelo
+ADMISSION_WAIT_TIMEOUT = float(os.getenv("ADMISSION_WAIT_TIMEOUT", "30"))  # segundos
+# Procesos entre los que se reparten límites y cola (uvicorn toma --workers de WEB_CONCURRENCY)
+ADMISSION_WORKERS = max(1, int(os.getenv("ADMISSION_WORKERS", os.getenv("WEB_CONCURRENCY", "1"))))
+
+# Menor número = más prioridad
+PRIORITY_CHAT = 0
+PRIORITY_BACKGROUND = 1  # precalentamiento, lotes
+PRIORITY_KEEPALIVE = 2  # nunca espera en la cola
+
+_limits = {k: int(v) for k, v in parse_map(OLLAMA_MODEL_LIMITS).items()}
+
+metrics.describe("admission_wait_seconds", "histogram", "Espera en la cola de admisión de Ollama")
+metrics.describe("admission_rejected_total", "counter", "Requests rechazados por la admisión de Ollama")
+
+
+class AdmissionRejected(Exception):
+    """Sin lugar para el request: status_code 429 (cola llena) o 503 (espera agotada, desplazado)."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+    def headers(self) -> dict:
+        return {"Retry-After": str(self.retry_after)}
+
+
+class _Gate:
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self.active = 0
+        self.waiters: list = []  # heap de (prioridad, orden, future)
+        self.admitted = 0
+        self.rejected: dict[str, int] = {"queue_full": 0, "timeout": 0, "displaced": 0, "busy": 0}
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.service_avg: float | None = None  # EWMA de segundos por generación
+
+    def queued(self) -> int:
+        return sum(1 for _, _, fut in self.waiters if not fut.done())
+
+
+def per_worker(total: int, workers: int) -> int:
+    """Parte de un límite total que le toca a cada worker (al menos 1)."""
+    return max(1, total // max(1, workers))
+
+
+class AdmissionController:
+    def __init__(self, default_limit: int = OLLAMA_MODEL_CONCURRENCY, limits: dict[str, int] | None = None,
+                 queue_max: int = ADMISSION_QUEUE_MAX, wait_timeout: float = ADMISSION_WAIT_TIMEOUT,
+                 workers: int = ADMISSION_WORKERS):
+        self.workers = max(1, workers)
+        if self.workers > 1 and default_limit < self.workers:
+            print(f"[ADMISSION] OLLAMA_MODEL_CONCURRENCY={default_limit} es menor que los {self.workers} workers: "
+                  f"cada uno admite 1 generación ({self.workers} en total)")
+        self.default_limit = per_worker(default_limit, self.workers)
+        self.limits = {m: per_worker(n, self.workers) for m, n in (_limits if limits is None else limits).items()}
+        self.queue_max = math.ceil(max(0, queue_max) / self.workers)
+        self.wait_timeout = wait_timeout
+        self._gates: dict[str, _Gate] = {}
+        self._order = itertools.count()
+
+    def _gate(self, model: str) -> _Gate:
+        gate = self._gates.get(model)
+        if gate is None:
+            gate = self._gates[model] = _Gate(self.limits.get(model, self.default_limit))
+        return gate
+
+    def retry_after(self, model: str) -> int:
+        """Segundos estimados hasta que se libere lugar para un request nuevo."""
+        gate = self._gate(model)
+        per_request = gate.service_avg or 5.0
+        return max(1, min(120, math.ceil((gate.queued() + 1) * per_request / gate.limit)))
+
+    def _reject(self, gate: _Gate, model: str, reason: str, status_code: int, detail: str) -> AdmissionRejected:
+        gate.rejected[reason] += 1
+        metrics.inc("admission_rejected_total", model=model, reason=reason)
+        return AdmissionRejected(status_code, detail, self.retry_after(model))
+
+    def precheck(self, model: str, priority: int = PRIORITY_CHAT):
+        """Falla rápido (antes de recuperar contexto) si el request no tendría lugar en la cola."""
+        gate = self._gate(model)
+        if gate.active < gate.limit or gate.queued() < self.queue_max:
+            return
+        if any(p > priority for p, _, fut in gate.waiters if not fut.done()):
+            return  # desplazaría a uno de menor prioridad
+        raise self._reject(gate, model, "queue_full", 429, f"Demasiadas consultas en espera para {model}")
+
+    async def acquire(self, model: str, priority: int = PRIORITY_CHAT, timeout: float | None = None):
+        """Espera un lugar para generar con `model`; devuelve la función que lo libera."""
+        gate = self._gate(model)
+        start = time.perf_counter()
+        if gate.active < gate.limit and not gate.queued():
+            gate.active += 1
+            return self._admitted(gate, model, start)
+        if priority >= PRIORITY_KEEPALIVE:
+            raise self._reject(gate, model, "busy", 503, f"{model} ocupado")
+        if gate.queued() >= self.queue_max:
+            pending = [w for w in gate.waiters if not w[2].done()]
+            worst = max(pending, key=lambda w: (w[0], w[1]), default=None)
+            if worst is None or worst[0] <= priority:
+                raise self._reject(gate, model, "queue_full", 429, f"Demasiadas consultas en espera para {model}")
+            worst[2].set_exception(self._reject(gate, model, "displaced", 503,
+                                                f"Desplazado por consultas de mayor prioridad para {model}"))
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(gate.waiters, (priority, next(self._order), fut))
+        try:
+            await asyncio.wait_for(fut, self.wait_timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            raise self._reject(gate, model, "timeout", 503, f"Tiempo de espera agotado para {model}") from None
+        except BaseException:
+            # Si el lugar se otorgó justo mientras se cancelaba, se devuelve
+            if fut.done() and not fut.cancelled() and fut.exception() is None:
+                self._release(gate)
+            raise
+        return self._admitted(gate, model, start)
+
+    def _admitted(self, gate: _Gate, model: str, start: float):
+        waited = time.perf_counter() - start
+        gate.admitted += 1
+        gate.wait_total += waited
+        gate.wait_max = max(gate.wait_max, waited)
+        metrics.observe("admission_wait_seconds", waited, model=model)
+        granted = time.perf_counter()
+        released = False
+
+        def release():
+            nonlocal released
+            if released:
+                return
+            released = True
+            elapsed = time.perf_counter() - granted
+            gate.service_avg = elapsed if gate.service_avg is None else 0.8 * gate.service_avg + 0.2 * elapsed
+            self._release(gate)
+        return release
+
+    def _release(self, gate: _Gate):
+        gate.active -= 1
+        while gate.waiters and gate.active < gate.limit:
+            _, _, fut = heapq.heappop(gate.waiters)
+            if fut.done():
+                continue  # expiró, fue cancelado o desplazado
+            gate.active += 1
+            fut.set_result(True)
+
+    def stats(self) -> dict:
+        models = {}
+        for model, gate in self._gates.items():
+            models[model] = {
+                "limit": gate.limit,
+                "active": gate.active,
+                "queued": gate.queued(),
+                "admitted": gate.admitted,
+                "rejected": dict(gate.rejected),
+                "avg_wait_ms": round(gate.wait_total * 1000 / max(1, gate.admitted), 2),
+                "max_wait_ms": round(gate.wait_max * 1000, 2),
+                "avg_service_ms": round(gate.service_avg * 1000, 1) if gate.service_avg is not None else None,
+                "retry_after": self.retry_after(model),
+            }
+        return {"workers": self.workers, "default_limit": self.default_limit, "queue_max": self.queue_max,
+                "wait_timeout": self.wait_timeout, "models": models}
+
+
+admission = AdmissionController()
@@ -0,0 +1,155 @@
+"""Caché de respuestas de /chat por versión del corpus de cada sesión.
+
+Una respuesta se reutiliza si coinciden modelo, answer_mode, locale y versión de los documentos de
+la sesión, y además la pregunta normalizada es idéntica o su embedding supera un umbral de similitud
+con el de una pregunta ya respondida. Subir o eliminar documentos incrementa la versión de la
+sesión, con lo que sus entradas dejan de ser alcanzables. Expulsión por TTL y LRU.
+
+La búsqueda por similitud solo mira el bucket de la consulta: los embeddings de cada bucket se apilan
+en una matriz (que se rearma cuando el bucket cambia) y se comparan con un único producto.
+"""
+import os
+import re
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+ANSWER_CACHE_MAX = int(os.getenv("ANSWER_CACHE_MAX", "2000"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))  # segundos
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+
+
+def normalize_question(text: str) -> str:
+    # Sin tildes ni signos: "¿Qué servicios?" y "que servicios" son la misma pregunta
+    text = unicodedata.normalize("NFD", (text or "").lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+class AnswerCache:
+    def __init__(self, max_entries: int = ANSWER_CACHE_MAX, ttl: float = ANSWER_CACHE_TTL,
+                 similarity: float = ANSWER_CACHE_SIMILARITY, enabled: bool = ANSWER_CACHE_ENABLED):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        # (bucket, pregunta normalizada) -> (expira, embedding, respuesta)
+        self._entries: OrderedDict[tuple, tuple[float, list[float] | None, str]] = OrderedDict()
+        self._versions: dict[str, int] = {}
+        # bucket -> {clave: embedding} y bucket -> (claves, matriz) armada en la última búsqueda
+        self._buckets: dict[tuple, dict[tuple, np.ndarray]] = {}
+        self._matrices: dict[tuple, tuple[list, np.ndarray]] = {}
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def version(self, session_id: str) -> int:
+        return self._versions.get(session_id, 0)
+
+    def invalidate(self, session_id: str):
+        """Marca un cambio en los documentos de la sesión; sus respuestas previas dejan de usarse."""
+        with self._lock:
+            self._versions[session_id] = self._versions.get(session_id, 0) + 1
+            stale = [k for k in self._entries if k[0][0] == session_id]
+            for k in stale:
+                self._drop(k)
+
+    def _bucket(self, session_id: str, model: str, answer_mode: str, locale: str, version: int | None = None) -> tuple:
+        return (session_id, self.version(session_id) if version is None else version, model, answer_mode, locale)
+
+    def get(self, session_id: str, model: str, answer_mode: str, locale: str, question: str,
+            embedding: list[float] | None = None) -> str | None:
+        """Busca por pregunta exacta y, si se pasa `embedding`, por similitud dentro del mismo bucket."""
+        if not self.enabled:
+            return None
+        bucket = self._bucket(session_id, model, answer_mode, locale)
+        key = (bucket, normalize_question(question))
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry[2]
+            if embedding is not None:
+                best_key = None
+                keys, matrix = self._matrix(bucket)
+                if keys:
+                    scores = matrix @ np.asarray(embedding, dtype=np.float32)
+                    for i in np.argsort(-scores):
+                        if scores[i] < self.similarity:
+                            break
+                        if self._entries[keys[i]][0] > now:
+                            best_key = keys[i]
+                            break
+                if best_key is not None:
+                    self._entries.move_to_end(best_key)
+                    self.semantic_hits += 1
+                    return self._entries[best_key][2]
+                # Solo cuenta como fallo la búsqueda completa (la exacta previa se reintenta con embedding)
+                self.misses += 1
+        return None
+
+    def put(self, session_id: str, model: str, answer_mode: str, locale: str, question: str,
+            answer: str, embedding: list[float] | None = None, version: int | None = None):
+        """Guarda una respuesta. `version` es la del corpus al iniciar la consulta: si los documentos
+        cambiaron mientras se generaba, la respuesta queda en un bucket ya obsoleto."""
+        if not self.enabled or not answer:
+            return
+        key = (self._bucket(session_id, model, answer_mode, locale, version), normalize_question(question))
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (time.time() + self.ttl, embedding, answer)
+            if embedding is not None:
+                self._buckets.setdefault(key[0], {})[key] = np.asarray(embedding, dtype=np.float32)
+                self._matrices.pop(key[0], None)
+            self._evict()
+
+    def _matrix(self, bucket: tuple) -> tuple[list, np.ndarray | None]:
+        cached = self._matrices.get(bucket)
+        if cached is None:
+            vectors = self._buckets.get(bucket)
+            if not vectors:
+                return [], None
+            cached = self._matrices[bucket] = (list(vectors), np.stack(list(vectors.values())))
+        return cached
+
+    def _drop(self, key: tuple):
+        if self._entries.pop(key, None) is None:
+            return
+        vectors = self._buckets.get(key[0])
+        if vectors is not None and vectors.pop(key, None) is not None:
+            self._matrices.pop(key[0], None)
+            if not vectors:
+                del self._buckets[key[0]]
+
+    def _evict(self):
+        now = time.time()
+        expired = [k for k, (expires, _, _) in self._entries.items() if expires <= now]
+        for k in expired:
+            self._drop(k)
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+
+    def stats(self) -> dict:
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "similarity_threshold": self.similarity,
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.exact_hits + self.semantic_hits) / lookups, 3) if lookups else 0.0,
+        }
+
+
+answer_cache = AnswerCache()
@@ -0,0 +1,4 @@
+"""Benchmarks y pruebas de carga del servicio (ver bench/run.py).
+
+Se ejecutan desde api/:  python -m bench.run all
+"""
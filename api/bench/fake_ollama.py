@@ -0,0 +1,149 @@
+"""Servidor que imita a Ollama para pruebas de carga sin GPU ni modelos.
+
+Implementa /api/chat (con y sin stream), /api/generate sin prompt (carga o descarga con keep_alive),
+/api/tags y /api/ps. El tiempo de respuesta se arma con
+tasas configurables: evaluación del prompt (tokens/s, estimando 4 caracteres por token), generación
+(tokens/s) y carga del modelo en el primer uso. --parallel emula OLLAMA_NUM_PARALLEL: los requests
+que exceden ese número esperan su turno, como en Ollama.
+
+    python -m bench.fake_ollama --port 11500 --token-rate 30 --prompt-rate 400 --parallel 1
+"""
+import json
+import time
+import random
+import asyncio
+import argparse
+from datetime import datetime, timezone
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+ANSWER_WORDS = "según el manual el procedimiento indica revisar el equipo registrar la orden y aplicar las medidas de seguridad".split()
+
+
+def create_app(models: list[str], token_rate: float, prompt_rate: float, answer_tokens: int,
+               load_ms: float, parallel: int) -> FastAPI:
+    app = FastAPI(title="Fake Ollama")
+    slots = asyncio.Semaphore(max(1, parallel))
+    loaded: dict[str, float] = {}  # modelo -> expiración (timestamp)
+    stats = {"requests": 0, "streamed": 0, "prompt_tokens": 0, "generated_tokens": 0, "loads": 0}
+
+    def keep_alive_seconds(value) -> float:
+        # Ollama acepta segundos o duraciones como "30m"; por defecto 5 minutos
+        if value is None:
+            return 300.0
+        if isinstance(value, (int, float)):
+            return float(value)
+        units = {"s": 1, "m": 60, "h": 3600}
+        return float(value[:-1]) * units[value[-1]] if value[-1] in units else float(value)
+
+    async def load(model: str, keep_alive) -> None:
+        if (model not in loaded or loaded[model] < time.time()) and load_ms:
+            stats["loads"] += 1
+            await asyncio.sleep(load_ms / 1000)
+        loaded[model] = time.time() + keep_alive_seconds(keep_alive)
+
+    async def prepare(model: str, messages: list[dict], keep_alive=None) -> tuple[int, float]:
+        """Simula carga del modelo y evaluación del prompt; devuelve (tokens del prompt, segundos)."""
+        start = time.perf_counter()
+        await load(model, keep_alive)
+        prompt_tokens = max(1, sum(len(m.get("content") or "") for m in messages) // 4)
+        await asyncio.sleep(prompt_tokens / prompt_rate)
+        stats["prompt_tokens"] += prompt_tokens
+        return prompt_tokens, time.perf_counter() - start
+
+    def pieces(n: int, seed: int) -> list[str]:
+        rng = random.Random(seed)
+        return [("" if i == 0 else " ") + rng.choice(ANSWER_WORDS) for i in range(n)]
+
+    def final(model: str, prompt_tokens: int, prompt_s: float, eval_count: int, eval_s: float) -> dict:
+        return {
+            "model": model, "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), "done": True,
+            "done_reason": "stop", "total_duration": int((prompt_s + eval_s) * 1e9),
+            "prompt_eval_count": prompt_tokens, "prompt_eval_duration": int(prompt_s * 1e9),
+            "eval_count": eval_count, "eval_duration": int(eval_s * 1e9),
+        }
+
+    @app.post("/api/chat")
+    async def chat(request: Request):
+        body = await request.json()
+        model = body.get("model") or models[0]
+        messages = body.get("messages") or []
+        n_tokens = int((body.get("options") or {}).get("num_predict") or answer_tokens)
+        n_tokens = min(n_tokens, answer_tokens)
+        words = pieces(n_tokens, hash(json.dumps(messages[-1:], sort_keys=True)))
+        stats["requests"] += 1
+        # Ollama usa stream=true si no se indica
+        if not body.get("stream", True):
+            async with slots:
+                prompt_tokens, prompt_s = await prepare(model, messages, body.get("keep_alive"))
+                eval_s = n_tokens / token_rate
+                await asyncio.sleep(eval_s)
+            stats["generated_tokens"] += n_tokens
+            return JSONResponse({**final(model, prompt_tokens, prompt_s, n_tokens, eval_s),
+                                 "message": {"role": "assistant", "content": "".join(words)}})
+
+        async def generate():
+            async with slots:
+                prompt_tokens, prompt_s = await prepare(model, messages, body.get("keep_alive"))
+                start = time.perf_counter()
+                for piece in words:
+                    await asyncio.sleep(1 / token_rate)
+                    stats["generated_tokens"] += 1
+                    yield json.dumps({"model": model, "message": {"role": "assistant", "content": piece}, "done": False}) + "\n"
+                yield json.dumps(final(model, prompt_tokens, prompt_s, len(words), time.perf_counter() - start)) + "\n"
+
+        stats["streamed"] += 1
+        return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+    @app.post("/api/generate")
+    async def generate_endpoint(request: Request):
+        # Solo el caso sin prompt: cargar el modelo, o descargarlo con keep_alive 0
+        body = await request.json()
+        model = body.get("model") or models[0]
+        if keep_alive_seconds(body.get("keep_alive")) <= 0:
+            loaded.pop(model, None)
+            return {"model": model, "response": "", "done": True, "done_reason": "unload"}
+        start = time.perf_counter()
+        async with slots:
+            await load(model, body.get("keep_alive"))
+        return {"model": model, "response": "", "done": True, "done_reason": "load",
+                "load_duration": int((time.perf_counter() - start) * 1e9)}
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": [{"name": m, "model": m, "size": 0, "details": {"family": "fake"}} for m in models]}
+
+    @app.get("/api/ps")
+    async def ps():
+        now = time.time()
+        return {"models": [{"name": m, "model": m, "size": 0, "size_vram": 0,
+                            "expires_at": datetime.fromtimestamp(exp, timezone.utc).isoformat()}
+                           for m, exp in loaded.items() if exp > now]}
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--models", default="qwen2.5:1.5b", help="lista separada por comas")
+    parser.add_argument("--token-rate", type=float, default=30.0, help="tokens generados por segundo")
+    parser.add_argument("--prompt-rate", type=float, default=400.0, help="tokens de prompt evaluados por segundo")
+    parser.add_argument("--answer-tokens", type=int, default=60)
+    parser.add_argument("--load-ms", type=float, default=0.0, help="demora de carga del modelo en el primer uso")
+    parser.add_argument("--parallel", type=int, default=1, help="requests atendidos en paralelo (OLLAMA_NUM_PARALLEL)")
+    args = parser.parse_args(argv)
+    import uvicorn
+    app = create_app([m.strip() for m in args.models.split(",") if m.strip()], args.token_rate, args.prompt_rate,
+                     args.answer_tokens, args.load_ms, args.parallel)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""PDFs de prueba con texto en español, generados sin dependencias extra.
+
+Escribe un PDF 1.4 mínimo (Helvetica, WinAnsiEncoding) que pypdf puede extraer. El contenido es
+pseudoaleatorio pero reproducible (semilla) e incluye códigos de producto y números, para que
+también ejercite el índice BM25.
+"""
+import random
+
+WORDS = """
+el sistema permite registrar solicitudes de mantenimiento preventivo y correctivo para cada equipo
+de la planta los técnicos revisan el estado de las bombas compresores válvulas y tableros eléctricos
+según el manual del fabricante cada procedimiento indica herramientas necesarias tiempos estimados
+riesgos asociados y medidas de seguridad el supervisor aprueba la orden de trabajo y registra los
+repuestos utilizados en el inventario la garantía cubre defectos de fabricación durante el primer año
+de operación siempre que se respeten las condiciones de instalación y uso indicadas en este documento
+""".split()
+
+LINES_PER_PAGE = 40
+WORDS_PER_LINE = 12
+
+
+def _escape(text: str) -> bytes:
+    raw = text.encode("cp1252", errors="replace")
+    return raw.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+
+def page_lines(rng: random.Random, page_no: int) -> list[str]:
+    lines = [f"Sección {page_no}. Procedimiento PR-{page_no:04d}"]
+    capitalize = True
+    for _ in range(LINES_PER_PAGE - 1):
+        words = [rng.choice(WORDS) for _ in range(WORDS_PER_LINE)]
+        if capitalize:
+            words[0] = words[0].capitalize()
+        if rng.random() < 0.2:
+            words.insert(rng.randrange(len(words)), f"EQ-{rng.randint(100, 999)}")
+        if rng.random() < 0.1:
+            words.append(f"{rng.randint(1, 500)} kg")
+        # Oraciones de largo variable, para que el fragmentado por oraciones tenga dónde cortar
+        capitalize = rng.random() < 0.4
+        if capitalize:
+            words[-1] += "."
+        lines.append(" ".join(words))
+    return lines
+
+
+def write_pdf(path: str, pages: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    objects: list[bytes] = []
+    # 1: catálogo, 2: árbol de páginas, 3: fuente; luego (página, contenido) por cada página
+    page_ids = [4 + 2 * i for i in range(pages)]
+    objects.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+    kids = " ".join(f"{pid} 0 R" for pid in page_ids).encode()
+    objects.append(b"<< /Type /Pages /Kids [" + kids + b"] /Count " + str(pages).encode() + b" >>")
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+    for i in range(pages):
+        content = [b"BT /F1 10 Tf 14 TL 50 800 Td"]
+        for line in page_lines(rng, i + 1):
+            content.append(b"(" + _escape(line) + b") Tj T*")
+        content.append(b"ET")
+        stream = b"\n".join(content)
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> "
+            f"/Contents {page_ids[i] + 1} 0 R >>".encode()
+        )
+        objects.append(b"<< /Length " + str(len(stream)).encode() + b" >>\nstream\n" + stream + b"\nendstream")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for n, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{n} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for off in offsets:
+        out += f"{off:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    with open(path, "wb") as fh:
+        fh.write(out)
+    return path
+
+
+def sample_questions(n: int, seed: int = 1) -> list[str]:
+    rng = random.Random(seed)
+    templates = [
+        "¿Qué dice el procedimiento PR-{p:04d} sobre {w}?",
+        "¿Cómo se registra {w} en la orden de trabajo?",
+        "¿Cuál es la garantía del equipo EQ-{e}?",
+        "Resumen de {w} y {w2} según el manual",
+    ]
+    # Sin repetidas, para que ninguna se sirva desde una caché
+    questions: dict[str, None] = {}
+    while len(questions) < n:
+        q = rng.choice(templates).format(p=rng.randint(1, 50), e=rng.randint(100, 999), w=rng.choice(WORDS), w2=rng.choice(WORDS))
+        questions[q] = None
+    return list(questions)
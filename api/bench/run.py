@@ -0,0 +1,406 @@
+"""Suite de benchmarks del servicio con resultados en JSON para comparar entre commits.
+
+    python -m bench.run ingest --pages 5,25,100
+    python -m bench.run retrieval --corpus 500,2000 --queries 50
+    python -m bench.run chat --concurrency 1,4,16 --requests 40
+    python -m bench.run chunking --pages 5,25,100
+    python -m bench.run all
+    python -m bench.run compare bench/results/antes.json bench/results/despues.json
+
+- ingest: tiempo y throughput de cada etapa (pdf_to_text, chunk, embeddings, escritura en Chroma)
+  sobre PDFs generados de distinto tamaño.
+- retrieval: percentiles de latencia de query_relevant (embedding + búsqueda híbrida) y de
+  query_by_embedding (solo el almacén) para distintos tamaños de corpus.
+- chunking: rag.chunk (texto completo), rag.iter_chunks (ventanas de palabras en streaming) y
+  chunker.iter_token_chunks (tokens y oraciones): tiempo, memoria pico, tokens por fragmento,
+  fragmentos que exceden el largo máximo del modelo y fragmentos que terminan en fin de oración.
+- chat: levanta bench.fake_ollama y la API con uvicorn, sube un PDF y mide latencia y throughput
+  de /chat y /chat/stream (tiempo al primer byte) con distintos niveles de concurrencia.
+
+Todo se guarda en un directorio temporal (CHROMA_DIR, UPLOAD_DIR y bases SQLite propias), sin tocar
+storage/. Ejecutar desde api/.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+
+from bench.pdfgen import write_pdf, page_lines, sample_questions
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(API_DIR, "bench", "results")
+
+
+def percentiles(values: list[float]) -> dict:
+    """Resumen en milisegundos de una lista de duraciones en segundos."""
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def pct(p):
+        return round(ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] * 1000, 2)
+
+    return {"p50_ms": pct(50), "p90_ms": pct(90), "p99_ms": pct(99),
+            "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2), "max_ms": round(ordered[-1] * 1000, 2)}
+
+
+def _storage_env(workdir: str) -> dict:
+    """Variables de entorno para que rag, la caché, el índice BM25 y los jobs usen `workdir`."""
+    return {
+        "CHROMA_DIR": os.path.join(workdir, "vectordb"),
+        "UPLOAD_DIR": os.path.join(workdir, "uploads"),
+        "EMBED_CACHE_DB": os.path.join(workdir, "embeddings.db"),
+        "LEXICAL_DB": os.path.join(workdir, "lexical.db"),
+        "JOBS_DB": os.path.join(workdir, "jobs.db"),
+    }
+
+
+def _git_commit() -> str | None:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=API_DIR, capture_output=True, text=True, timeout=10)
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bench_ingest(args, workdir: str) -> list[dict]:
+    import rag
+    rows = []
+    for pages in args.pages:
+        path = write_pdf(os.path.join(workdir, f"bench_{pages}p.pdf"), pages, seed=pages)
+        text, t_extract = _timed(rag.pdf_to_text, path)
+        chunks, t_chunk = _timed(rag.chunk, text, 150, 30)
+        # Sin pasar por la caché de embeddings: se mide el modelo
+        embs, t_embed = [], 0.0
+        for i in range(0, len(chunks), rag.EMBED_BATCH):
+            part, t = _timed(rag._encode, chunks[i:i + rag.EMBED_BATCH])
+            embs.extend(part)
+            t_embed += t
+        collection = rag.get_partitions().get(f"bench-ingest-{pages}", create=True)
+        ids = [f"bench_{pages}_{i}" for i in range(len(chunks))]
+        metas = [{"client_id": f"bench-ingest-{pages}", "source": os.path.basename(path), "chunk": i} for i in range(len(chunks))]
+        t_store = 0.0
+        for i in range(0, len(chunks), rag.EMBED_BATCH):
+            sl = slice(i, i + rag.EMBED_BATCH)
+            _, t = _timed(collection.upsert, documents=chunks[sl], embeddings=embs[sl], metadatas=metas[sl], ids=ids[sl])
+            t_store += t
+        total = t_extract + t_chunk + t_embed + t_store
+        row = {
+            "label": f"pages={pages}", "pages": pages, "chunks": len(chunks),
+            "pdf_to_text_s": round(t_extract, 3), "chunk_s": round(t_chunk, 3),
+            "embed_s": round(t_embed, 3), "chroma_add_s": round(t_store, 3), "total_s": round(total, 3),
+            "pages_per_sec": round(pages / t_extract, 2) if t_extract else None,
+            "chunks_per_sec_embed": round(len(chunks) / t_embed, 2) if t_embed else None,
+            "chunks_per_sec_total": round(len(chunks) / total, 2) if total else None,
+        }
+        print(json.dumps(row, ensure_ascii=False))
+        rows.append(row)
+    return rows
+
+
+def _synthetic_chunks(n: int, seed: int) -> list[str]:
+    import random
+    import rag
+    rng = random.Random(seed)
+    texts, page = [], 0
+    while len(texts) < n:
+        page += 1
+        texts.extend(t for t, _ in rag.iter_chunks([(page, " ".join(page_lines(rng, page)))], size=150, overlap=30))
+    return texts[:n]
+
+
+def bench_retrieval(args) -> list[dict]:
+    import rag
+    from lexical_index import lexical_index
+    rows = []
+    for size in args.corpus:
+        # Preguntas distintas por corpus: las repetidas se responderían desde la caché de embeddings
+        questions = sample_questions(args.queries, seed=size)
+        session = f"bench-retrieval-{size}"
+        texts = _synthetic_chunks(size, seed=size)
+        collection = rag.get_partitions().get(session, create=True)
+        start = time.perf_counter()
+        for i in range(0, len(texts), rag.EMBED_BATCH):
+            part = texts[i:i + rag.EMBED_BATCH]
+            ids = [f"{session}_{i + j}" for j in range(len(part))]
+            collection.upsert(documents=part, embeddings=rag._embed(part), ids=ids,
+                              metadatas=[{"client_id": session, "source": "synthetic.pdf", "chunk": i + j} for j in range(len(part))])
+            lexical_index.add(session, "synthetic.pdf", list(zip(ids, part)))
+        build_s = time.perf_counter() - start
+        for q in sample_questions(3, seed=-size):  # calentamiento
+            rag.query_relevant(q, session, top_k=6)
+        full, store = [], []
+        for q in questions:
+            _, t = _timed(rag.query_relevant, q, session, top_k=6)
+            full.append(t)
+        for q, emb in zip(questions, rag._embed(questions)):
+            _, t = _timed(rag.query_by_embedding, emb, session, top_k=6, question=q)
+            store.append(t)
+        row = {"label": f"corpus={size}", "corpus_chunks": size, "queries": len(questions), "build_s": round(build_s, 2),
+               "query_relevant": percentiles(full), "query_by_embedding": percentiles(store)}
+        print(json.dumps(row, ensure_ascii=False))
+        rows.append(row)
+    return rows
+
+
+def bench_chunking(args) -> list[dict]:
+    import random
+    import tracemalloc
+    import rag
+    from chunker import iter_token_chunks, CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS
+    count = rag.token_counter()
+    embedder = rag.get_embedder()
+    max_seq = getattr(embedder, "max_seq_length", None) or 384
+    strategies = {
+        "chunk": lambda pages: rag.chunk("\n".join(t for _, t in pages), 150, 30),
+        "iter_chunks": lambda pages: [t for t, _ in rag.iter_chunks(iter(pages), size=150, overlap=30)],
+        "token_chunks": lambda pages: [t for t, _ in iter_token_chunks(iter(pages), CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS, count=count)],
+    }
+    rows = []
+    for n_pages in args.pages:
+        rng = random.Random(n_pages)
+        pages = [(p, "\n".join(page_lines(rng, p))) for p in range(1, n_pages + 1)]
+        for name, fn in strategies.items():
+            tracemalloc.start()
+            start = time.perf_counter()
+            chunks = fn(pages)
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            tokens = count(chunks)
+            row = {
+                "label": f"{name} pages={n_pages}", "strategy": name, "pages": n_pages, "chunks": len(chunks),
+                "seconds": round(elapsed, 4), "peak_kb": round(peak / 1024, 1),
+                "tokens_mean": round(sum(tokens) / len(tokens), 1) if tokens else 0,
+                "tokens_max": max(tokens, default=0),
+                "over_model_limit": sum(1 for t in tokens if t > max_seq),
+                "sentence_end_pct": round(100 * sum(1 for c in chunks if c.rstrip().endswith((".", "!", "?"))) / max(1, len(chunks)), 1),
+            }
+            print(json.dumps(row, ensure_ascii=False))
+            rows.append(row)
+    return rows
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _wait_http(client, url: str, timeout: float, ok=(200,)):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            r = await client.get(url)
+            if r.status_code in ok:
+                return r
+        except Exception:
+            pass
+        await asyncio.sleep(0.5)
+    raise TimeoutError(f"{url} no respondió en {timeout}s")
+
+
+async def _load(client, url: str, payloads: list[dict], concurrency: int, stream: bool) -> dict:
+    queue = list(payloads)
+    latencies, first_bytes, errors = [], [], 0
+
+    async def worker():
+        nonlocal errors
+        while queue:
+            payload = queue.pop()
+            start = time.perf_counter()
+            try:
+                if stream:
+                    async with client.stream("POST", url, json=payload) as r:
+                        first = None
+                        async for _ in r.aiter_bytes():
+                            if first is None:
+                                first = time.perf_counter() - start
+                        if r.status_code != 200:
+                            errors += 1
+                            continue
+                        first_bytes.append(first or 0.0)
+                else:
+                    r = await client.post(url, json=payload)
+                    if r.status_code != 200:
+                        errors += 1
+                        continue
+                latencies.append(time.perf_counter() - start)
+            except Exception:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - start
+    out = {"requests": len(payloads), "errors": errors, "wall_s": round(wall, 2),
+           "throughput_rps": round(len(latencies) / wall, 3) if wall else None, "latency": percentiles(latencies)}
+    if stream:
+        out["first_byte"] = percentiles(first_bytes)
+    return out
+
+
+async def _bench_chat(args, workdir: str) -> dict:
+    import httpx
+    fake_port, api_port = _free_port(), _free_port()
+    logs = open(os.path.join(workdir, "servers.log"), "w", encoding="utf-8")
+    fake = subprocess.Popen(
+        [sys.executable, "-m", "bench.fake_ollama", "--port", str(fake_port), "--models", args.model,
+         "--token-rate", str(args.token_rate), "--prompt-rate", str(args.prompt_rate),
+         "--answer-tokens", str(args.answer_tokens), "--parallel", str(args.ollama_parallel)],
+        cwd=API_DIR, stdout=logs, stderr=subprocess.STDOUT,
+    )
+    # La API usa su propio almacén: Chroma no admite dos procesos sobre el mismo directorio
+    api_env = {**os.environ, **_storage_env(os.path.join(workdir, "api")), "OLLAMA_URL": f"http://127.0.0.1:{fake_port}", "MODEL_NAME": args.model,
+               "MODEL_KEEPALIVE_ENABLED": "false", "ANSWER_CACHE_ENABLED": "false"}
+    api = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(api_port), "--log-level", "warning"],
+        cwd=API_DIR, env=api_env, stdout=logs, stderr=subprocess.STDOUT,
+    )
+    base = f"http://127.0.0.1:{api_port}"
+    try:
+        async with httpx.AsyncClient(timeout=600) as client:
+            await _wait_http(client, f"http://127.0.0.1:{fake_port}/api/tags", 60)
+            await _wait_http(client, f"{base}/health", 120)
+            ready_start = time.perf_counter()
+            await _wait_http(client, f"{base}/ready", 900)
+            ready_s = time.perf_counter() - ready_start
+
+            # Ingesta de punta a punta por la API (subida + job en background)
+            path = write_pdf(os.path.join(workdir, "bench_chat.pdf"), args.chat_pages, seed=7)
+            start = time.perf_counter()
+            with open(path, "rb") as fh:
+                r = await client.post(f"{base}/upload_pdf", data={"session_id": "bench"},
+                                      files={"file": ("bench_chat.pdf", fh, "application/pdf")})
+            r.raise_for_status()
+            job_id = r.json().get("job_id")
+            while job_id:
+                job = (await client.get(f"{base}/jobs/{job_id}")).json()
+                if job.get("status") in ("done", "failed"):
+                    break
+                await asyncio.sleep(0.5)
+            ingest_s = time.perf_counter() - start
+
+            results = {"ready_wait_s": round(ready_s, 2), "upload_ingest_s": round(ingest_s, 2),
+                       "pages": args.chat_pages, "runs": []}
+            questions = sample_questions(args.requests, seed=3)
+            payloads = [{"message": q, "session_id": "bench", "model": args.model, "use_cache": False} for q in questions]
+            for c in args.concurrency:
+                for endpoint, stream in (("/chat", False), ("/chat/stream", True)):
+                    row = {"label": f"{endpoint} c={c}", "endpoint": endpoint, "concurrency": c,
+                           **await _load(client, base + endpoint, payloads, c, stream)}
+                    print(json.dumps(row, ensure_ascii=False))
+                    results["runs"].append(row)
+            return results
+    finally:
+        for proc in (api, fake):
+            proc.terminate()
+            try:
+                proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        logs.close()
+
+
+def _flatten(report: dict) -> dict[str, float]:
+    out = {}
+
+    def walk(prefix, value):
+        if isinstance(value, dict):
+            for k, v in value.items():
+                walk(f"{prefix}.{k}" if prefix else k, v)
+        elif isinstance(value, list):
+            for i, item in enumerate(value):
+                label = item.get("label", str(i)) if isinstance(item, dict) else str(i)
+                walk(f"{prefix}[{label}]", item)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            out[prefix] = value
+
+    walk("", {k: v for k, v in report.items() if k != "meta"})
+    return out
+
+
+def compare(args):
+    with open(args.before, encoding="utf-8") as fh:
+        before = _flatten(json.load(fh))
+    with open(args.after, encoding="utf-8") as fh:
+        after = _flatten(json.load(fh))
+    print(f"{'métrica':70} {'antes':>12} {'después':>12} {'cambio':>9}")
+    for key in sorted(set(before) & set(after)):
+        a, b = before[key], after[key]
+        delta = f"{(b - a) / a * 100:+.1f}%" if a else "-"
+        print(f"{key:70} {a:>12} {b:>12} {delta:>9}")
+
+
+def _ints(value: str) -> list[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("suite", choices=["ingest", "retrieval", "chunking", "chat", "all", "compare"])
+    parser.add_argument("files", nargs="*", help="para compare: reporte anterior y nuevo")
+    parser.add_argument("--out", help="archivo JSON de resultados (por defecto bench/results/<fecha>_<commit>.json)")
+    parser.add_argument("--workdir", help="directorio de datos (por defecto uno temporal)")
+    parser.add_argument("--pages", type=_ints, default=[5, 25, 100])
+    parser.add_argument("--corpus", type=_ints, default=[500, 2000])
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--concurrency", type=_ints, default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=40, help="requests por nivel de concurrencia")
+    parser.add_argument("--chat-pages", type=int, default=20)
+    parser.add_argument("--model", default="qwen2.5:1.5b")
+    parser.add_argument("--token-rate", type=float, default=30.0)
+    parser.add_argument("--prompt-rate", type=float, default=400.0)
+    parser.add_argument("--answer-tokens", type=int, default=60)
+    parser.add_argument("--ollama-parallel", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    if args.suite == "compare":
+        if len(args.files) != 2:
+            parser.error("compare necesita dos archivos")
+        args.before, args.after = args.files
+        return compare(args)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="ia-rag-bench-")
+    os.environ.update(_storage_env(workdir))
+    from embed_backends import EMBED_BACKEND
+    report = {"meta": {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "embed_model": os.getenv("EMBED_MODEL", "sentence-transformers/all-mpnet-base-v2"),
+        "embed_backend": EMBED_BACKEND,
+        "workdir": workdir,
+        "args": {k: v for k, v in vars(args).items() if k not in ("files", "out", "workdir")},
+    }}
+    if args.suite in ("ingest", "all"):
+        report["ingest"] = bench_ingest(args, workdir)
+    if args.suite in ("retrieval", "all"):
+        report["retrieval"] = bench_retrieval(args)
+    if args.suite in ("chunking", "all"):
+        report["chunking"] = bench_chunking(args)
+    if args.suite in ("chat", "all"):
+        report["chat"] = asyncio.run(_bench_chat(args, workdir))
+
+    out = args.out or os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}_{report['meta']['git_commit'] or 'nogit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, ensure_ascii=False, indent=2)
+    print(f"[BENCH] Resultados en {out}")
+
+
+if __name__ == "__main__":
+    main()
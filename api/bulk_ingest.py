@@ -0,0 +1,419 @@
+"""Ingesta masiva offline: indexa un directorio o un manifiesto sin pasar por la API.
+
+    python bulk_ingest.py DIRECTORIO --session ID --offline [--workers 4] [--batch 256]
+    python bulk_ingest.py manifiesto.jsonl --offline [--checkpoint storage/bulk_ingest.db] [--retry-failed]
+
+Un pool de procesos lee y fragmenta los archivos (PDF, .txt, .md) en paralelo; el proceso principal
+junta fragmentos de varios documentos en lotes grandes de embeddings (pasando por la caché de
+embeddings) e inserta en Chroma de a miles de fragmentos por llamada. Cada archivo se copia al
+directorio de subidas y se registra en el catálogo, igual que una subida por la API.
+
+El avance se guarda por archivo en un SQLite de checkpoint: al relanzar el mismo comando se omiten
+los archivos ya indexados (o duplicados) que no cambiaron, y un documento interrumpido a medias se
+reindexa con los mismos ids. Al final se informan páginas/s y fragmentos/s.
+
+Manifiesto: JSONL ({"path", "session_id", "original_filename"}), CSV con encabezado `path` (y
+opcionalmente `session_id`, `original_filename`) o una ruta por línea. Las rutas relativas se
+resuelven desde el directorio del manifiesto. Escribe Chroma y el índice BM25 desde este proceso,
+así que exige el backend detenido: sin --offline no arranca, y tampoco si el servicio de índice
+(INDEX_SERVICE_ADDRESS) responde.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import rag
+from doc_catalog import doc_catalog
+from chunker import CHUNK_STRATEGY, tokenizer_counter, estimate_counter
+
+BULK_WORKERS = int(os.getenv("BULK_WORKERS", "0"))  # 0 = núcleos disponibles
+BULK_EMBED_BATCH = int(os.getenv("BULK_EMBED_BATCH", "256"))
+BULK_INSERT_BATCH = int(os.getenv("BULK_INSERT_BATCH", "2048"))
+BULK_CHECKPOINT_DB = os.getenv("BULK_CHECKPOINT_DB", os.path.join(os.path.dirname(rag.CHROMA_DIR) or ".", "bulk_ingest.db"))
+EXTENSIONS = (".pdf", ".txt", ".md")
+
+
+def _cores() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# --- Entrada ---
+
+def load_entries(source: str, session_id: str) -> list[dict]:
+    """Archivos a indexar: [{"path", "session_id", "original_filename"}] desde un directorio o manifiesto."""
+    if os.path.isdir(source):
+        entries = []
+        for root, _, files in os.walk(source):
+            for name in sorted(files):
+                if name.lower().endswith(EXTENSIONS):
+                    entries.append({"path": os.path.join(root, name), "session_id": session_id, "original_filename": name})
+        return sorted(entries, key=lambda e: e["path"])
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, "r", encoding="utf-8") as fh:
+        if source.lower().endswith((".jsonl", ".json")):
+            rows = [json.loads(line) for line in fh if line.strip()]
+        elif source.lower().endswith(".csv"):
+            rows = list(csv.DictReader(fh))
+        else:
+            rows = [{"path": line.strip()} for line in fh if line.strip() and not line.startswith("#")]
+    entries = []
+    for row in rows:
+        path = os.path.join(base, row["path"])  # join conserva las rutas absolutas
+        entries.append({"path": path, "session_id": row.get("session_id") or session_id,
+                        "original_filename": row.get("original_filename") or os.path.basename(path)})
+    return entries
+
+
+# --- Checkpoint ---
+
+class Checkpoint:
+    """Estado por (archivo, sesión): pending (copiado, indexando), done, duplicate o failed."""
+
+    def __init__(self, db_path: str = BULK_CHECKPOINT_DB):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, timeout=10)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT NOT NULL,
+                session_id TEXT NOT NULL,
+                size_bytes INTEGER,
+                mtime REAL,
+                file_hash TEXT,
+                stored_name TEXT,
+                status TEXT NOT NULL,
+                pages INTEGER,
+                chunks INTEGER,
+                error TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (path, session_id)
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get(self, entry: dict) -> dict | None:
+        row = self._conn.execute("SELECT * FROM files WHERE path = ? AND session_id = ?",
+                                 (os.path.abspath(entry["path"]), entry["session_id"])).fetchone()
+        return dict(row) if row else None
+
+    def is_finished(self, entry: dict, retry_failed: bool = False) -> bool:
+        """Ya indexado (o duplicado, o fallido sin --retry-failed) y sin cambios desde entonces."""
+        row = self.get(entry)
+        if row is None or row["status"] == "pending" or (row["status"] == "failed" and retry_failed):
+            return False
+        try:
+            st = os.stat(entry["path"])
+        except OSError:
+            return row["status"] != "failed"
+        return row["size_bytes"] == st.st_size and row["mtime"] == st.st_mtime
+
+    def mark(self, entry: dict, status: str, **fields):
+        try:
+            st = os.stat(entry["path"])
+            size, mtime = st.st_size, st.st_mtime
+        except OSError:
+            size = mtime = None
+        row = {"file_hash": None, "stored_name": None, "pages": None, "chunks": None, "error": None, **fields}
+        self._conn.execute(
+            "INSERT INTO files (path, session_id, size_bytes, mtime, file_hash, stored_name, status, pages, chunks, "
+            "error, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(path, session_id) DO UPDATE SET size_bytes = excluded.size_bytes, mtime = excluded.mtime, "
+            "file_hash = COALESCE(excluded.file_hash, files.file_hash), "
+            "stored_name = COALESCE(excluded.stored_name, files.stored_name), status = excluded.status, "
+            "pages = excluded.pages, chunks = excluded.chunks, error = excluded.error, updated_at = excluded.updated_at",
+            (os.path.abspath(entry["path"]), entry["session_id"], size, mtime, row["file_hash"], row["stored_name"],
+             status, row["pages"], row["chunks"], row["error"], time.time()),
+        )
+        self._conn.commit()
+
+    def summary(self) -> dict:
+        rows = self._conn.execute("SELECT status, COUNT(*) AS n FROM files GROUP BY status").fetchall()
+        return {r["status"]: r["n"] for r in rows}
+
+    def close(self):
+        self._conn.close()
+
+
+# --- Procesos de extracción ---
+
+_count = None
+
+
+def _init_worker():
+    # Solo el tokenizer del modelo de embeddings: cargar el modelo completo en cada proceso no hace falta
+    global _count
+    _count = estimate_counter
+    if CHUNK_STRATEGY == "words":
+        return
+    try:
+        from transformers import AutoTokenizer
+        _count = tokenizer_counter(AutoTokenizer.from_pretrained(rag.EMBED_MODEL))
+    except Exception as e:
+        print(f"[BULK] Worker {os.getpid()}: tokenizer de {rag.EMBED_MODEL} no disponible ({e}); se estiman los tokens")
+
+
+def _parse(path: str, session_id: str) -> dict:
+    """Hash, verificación de duplicado y fragmentos de un archivo (corre en el pool)."""
+    start = time.perf_counter()
+    file_hash = rag.file_sha256(path)
+    existing = doc_catalog.find_by_hash(session_id, file_hash)
+    if existing:
+        return {"file_hash": file_hash, "duplicate": existing["stored_name"], "seconds": time.perf_counter() - start}
+    pages = {"total": None, "last": 0}
+
+    def report(**fields):
+        if "pages_total" in fields:
+            pages["total"] = fields["pages_total"]
+
+    chunks = []
+    for text, page in rag.document_chunks(rag._read_pages(path, report), count=_count):
+        pages["last"] = max(pages["last"], page or 0)
+        chunks.append((text, page))
+    return {"file_hash": file_hash, "size_bytes": os.path.getsize(path), "pages": pages["total"] or pages["last"] or 0,
+            "chunks": chunks, "seconds": time.perf_counter() - start}
+
+
+# --- Escritura ---
+
+class Throughput:
+    def __init__(self, total_files: int, report_every: float):
+        self.total_files = total_files
+        self.report_every = report_every
+        self.start = time.perf_counter()
+        self._last_report = self.start
+        self.counts = {"files": 0, "duplicates": 0, "failed": 0, "pages": 0, "chunks": 0, "chunks_reused": 0}
+        self.seconds = {"parse": 0.0, "embed": 0.0, "store": 0.0}
+
+    def rates(self) -> dict:
+        elapsed = max(1e-9, time.perf_counter() - self.start)
+        return {"elapsed_s": round(elapsed, 2),
+                "pages_per_s": round(self.counts["pages"] / elapsed, 2),
+                "chunks_per_s": round(self.counts["chunks"] / elapsed, 2)}
+
+    def maybe_report(self, force: bool = False):
+        now = time.perf_counter()
+        if not force and now - self._last_report < self.report_every:
+            return
+        self._last_report = now
+        c, r = self.counts, self.rates()
+        done = c["files"] + c["duplicates"] + c["failed"]
+        print(f"[BULK] {done}/{self.total_files} archivos, {c['pages']} páginas ({r['pages_per_s']} pág/s), "
+              f"{c['chunks']} fragmentos ({r['chunks_per_s']} frag/s), {c['failed']} fallidos")
+
+    def summary(self) -> dict:
+        return {**self.counts, **self.rates(),
+                "seconds": {k: round(v, 2) for k, v in self.seconds.items()}}
+
+
+class BulkWriter:
+    """Junta fragmentos de varios documentos en lotes de embeddings y guarda cada documento al completarse."""
+
+    def __init__(self, partitions, checkpoint: Checkpoint, stats: Throughput,
+                 embed_batch: int = BULK_EMBED_BATCH, insert_batch: int = BULK_INSERT_BATCH):
+        self.partitions = partitions
+        self.checkpoint = checkpoint
+        self.stats = stats
+        self.embed_batch = max(1, embed_batch)
+        self.insert_batch = max(1, insert_batch)
+        self._buffer: list[tuple[dict, int]] = []  # (documento, índice de fragmento)
+        self._seen: dict[tuple[str, str], str] = {}  # (sesión, hash) → nombre almacenado en esta corrida
+        self.sessions: set[str] = set()
+
+    def accept(self, entry: dict, result: dict):
+        self.stats.seconds["parse"] += result.get("seconds", 0.0)
+        if result.get("error"):
+            self.stats.counts["failed"] += 1
+            self.checkpoint.mark(entry, "failed", error=result["error"])
+            print(f"[BULK] Error en {entry['path']}: {result['error']}")
+            return
+        key = (entry["session_id"], result["file_hash"])
+        duplicate = result.get("duplicate") or self._seen.get(key)
+        if duplicate:
+            self.stats.counts["duplicates"] += 1
+            self.checkpoint.mark(entry, "duplicate", file_hash=result["file_hash"], stored_name=duplicate)
+            return
+        doc = {"entry": entry, "file_hash": result["file_hash"], "size_bytes": result["size_bytes"],
+               "pages": result["pages"], "chunks": result["chunks"], "embeddings": [None] * len(result["chunks"]),
+               "pending": len(result["chunks"])}
+        try:
+            doc["stored_name"] = self._store_file(entry, result)
+        except OSError as e:
+            self.stats.counts["failed"] += 1
+            self.checkpoint.mark(entry, "failed", file_hash=result["file_hash"], error=str(e))
+            print(f"[BULK] No se pudo copiar {entry['path']}: {e}")
+            return
+        self._seen[key] = doc["stored_name"]
+        if not doc["pending"]:
+            self._finish(doc)
+            return
+        self._buffer.extend((doc, i) for i in range(doc["pending"]))
+        while len(self._buffer) >= self.embed_batch:
+            self._embed(self._buffer[:self.embed_batch])
+            del self._buffer[:self.embed_batch]
+
+    def flush(self):
+        if self._buffer:
+            self._embed(self._buffer)
+            self._buffer = []
+
+    def _store_file(self, entry: dict, result: dict) -> str:
+        """Copia al directorio de subidas; al reanudar se reutiliza la copia de la corrida anterior."""
+        previous = self.checkpoint.get(entry)
+        upload_dir = rag.UPLOAD_DIR
+        if previous and previous["stored_name"] and previous["file_hash"] == result["file_hash"] \
+                and os.path.exists(os.path.join(upload_dir, previous["stored_name"])):
+            return previous["stored_name"]
+        os.makedirs(upload_dir, exist_ok=True)
+        stored_name = doc_catalog.reserve_name(entry["session_id"], entry["original_filename"], upload_dir)
+        try:
+            shutil.copyfile(entry["path"], os.path.join(upload_dir, stored_name))
+        except Exception:
+            doc_catalog.remove(stored_name)
+            raise
+        doc_catalog.mark_uploaded(stored_name, result["size_bytes"], result["file_hash"])
+        self.checkpoint.mark(entry, "pending", file_hash=result["file_hash"], stored_name=stored_name)
+        return stored_name
+
+    def _embed(self, items: list[tuple[dict, int]]):
+        start = time.perf_counter()
+        vectors, reused = rag._embed_cached([doc["chunks"][i][0] for doc, i in items])
+        self.stats.seconds["embed"] += time.perf_counter() - start
+        self.stats.counts["chunks_reused"] += reused
+        finished = []
+        for (doc, i), vector in zip(items, vectors):
+            doc["embeddings"][i] = vector
+            doc["pending"] -= 1
+            if doc["pending"] == 0:
+                finished.append(doc)
+        for doc in finished:
+            self._finish(doc)
+
+    def _finish(self, doc: dict):
+        start = time.perf_counter()
+        entry, source = doc["entry"], doc["stored_name"]
+        client_id = entry["session_id"]
+        collection = self.partitions.get(client_id, create=True)
+        pieces = [text for text, _ in doc["chunks"]]
+        with self.partitions.gate.write():
+            for lo in range(0, len(pieces), self.insert_batch):
+                hi = lo + self.insert_batch
+                ids, metas = rag.chunk_records(client_id, source, entry["original_filename"], doc["file_hash"], lo,
+                                               [page for _, page in doc["chunks"][lo:hi]])
+                rag.store_chunks(collection, client_id, source, ids, pieces[lo:hi], doc["embeddings"][lo:hi], metas)
+        doc_catalog.record_indexed(client_id, source, entry["original_filename"], doc["file_hash"], doc["size_bytes"],
+                                   doc["pages"] or None, len(pieces))
+        self.checkpoint.mark(entry, "done", file_hash=doc["file_hash"], stored_name=source, pages=doc["pages"],
+                             chunks=len(pieces))
+        self.stats.seconds["store"] += time.perf_counter() - start
+        self.stats.counts["files"] += 1
+        self.stats.counts["pages"] += doc["pages"]
+        self.stats.counts["chunks"] += len(pieces)
+        self.sessions.add(client_id)
+        # Libera los vectores: el documento ya está en Chroma
+        doc["chunks"] = doc["embeddings"] = None
+        self.stats.maybe_report()
+
+
+def _insert_batch_limit(requested: int) -> int:
+    # Chroma rechaza lotes mayores que el máximo del backend SQLite
+    try:
+        return min(requested, rag._client.get_max_batch_size())
+    except Exception:
+        return requested
+
+
+def run(args) -> dict:
+    from index_service import cli_target
+    # Sin gate compartido ni handles coordinados: solo con el backend (y el servicio) detenidos
+    cli_target("bulk_ingest", args.offline, hint="Con el backend en marcha subir los archivos por la API. ",
+               routable=False)
+    entries = load_entries(args.source, args.session)
+    checkpoint = Checkpoint(args.checkpoint)
+    todo = [e for e in entries if not checkpoint.is_finished(e, retry_failed=args.retry_failed)]
+    print(f"[BULK] {len(entries)} archivos, {len(entries) - len(todo)} ya procesados, {len(todo)} pendientes "
+          f"(checkpoint {checkpoint.db_path})")
+    if not todo:
+        return {"checkpoint": checkpoint.summary()}
+    partitions = rag.get_partitions()
+    if partitions is None:
+        sys.exit("Chroma no está disponible")
+    if rag.get_embedder() is None:
+        sys.exit("El modelo de embeddings no está disponible")
+    workers = args.workers or BULK_WORKERS or max(1, _cores() - 1)
+    stats = Throughput(len(todo), args.report_every)
+    writer = BulkWriter(partitions, checkpoint, stats, embed_batch=args.batch,
+                        insert_batch=_insert_batch_limit(args.insert_batch))
+    # spawn: los workers no heredan el modelo cargado ni las conexiones SQLite del proceso principal
+    ctx = multiprocessing.get_context("spawn")
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker) as pool:
+            # Ventana acotada: no se fragmenta más adelante de lo que alcanzan a embeber los lotes
+            pending, remaining = deque(), iter(todo)
+
+            def fill():
+                while len(pending) < workers * 2:
+                    entry = next(remaining, None)
+                    if entry is None:
+                        return
+                    pending.append((entry, pool.submit(_parse, entry["path"], entry["session_id"])))
+
+            fill()
+            while pending:
+                entry, future = pending.popleft()
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {"error": str(e)}
+                fill()
+                writer.accept(entry, result)
+            writer.flush()
+    finally:
+        # Las sesiones tocadas invalidan las respuestas en caché de los workers de la API
+        if writer.sessions:
+            from settings_store import settings
+            for session_id in writer.sessions:
+                settings.incr(f"corpus_version:{session_id}")
+        stats.maybe_report(force=True)
+        checkpoint.close()
+    report = {"workers": workers, "embed_batch": writer.embed_batch, "insert_batch": writer.insert_batch,
+              **stats.summary(), "embedding_cache": rag.embedding_cache.stats()}
+    print(json.dumps(report, ensure_ascii=False))
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="directorio (recursivo) o manifiesto .jsonl/.csv/.txt")
+    parser.add_argument("--session", default="global", help="sesión de los archivos que no indican otra")
+    parser.add_argument("--workers", type=int, default=0, help="procesos de extracción (0 = BULK_WORKERS o núcleos - 1)")
+    parser.add_argument("--batch", type=int, default=BULK_EMBED_BATCH, help="fragmentos por lote de embeddings")
+    parser.add_argument("--insert-batch", type=int, default=BULK_INSERT_BATCH, help="fragmentos por inserción en Chroma")
+    parser.add_argument("--checkpoint", default=BULK_CHECKPOINT_DB)
+    parser.add_argument("--retry-failed", action="store_true", help="reintentar los archivos que fallaron")
+    parser.add_argument("--report-every", type=float, default=10.0, help="segundos entre reportes de avance")
+    parser.add_argument("--offline", action="store_true", help="el backend y el servicio de índice están detenidos")
+    args = parser.parse_args(argv)
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
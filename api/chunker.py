@@ -0,0 +1,127 @@
+"""Fragmentado por tokens del modelo de embeddings, respetando oraciones y párrafos.
+
+Las ventanas fijas de 150 palabras cortan oraciones y filas de tablas, y no saben cuántos tokens ve
+realmente el modelo (lo que excede max_seq_length se trunca en silencio). Aquí cada página se divide
+en unidades (oraciones, o filas si el bloque parece una tabla), se cuentan sus tokens con el
+tokenizer del modelo en un solo llamado por página, y se arman fragmentos de hasta `max_tokens`
+sin partir unidades. El solapamiento es de oraciones completas. Consume las páginas en streaming:
+solo retiene las unidades del fragmento en curso.
+"""
+import os
+import re
+from collections import deque
+
+# sentences (por tokens, respetando oraciones) o words (ventanas de 150 palabras, el método anterior)
+CHUNK_STRATEGY = os.getenv("CHUNK_STRATEGY", "sentences").lower()
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "200"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "40"))
+# Fragmentos con menos tokens se descartan (equivale al mínimo de 10 palabras de chunk())
+CHUNK_MIN_TOKENS = int(os.getenv("CHUNK_MIN_TOKENS", "16"))
+# Con el fragmento lleno al menos en esta fracción se prefiere cortar en el cambio de párrafo
+PARAGRAPH_BREAK_FILL = 0.6
+
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+_SENTENCE_RE = re.compile(r"(?<=[.!?…;])\s+(?=[\"'¿¡(«A-ZÁÉÍÓÚÑ0-9])")
+# Fila de tabla: separadores "|" o tabulaciones, o 2+ huecos de varios espacios
+_TABLE_ROW_RE = re.compile(r"\||\t|\S {2,}\S.* {2,}\S")
+
+
+def split_units(text: str) -> list[tuple[str, bool]]:
+    """Unidades de una página: (texto, empieza párrafo). Las filas de tabla se mantienen enteras."""
+    units = []
+    for paragraph in _PARAGRAPH_RE.split(text):
+        lines = [ln.strip() for ln in paragraph.splitlines() if ln.strip()]
+        if not lines:
+            continue
+        first = True
+        if sum(1 for ln in lines if _TABLE_ROW_RE.search(ln)) * 2 > len(lines):
+            pieces = lines
+        else:
+            pieces = _SENTENCE_RE.split(" ".join(" ".join(lines).split()))
+        for piece in pieces:
+            piece = " ".join(piece.split())
+            if piece:
+                units.append((piece, first))
+                first = False
+    return units
+
+
+def tokenizer_counter(tokenizer):
+    """Contador por lotes con un tokenizer de Hugging Face (una llamada tokeniza todas las unidades)."""
+    def count(texts: list[str]) -> list[int]:
+        if not texts:
+            return []
+        return [len(ids) for ids in tokenizer(texts, add_special_tokens=False)["input_ids"]]
+    return count
+
+
+def estimate_counter(texts: list[str]) -> list[int]:
+    from context_packer import estimate_tokens
+    return [estimate_tokens(t) for t in texts]
+
+
+def _split_long(text: str, tokens: int, max_tokens: int, room: int) -> list[tuple[str, int]]:
+    """Parte por palabras una unidad que no entra en un fragmento (oración sin puntuación, bloque sin
+    cortes). El primer trozo completa el fragmento en curso (`room` tokens libres)."""
+    words = text.split()
+    per_word = tokens / max(1, len(words))
+    out, i = [], 0
+    while i < len(words):
+        size = max(1, int((room if room > 0 else max_tokens) / per_word))
+        piece = words[i:i + size]
+        out.append((" ".join(piece), max(1, round(per_word * len(piece)))))
+        i += size
+        room = 0
+    return out
+
+
+def iter_token_chunks(pages, max_tokens: int = CHUNK_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+                      count=estimate_counter, min_tokens: int = CHUNK_MIN_TOKENS):
+    """Consume (página, texto) y genera (fragmento, página de inicio), como rag.iter_chunks."""
+    current: deque = deque()  # (texto, tokens, página)
+    used = 0
+    fresh = 0  # unidades agregadas desde el último fragmento emitido
+
+    def emit():
+        text = " ".join(u[0] for u in current)
+        return text, current[0][2]
+
+    def keep_overlap():
+        nonlocal used, fresh
+        # Se conservan las últimas oraciones completas que entran en el solapamiento
+        kept, total = [], 0
+        for unit in reversed(current):
+            if total + unit[1] > overlap_tokens:
+                break
+            kept.append(unit)
+            total += unit[1]
+        current.clear()
+        current.extend(reversed(kept))
+        used = total
+        fresh = 0
+
+    for page_no, text in pages:
+        units = split_units(text)
+        counts = count([u[0] for u in units])
+        for (unit_text, starts_paragraph), tokens in zip(units, counts):
+            if tokens <= max_tokens:
+                pieces = [(unit_text, tokens)]
+            else:
+                room = max_tokens - used
+                pieces = _split_long(unit_text, tokens, max_tokens, room if room >= min_tokens else 0)
+            for piece, piece_tokens in pieces:
+                full = used + piece_tokens > max_tokens
+                paragraph_cut = starts_paragraph and used >= max_tokens * PARAGRAPH_BREAK_FILL
+                if fresh and (full or paragraph_cut):
+                    yield emit()
+                    keep_overlap()
+                    # El solapamiento no debe impedir que entre la unidad nueva
+                    while current and used + piece_tokens > max_tokens:
+                        used -= current.popleft()[1]
+                current.append((piece, piece_tokens, page_no))
+                used += piece_tokens
+                fresh += 1
+                starts_paragraph = False
+    # El último fragmento solo se emite si aporta algo además del solapamiento ya emitido
+    if fresh and used >= min_tokens:
+        yield emit()
@@ -0,0 +1,138 @@
+"""Armado del contexto del prompt según un presupuesto de tokens por modelo.
+
+Reemplaza el corte fijo de 700 caracteres por fragmento y 13000 en total: el presupuesto depende del
+modelo (los modelos chicos en CPU evalúan el prompt mucho más lento), se descartan fragmentos casi
+duplicados, se recorta el solapamiento entre ventanas consecutivas de un mismo documento y se respeta
+el score_threshold del request.
+"""
+import os
+import re
+import threading
+
+# Presupuesto por defecto y por modelo: CONTEXT_TOKEN_BUDGETS="qwen2.5:1.5b=1200,llama3.1:8b=3000"
+MAX_CONTEXT_TOKENS = int(os.getenv("MAX_CONTEXT_TOKENS", "1500"))
+CONTEXT_TOKEN_BUDGETS = os.getenv("CONTEXT_TOKEN_BUDGETS", "qwen2.5:1.5b=1200")
+# Tokenizers de Hugging Face opcionales por modelo: CONTEXT_TOKENIZERS="qwen2.5:1.5b=Qwen/Qwen2.5-1.5B-Instruct"
+CONTEXT_TOKENIZERS = os.getenv("CONTEXT_TOKENIZERS", "")
+# Fracción de las palabras de un fragmento ya presentes en el contexto para considerarlo duplicado
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.8"))
+# No vale la pena agregar un fragmento recortado a menos de esto
+MIN_CHUNK_TOKENS = 48
+
+_WORD_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def parse_map(spec: str) -> dict[str, str]:
+    out = {}
+    for item in spec.split(","):
+        if "=" in item:
+            k, v = item.rsplit("=", 1)
+            out[k.strip()] = v.strip()
+    return out
+
+
+_budgets = {k: int(v) for k, v in parse_map(CONTEXT_TOKEN_BUDGETS).items()}
+_tokenizer_names = parse_map(CONTEXT_TOKENIZERS)
+_tokenizers: dict[str, object] = {}
+_tokenizers_lock = threading.Lock()
+
+
+def budget_for(model: str) -> int:
+    return _budgets.get(model, MAX_CONTEXT_TOKENS)
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimación rápida para tokenizers BPE: una pieza por palabra corta o signo, más una cada 6 letras extra."""
+    return sum(1 + (len(piece) - 1) // 6 for piece in _WORD_RE.findall(text))
+
+
+def _tokenizer(model: str):
+    name = _tokenizer_names.get(model)
+    if not name:
+        return None
+    with _tokenizers_lock:
+        if model not in _tokenizers:
+            try:
+                from transformers import AutoTokenizer
+                _tokenizers[model] = AutoTokenizer.from_pretrained(name)
+            except Exception as e:
+                print(f"[CONTEXT] No se pudo cargar el tokenizer {name} para {model}, se usa estimación: {e}")
+                _tokenizers[model] = None
+        return _tokenizers[model]
+
+
+def token_counter(model: str):
+    tok = _tokenizer(model)
+    if tok is None:
+        return estimate_tokens
+    return lambda text: len(tok.encode(text, add_special_tokens=False))
+
+
+def _overlap(prev: list[str], cur: list[str], min_words: int = 5, max_words: int = 200) -> int:
+    """Cantidad de palabras finales de `prev` que coinciden con el inicio de `cur`."""
+    for k in range(min(len(prev), len(cur), max_words), min_words - 1, -1):
+        if prev[-k:] == cur[:k]:
+            return k
+    return 0
+
+
+def _truncate(words: list[str], max_tokens: int, count) -> list[str]:
+    lo, hi = 0, len(words)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if count(" ".join(words[:mid])) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return words[:lo]
+
+
+def pack_context(chunks: list[dict], model: str, score_threshold: float | None = None, budget: int | None = None) -> str:
+    """Contexto en texto plano con los mejores fragmentos que entran en el presupuesto de tokens del modelo.
+
+    `chunks` llega ordenado por relevancia con claves source, page, text, score (y chunk, opcional).
+    """
+    budget = budget or budget_for(model)
+    count = token_counter(model)
+    selected: list[dict] = []
+    seen_words: set[str] = set()
+    used = 0
+    for ch in chunks:
+        if score_threshold is not None and (ch.get("score") or 0) < score_threshold:
+            continue
+        words = (ch.get("text") or "").split()
+        if not words:
+            continue
+        distinct = set(words)
+        if seen_words and len(distinct & seen_words) / len(distinct) >= CONTEXT_DEDUP_THRESHOLD:
+            continue
+        # Ventanas vecinas del mismo documento comparten palabras en los bordes: se quitan del nuevo fragmento
+        for prev in selected:
+            if prev["source"] != ch.get("source"):
+                continue
+            k = _overlap(prev["words"], words)
+            if k:
+                words = words[k:]
+            k = _overlap(words, prev["words"])
+            if k:
+                words = words[:-k]
+            if not words:
+                break
+        if len(words) < 5:
+            continue
+        header = f"[{len(selected) + 1}] Fuente: {ch.get('source')} pág {ch.get('page')} -> "
+        remaining = budget - used - count(header)
+        cost = count(" ".join(words))
+        if cost > remaining:
+            if remaining < MIN_CHUNK_TOKENS:
+                break
+            words = _truncate(words, remaining - 1, count)
+            segment = header + " ".join(words) + "…"
+        else:
+            segment = header + " ".join(words)
+        used += count(segment)
+        seen_words.update(words)
+        selected.append({"source": ch.get("source"), "words": words, "segment": segment})
+    if not selected:
+        return "(sin fragmentos relevantes)"
+    return "\n".join(s["segment"] for s in selected)
@@ -0,0 +1,169 @@
+"""Catálogo persistente de los documentos subidos (SQLite junto a CHROMA_DIR).
+
+Reemplaza los os.listdir(UPLOAD_DIR) con comparación por prefijo: listar o borrar los documentos de
+una sesión es una consulta indexada por session_id (el prefijo "sesion_" también coincidía con otras
+sesiones cuyo id empieza igual), y el nombre de un archivo nuevo se reserva en el catálogo en lugar de
+probar os.path.exists en un bucle. Cada fila guarda sesión, nombre almacenado, nombre original,
+hash, tamaño, páginas, fragmentos, estado y fechas de subida e indexación. rag.check_catalog
+reconcilia el catálogo con el directorio de subidas y con Chroma.
+"""
+import os
+import time
+import sqlite3
+import threading
+
+DOC_CATALOG_DB = os.getenv("DOC_CATALOG_DB", os.path.join(os.path.dirname(os.getenv("CHROMA_DIR", "storage/vectordb")) or ".", "catalog.db"))
+
+# uploading: nombre reservado, el archivo se está escribiendo; uploaded: en cola de ingesta
+STATUSES = ("uploading", "uploaded", "indexed", "failed")
+
+
+class DocumentCatalog:
+    def __init__(self, db_path: str = DOC_CATALOG_DB):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS documents (
+                    stored_name TEXT PRIMARY KEY,
+                    session_id TEXT NOT NULL,
+                    original_filename TEXT,
+                    file_hash TEXT,
+                    size_bytes INTEGER,
+                    pages INTEGER,
+                    chunks INTEGER,
+                    status TEXT NOT NULL,
+                    uploaded_at REAL NOT NULL,
+                    indexed_at REAL
+                );
+                CREATE INDEX IF NOT EXISTS documents_session ON documents(session_id, uploaded_at);
+                CREATE INDEX IF NOT EXISTS documents_hash ON documents(session_id, file_hash);
+                """
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _execute(self, sql: str, params: tuple = ()) -> int:
+        with self._lock:
+            db = self._db()
+            cur = db.execute(sql, params)
+            db.commit()
+            return cur.rowcount
+
+    # --- Altas y estados ---
+
+    def reserve_name(self, session_id: str, original_filename: str, upload_dir: str) -> str:
+        """Reserva un nombre libre "<sesión>_<nombre>[_n].ext" para una subida nueva."""
+        base_name, ext = os.path.splitext(os.path.basename(original_filename))
+        counter = 0
+        while True:
+            suffix = f"_{counter}" if counter else ""
+            name = f"{session_id}_{base_name}{suffix}{ext}"
+            counter += 1
+            # Un archivo anterior al catálogo (aún sin reconciliar) también ocupa el nombre
+            if os.path.exists(os.path.join(upload_dir, name)):
+                continue
+            inserted = self._execute(
+                "INSERT OR IGNORE INTO documents (stored_name, session_id, original_filename, status, uploaded_at) "
+                "VALUES (?, ?, ?, 'uploading', ?)",
+                (name, session_id, original_filename, time.time()),
+            )
+            if inserted:
+                return name
+
+    def mark_uploaded(self, stored_name: str, size_bytes: int, file_hash: str):
+        self._execute("UPDATE documents SET status = 'uploaded', size_bytes = ?, file_hash = ? WHERE stored_name = ?",
+                      (size_bytes, file_hash, stored_name))
+
+    def record_indexed(self, session_id: str, stored_name: str, original_filename: str | None, file_hash: str,
+                       size_bytes: int | None, pages: int | None, chunks: int):
+        """Alta o actualización al terminar de indexar (también para documentos que no pasaron por upload_pdf)."""
+        now = time.time()
+        self._execute(
+            "INSERT INTO documents (stored_name, session_id, original_filename, file_hash, size_bytes, pages, chunks, "
+            "status, uploaded_at, indexed_at) VALUES (?, ?, ?, ?, ?, ?, ?, 'indexed', ?, ?) "
+            "ON CONFLICT(stored_name) DO UPDATE SET session_id = excluded.session_id, "
+            "original_filename = COALESCE(excluded.original_filename, documents.original_filename), "
+            "file_hash = excluded.file_hash, size_bytes = COALESCE(excluded.size_bytes, documents.size_bytes), "
+            "pages = excluded.pages, chunks = excluded.chunks, status = 'indexed', indexed_at = excluded.indexed_at",
+            (stored_name, session_id, original_filename, file_hash, size_bytes, pages, chunks, now, now),
+        )
+
+    def set_status(self, stored_name: str, status: str):
+        self._execute("UPDATE documents SET status = ? WHERE stored_name = ?", (status, stored_name))
+
+    # --- Bajas ---
+
+    def remove(self, stored_name: str) -> bool:
+        return self._execute("DELETE FROM documents WHERE stored_name = ?", (stored_name,)) > 0
+
+    def remove_session(self, session_id: str) -> list[str]:
+        """Elimina las filas de la sesión; devuelve sus nombres almacenados."""
+        with self._lock:
+            db = self._db()
+            names = [r["stored_name"] for r in db.execute("SELECT stored_name FROM documents WHERE session_id = ?", (session_id,))]
+            db.execute("DELETE FROM documents WHERE session_id = ?", (session_id,))
+            db.commit()
+        return names
+
+    # --- Consultas ---
+
+    def get(self, stored_name: str) -> dict | None:
+        with self._lock:
+            row = self._db().execute("SELECT * FROM documents WHERE stored_name = ?", (stored_name,)).fetchone()
+        return dict(row) if row else None
+
+    def list_session(self, session_id: str, include_uploading: bool = False) -> list[dict]:
+        """Documentos de la sesión por fecha de subida; sin las subidas a medio escribir salvo que se pidan."""
+        sql = "SELECT * FROM documents WHERE session_id = ?"
+        if not include_uploading:
+            sql += " AND status != 'uploading'"
+        with self._lock:
+            rows = self._db().execute(sql + " ORDER BY uploaded_at", (session_id,)).fetchall()
+        return [dict(r) for r in rows]
+
+    def find_by_hash(self, session_id: str, file_hash: str) -> dict | None:
+        """Documento ya indexado en la sesión con el mismo contenido."""
+        with self._lock:
+            row = self._db().execute(
+                "SELECT * FROM documents WHERE session_id = ? AND file_hash = ? AND status = 'indexed' LIMIT 1",
+                (session_id, file_hash),
+            ).fetchone()
+        return dict(row) if row else None
+
+    def recent_sessions(self, limit: int) -> list[str]:
+        """Sesiones con documentos indexados, de la de actividad más reciente a la más antigua."""
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT session_id FROM documents WHERE status = 'indexed' GROUP BY session_id "
+                "ORDER BY MAX(COALESCE(indexed_at, uploaded_at)) DESC LIMIT ?", (limit,),
+            ).fetchall()
+        return [r["session_id"] for r in rows]
+
+    def all_names(self) -> dict[str, dict]:
+        with self._lock:
+            rows = self._db().execute("SELECT * FROM documents").fetchall()
+        return {r["stored_name"]: dict(r) for r in rows}
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db().execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            db = self._db()
+            rows = db.execute("SELECT status, COUNT(*) AS n, COALESCE(SUM(size_bytes), 0) AS size FROM documents GROUP BY status").fetchall()
+            sessions = db.execute("SELECT COUNT(DISTINCT session_id) FROM documents").fetchone()[0]
+        return {"db": self.db_path, "sessions": sessions, "by_status": {r["status"]: r["n"] for r in rows},
+                "size_bytes": sum(r["size"] for r in rows)}
+
+
+doc_catalog = DocumentCatalog()
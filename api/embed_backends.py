@@ -0,0 +1,62 @@
+"""Backends de CPU para el modelo de embeddings, seleccionables con EMBED_BACKEND.
+
+- torch: SentenceTransformer en PyTorch float32 (comportamiento original).
+- onnx: el mismo modelo exportado a ONNX y ejecutado con ONNX Runtime.
+- onnx-int8: ONNX con cuantización dinámica a int8 (EMBED_ONNX_QUANTIZATION según la CPU).
+
+Las exportaciones se guardan en EMBED_ONNX_DIR para no repetirlas en cada arranque. Los vectores
+de cada backend difieren levemente, por eso la clave de la caché de embeddings y la metadata
+`embed_key` de los fragmentos incluyen el backend (ver embed_tools.py para re-embeber un almacén).
+"""
+import os
+import re
+import time
+
+BACKENDS = ("torch", "onnx", "onnx-int8")
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch").lower()
+# avx2, avx512, avx512_vnni o arm64
+EMBED_ONNX_QUANTIZATION = os.getenv("EMBED_ONNX_QUANTIZATION", "avx2")
+EMBED_ONNX_DIR = os.getenv("EMBED_ONNX_DIR", os.path.join(os.path.dirname(os.getenv("CHROMA_DIR", "storage/vectordb")) or ".", "onnx"))
+
+
+def embedding_key(model: str, backend: str = EMBED_BACKEND) -> str:
+    """Identificador de los vectores producidos: el modelo y, fuera de torch, el backend."""
+    return model if backend == "torch" else f"{model}@{backend}"
+
+
+def _local_dir(model: str) -> str:
+    return os.path.join(EMBED_ONNX_DIR, re.sub(r"[^\w.-]+", "__", model))
+
+
+def load_embedder(model: str, backend: str = EMBED_BACKEND):
+    """SentenceTransformer en CPU con el backend pedido; exporta y cuantiza a ONNX la primera vez."""
+    if backend not in BACKENDS:
+        raise ValueError(f"EMBED_BACKEND desconocido: {backend} (opciones: {', '.join(BACKENDS)})")
+    from sentence_transformers import SentenceTransformer
+    start = time.perf_counter()
+    if backend == "torch":
+        embedder = SentenceTransformer(model, device="cpu")
+    else:
+        try:
+            import optimum  # noqa: F401
+            import onnxruntime  # noqa: F401
+        except ImportError as e:
+            raise RuntimeError(f"EMBED_BACKEND={backend} requiere optimum y onnxruntime "
+                               f"(pip install -r requirements-onnx.txt): {e}") from e
+        local = _local_dir(model)
+        if not os.path.exists(os.path.join(local, "onnx", "model.onnx")):
+            print(f"[EMBED] Exportando {model} a ONNX en {local}")
+            SentenceTransformer(model, device="cpu", backend="onnx").save(local)
+        if backend == "onnx":
+            embedder = SentenceTransformer(local, device="cpu", backend="onnx")
+        else:
+            file_name = f"model_qint8_{EMBED_ONNX_QUANTIZATION}.onnx"
+            if not os.path.exists(os.path.join(local, "onnx", file_name)):
+                from sentence_transformers import export_dynamic_quantized_onnx_model
+                print(f"[EMBED] Cuantizando {model} a int8 ({EMBED_ONNX_QUANTIZATION})")
+                base = SentenceTransformer(local, device="cpu", backend="onnx")
+                export_dynamic_quantized_onnx_model(base, EMBED_ONNX_QUANTIZATION, local)
+            embedder = SentenceTransformer(local, device="cpu", backend="onnx",
+                                           model_kwargs={"file_name": f"onnx/{file_name}"})
+    print(f"[EMBED] Modelo {model} ({backend}) cargado en {time.perf_counter() - start:.1f}s")
+    return embedder
@@ -0,0 +1,172 @@
+"""Herramientas de línea de comandos para los backends de embeddings.
+
+    python embed_tools.py bench [--backends torch,onnx,onnx-int8] [--texts manual.pdf] [--limit 512]
+    python embed_tools.py reembed [--session ID] [--force] [--offline]
+
+bench mide fragmentos/segundo (total y por núcleo) de cada backend sobre fragmentos reales y su
+fidelidad respecto del primero de la lista: similitud coseno entre los vectores de un mismo texto y
+coincidencia de los 10 vecinos más cercanos. reembed recalcula con el backend actual (EMBED_BACKEND)
+los fragmentos guardados en Chroma con otro; es reanudable porque omite los que ya tienen el
+`embed_key` actual. Con INDEX_SERVICE_ADDRESS reembed corre en el servicio de índice; sin servicio
+exige --offline (backend detenido).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import rag
+from embed_backends import BACKENDS, load_embedder
+
+
+def _cores() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _sample_texts(path: str | None, limit: int) -> list[str]:
+    """Fragmentos de un archivo (cortados como en la ingesta, según CHUNK_STRATEGY) o, si no se indica,
+    del almacén de Chroma."""
+    if path:
+        texts = []
+        for text, _ in rag.document_chunks(rag._read_pages(path)):
+            texts.append(text)
+            if len(texts) >= limit:
+                break
+        return texts
+    partitions = rag.get_partitions()
+    texts = []
+    for collection in partitions.all_collections() if partitions else []:
+        res = collection.get(include=["documents"], limit=limit - len(texts))
+        texts.extend(d for d in res.get("documents") or [] if d)
+        if len(texts) >= limit:
+            break
+    return texts
+
+
+def bench(args) -> dict:
+    import numpy as np
+
+    texts = _sample_texts(args.texts, args.limit)
+    if not texts:
+        sys.exit("No hay fragmentos para medir: indicar --texts o indexar documentos primero")
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    cores = _cores()
+    results, reference = [], None
+    for backend in backends:
+        embedder = load_embedder(rag.EMBED_MODEL, backend)
+        embedder.encode(texts[:args.batch], batch_size=args.batch, normalize_embeddings=True)  # calentamiento
+        start = time.perf_counter()
+        vecs = embedder.encode(texts, batch_size=args.batch, normalize_embeddings=True)
+        elapsed = time.perf_counter() - start
+        vecs = np.asarray(vecs, dtype=np.float32)
+        row = {
+            "backend": backend,
+            "chunks": len(texts),
+            "seconds": round(elapsed, 3),
+            "chunks_per_sec": round(len(texts) / elapsed, 2),
+            "chunks_per_sec_per_core": round(len(texts) / elapsed / cores, 2),
+        }
+        if reference is None:
+            reference = vecs
+        else:
+            cos = (reference * vecs).sum(axis=1)
+            row["cosine_mean"] = round(float(cos.mean()), 5)
+            row["cosine_min"] = round(float(cos.min()), 5)
+            # Vecinos más cercanos de los primeros textos con cada backend (excluyendo el propio texto)
+            k = min(10, len(texts) - 1)
+            queries = min(50, len(texts))
+            if k > 0:
+                ref_sim, sim = reference[:queries] @ reference.T, vecs[:queries] @ vecs.T
+                np.fill_diagonal(ref_sim, -np.inf)
+                np.fill_diagonal(sim, -np.inf)
+                ref_nn = np.argsort(-ref_sim, axis=1)[:, :k]
+                nn = np.argsort(-sim, axis=1)[:, :k]
+                overlap = [len(set(a) & set(b)) / k for a, b in zip(ref_nn, nn)]
+                row[f"neighbors_overlap_at_{k}"] = round(float(np.mean(overlap)), 4)
+        results.append(row)
+        print(json.dumps(row, ensure_ascii=False))
+    report = {"model": rag.EMBED_MODEL, "cores": cores, "batch": args.batch, "reference": backends[0], "results": results}
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, ensure_ascii=False, indent=2)
+    return report
+
+
+def reembed_collections(session_id: str | None = None, force: bool = False, batch: int = rag.EMBED_BATCH) -> int:
+    """Recalcula con EMBED_KEY los fragmentos guardados con otro backend. Corre en el proceso dueño de
+    Chroma: cada upsert pasa por el gate de escrituras, así que no se cruza con ingestas ni compactaciones."""
+    partitions = rag.get_partitions()
+    if partitions is None:
+        raise RuntimeError("Chroma no está disponible")
+    collections = [partitions.get(session_id)] if session_id else partitions.all_collections()
+    total = 0
+    for collection in collections:
+        if collection is None:
+            continue
+        name = collection.name
+        # Primero los ids a convertir: upsert durante una paginación por offset podría saltear fragmentos
+        ids, offset = [], 0
+        while True:
+            res = collection.get(include=["metadatas"], limit=1000, offset=offset)
+            page = res.get("ids") or []
+            if not page:
+                break
+            ids.extend(cid for cid, m in zip(page, res["metadatas"]) if force or (m or {}).get("embed_key") != rag.EMBED_KEY)
+            offset += len(page)
+        for i in range(0, len(ids), batch):
+            res = collection.get(ids=ids[i:i + batch], include=["documents", "metadatas"])
+            metas = [{**(m or {}), "embed_key": rag.EMBED_KEY} for m in res["metadatas"]]
+            docs = [d or "" for d in res["documents"]]
+            embeddings = rag._embed(docs)
+            with partitions.gate.write():
+                # Una compactación pudo reemplazar la colección (mismos ids, otro handle)
+                collection = rag._client.get_collection(name)
+                collection.upsert(ids=res["ids"], documents=docs, metadatas=metas, embeddings=embeddings)
+            total += len(res["ids"])
+        if ids:
+            print(f"[REEMBED] {name}: {len(ids)} fragmentos recalculados con {rag.EMBED_KEY}")
+    print(f"[REEMBED] Total: {total} fragmentos")
+    return total
+
+
+def reembed(args) -> int:
+    from index_service import cli_target
+    service = cli_target("reembed", args.offline)
+    if service:
+        return service.reembed(args.session, force=args.force, batch=args.batch)
+    try:
+        return reembed_collections(args.session, force=args.force, batch=args.batch)
+    except RuntimeError as e:
+        sys.exit(str(e))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("bench", help="throughput y fidelidad de cada backend")
+    p.add_argument("--backends", default=",".join(BACKENDS), help="el primero es la referencia de fidelidad")
+    p.add_argument("--texts", help="PDF o texto de muestra (por defecto, fragmentos ya indexados)")
+    p.add_argument("--limit", type=int, default=512)
+    p.add_argument("--batch", type=int, default=32)
+    p.add_argument("--json", help="guardar el reporte en este archivo")
+    p.set_defaults(func=bench)
+    p = sub.add_parser("reembed", help="recalcular los embeddings guardados con el backend actual")
+    p.add_argument("--session", help="solo esta sesión")
+    p.add_argument("--batch", type=int, default=rag.EMBED_BATCH)
+    p.add_argument("--force", action="store_true", help="recalcular también los que ya tienen el backend actual")
+    p.add_argument("--offline", action="store_true", help="el backend está detenido: escribir desde este proceso")
+    p.set_defaults(func=reembed)
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""Caché de embeddings en dos niveles, direccionada por contenido.
+
+Clave: (modelo y backend de embeddings, hash del texto normalizado). El primer nivel es un LRU en memoria;
+el segundo, una tabla SQLite con vectores float32 y límite de tamaño (se expulsan los menos usados).
+La usan tanto la ingesta (fragmentos repetidos entre sesiones o versiones de un mismo manual) como
+las consultas de /chat (preguntas frecuentes). Al cambiar EMBED_MODEL o EMBED_BACKEND las
+entradas anteriores se descartan automáticamente.
+"""
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+
+EMBED_CACHE_DB = os.getenv("EMBED_CACHE_DB", os.path.join(os.path.dirname(os.getenv("CHROMA_DIR", "storage/vectordb")) or ".", "embeddings.db"))
+EMBED_CACHE_MEMORY_ITEMS = int(os.getenv("EMBED_CACHE_MEMORY_ITEMS", "20000"))
+EMBED_CACHE_DISK_ITEMS = int(os.getenv("EMBED_CACHE_DISK_ITEMS", "1000000"))
+
+
+def normalize(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(normalize(text).encode("utf-8")).hexdigest()
+
+
+class DiskEmbeddingStore:
+    """Nivel persistente: SQLite con expulsión por último uso al superar max_items."""
+
+    def __init__(self, db_path: str = EMBED_CACHE_DB, max_items: int = EMBED_CACHE_DISK_ITEMS):
+        self.db_path = db_path
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self._count: int | None = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    hash TEXT NOT NULL,
+                    dim INTEGER NOT NULL,
+                    vector BLOB NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (model, hash)
+                )"""
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+            self._conn.commit()
+            self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return self._conn
+
+    def purge_other_models(self, model: str) -> int:
+        with self._lock:
+            db = self._db()
+            removed = db.execute("DELETE FROM embeddings WHERE model != ?", (model,)).rowcount
+            db.commit()
+            self._count -= removed
+        return removed
+
+    def get_many(self, model: str, hashes: list[str]) -> dict[str, list[float]]:
+        found: dict[str, list[float]] = {}
+        with self._lock:
+            db = self._db()
+            # SQLite limita la cantidad de parámetros por consulta
+            for i in range(0, len(hashes), 500):
+                part = hashes[i:i + 500]
+                marks = ",".join("?" * len(part))
+                rows = db.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({marks})", (model, *part)
+                ).fetchall()
+                for h, blob in rows:
+                    vec = array("f")
+                    vec.frombytes(blob)
+                    found[h] = vec.tolist()
+            if found:
+                now = time.time()
+                db.executemany("UPDATE embeddings SET last_used = ? WHERE model = ? AND hash = ?",
+                               [(now, model, h) for h in found])
+                db.commit()
+        return found
+
+    def put_many(self, model: str, items: dict[str, list[float]]):
+        if not items:
+            return
+        now = time.time()
+        rows = [(model, h, len(v), array("f", v).tobytes(), now) for h, v in items.items()]
+        with self._lock:
+            db = self._db()
+            before = db.total_changes
+            db.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, hash, dim, vector, last_used) VALUES (?, ?, ?, ?, ?)", rows
+            )
+            self._count += db.total_changes - before
+            excess = self._count - self.max_items
+            if excess > 0:
+                # Expulsar de a bloques para no pagar un DELETE por cada inserción
+                excess += self.max_items // 20
+                removed = db.execute(
+                    "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)", (excess,)
+                ).rowcount
+                self._count -= removed
+            db.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._db()
+            return self._count
+
+
+class EmbeddingCache:
+    def __init__(self, model: str, memory_items: int = EMBED_CACHE_MEMORY_ITEMS, disk: DiskEmbeddingStore | None = None):
+        self.model = model
+        self.memory_items = memory_items
+        self.disk = disk if disk is not None else DiskEmbeddingStore()
+        self._memory: OrderedDict[str, list[float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._purged = False
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _remember(self, key: str, vector: list[float]):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def embed(self, texts: list[str], encode) -> tuple[list[list[float]], int]:
+        """Vectores para `texts`, calculando con `encode` solo los ausentes en ambos niveles.
+
+        Devuelve (vectores en el orden de entrada, cantidad de textos servidos desde la caché).
+        """
+        if not self._purged:
+            removed = self.disk.purge_other_models(self.model)
+            self._purged = True
+            if removed:
+                print(f"[EMBED-CACHE] {removed} embeddings de otros modelos descartados (modelo actual: {self.model})")
+        keys = [content_hash(t) for t in texts]
+        found: dict[str, list[float]] = {}
+        with self._lock:
+            for k in keys:
+                if k in self._memory:
+                    self._memory.move_to_end(k)
+                    found[k] = self._memory[k]
+        memory_found = len(found)
+        missing = [k for k in dict.fromkeys(keys) if k not in found]
+        if missing:
+            from_disk = self.disk.get_many(self.model, missing)
+            found.update(from_disk)
+            disk_found = len(from_disk)
+        else:
+            disk_found = 0
+        to_encode = [k for k in missing if k not in found]
+        if to_encode:
+            text_by_key = dict(zip(keys, texts))
+            fresh = dict(zip(to_encode, encode([text_by_key[k] for k in to_encode])))
+            self.disk.put_many(self.model, fresh)
+            found.update(fresh)
+        with self._lock:
+            for k in missing:
+                self._remember(k, found[k])
+            self.memory_hits += memory_found
+            self.disk_hits += disk_found
+            self.misses += len(to_encode)
+        encoded = set(to_encode)
+        hits = sum(1 for k in keys if k not in encoded)
+        return [found[k] for k in keys], hits
+
+    def clear_memory(self):
+        with self._lock:
+            self._memory.clear()
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "model": self.model,
+            "memory_items": len(self._memory),
+            "memory_limit": self.memory_items,
+            "disk_items": len(self.disk),
+            "disk_limit": self.disk.max_items,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+        }
@@ -0,0 +1,133 @@
+"""Embeddings y llamadas a Chroma fuera del event loop.
+
+SentenceTransformer.encode y las operaciones de Chroma son síncronas; aquí se ejecutan en un pool
+de threads (torch y el cliente de Chroma liberan el GIL en el trabajo pesado). Las consultas de
+/chat que llegan al mismo tiempo se agrupan en micro-lotes: un solo encode por lote, con una
+ventana de espera máxima y un tamaño máximo de lote.
+"""
+import os
+import time
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from index_service import index
+
+EMBED_THREADS = int(os.getenv("EMBED_THREADS", "2"))
+EMBED_BATCH_MAX = int(os.getenv("EMBED_BATCH_MAX", "32"))
+EMBED_BATCH_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", "10"))
+
+
+class EmbeddingService:
+    def __init__(self, threads: int = EMBED_THREADS, batch_max: int = EMBED_BATCH_MAX,
+                 batch_wait_ms: float = EMBED_BATCH_WAIT_MS):
+        self.threads = max(1, threads)
+        self.batch_max = max(1, batch_max)
+        self.batch_wait = max(0.0, batch_wait_ms) / 1000
+        self._executor: ThreadPoolExecutor | None = None
+        self._queue: asyncio.Queue | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self._task: asyncio.Task | None = None
+        # Contadores para observar el agrupamiento
+        self._queries = 0
+        self._batches = 0
+        self._largest_batch = 0
+        self._encode_time = 0.0
+
+    async def start(self):
+        if self._task is not None:
+            return
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="embed")
+        self._queue = asyncio.Queue()
+        # Un lote en vuelo por thread; mientras todos están ocupados los pedidos se acumulan en la cola
+        self._slots = asyncio.Semaphore(self.threads)
+        self._task = asyncio.get_running_loop().create_task(self._batch_loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+
+    async def run(self, fn, *args, **kwargs):
+        """Ejecuta una función síncrona (Chroma, ingesta) en el pool sin bloquear el loop."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="embed")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+
+    async def embed_query(self, text: str) -> list[float]:
+        """Embedding de una consulta, agrupado con las demás consultas concurrentes."""
+        if self._task is None:
+            await self.start()
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, fut))
+        return await fut
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_wait
+            while len(batch) < self.batch_max:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            await self._slots.acquire()
+            # Lo que llegó mientras se esperaba un thread libre viaja en el mismo lote
+            while len(batch) < self.batch_max and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            loop.create_task(self._dispatch(batch))
+
+    async def _dispatch(self, batch: list[tuple[str, asyncio.Future]]):
+        try:
+            pending = [(text, fut) for text, fut in batch if not fut.done()]
+            if not pending:
+                return
+            # Preguntas idénticas (FAQ) se codifican una sola vez
+            unique = list(dict.fromkeys(text for text, _ in pending))
+            start = time.perf_counter()
+            try:
+                vectors = await self.run(index.embed, unique)
+            except Exception as e:
+                for _, fut in pending:
+                    if not fut.done():
+                        fut.set_exception(e)
+                return
+            self._encode_time += time.perf_counter() - start
+            self._batches += 1
+            self._queries += len(pending)
+            self._largest_batch = max(self._largest_batch, len(unique))
+            by_text = dict(zip(unique, vectors))
+            for text, fut in pending:
+                if not fut.done():
+                    fut.set_result(by_text[text])
+        finally:
+            self._slots.release()
+
+    def stats(self) -> dict:
+        return {
+            "threads": self.threads,
+            "batch_max": self.batch_max,
+            "batch_wait_ms": self.batch_wait * 1000,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "queries": self._queries,
+            "batches": self._batches,
+            "avg_batch": round(self._queries / self._batches, 2) if self._batches else 0,
+            "largest_batch": self._largest_batch,
+            "avg_encode_ms": round(self._encode_time * 1000 / self._batches, 2) if self._batches else 0,
+        }
+
+
+embeddings = EmbeddingService()
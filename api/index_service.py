@@ -0,0 +1,341 @@
+"""Servicio de embeddings e índice compartido por los workers de uvicorn.
+
+Con `uvicorn --workers N` cada proceso cargaría su propio modelo de embeddings, su cliente de Chroma
+y sus SQLite de caché e índice BM25. Con INDEX_SERVICE_ADDRESS definida, un único proceso
+(`python index_service.py`) es dueño de todo eso y los workers le hablan por un socket local
+(multiprocessing.connection sobre un socket Unix, autenticado con INDEX_SERVICE_AUTHKEY, que es
+obligatoria: sin clave ni el servicio arranca ni los workers se conectan). Sin la variable todo corre
+en el mismo proceso, como antes.
+
+`index` expone la misma interfaz en ambos modos. Cada worker mantiene un pool de conexiones; el
+servicio atiende cada conexión en su propio thread, y add_document envía el progreso de la ingesta
+como mensajes intermedios.
+"""
+import os
+import sys
+import time
+import queue
+import argparse
+import threading
+import traceback
+from multiprocessing.connection import Client, Listener
+
+# Vacío: embeddings e índice en el mismo proceso. Con valor: "unix:/ruta/index.sock"
+INDEX_SERVICE_ADDRESS = os.getenv("INDEX_SERVICE_ADDRESS", "").strip()
+# Sin valor por defecto: el protocolo de multiprocessing usa pickle, una clave conocida permitiría
+# ejecutar código en el servicio
+INDEX_SERVICE_AUTHKEY = os.getenv("INDEX_SERVICE_AUTHKEY", "").strip().encode()
+# Conexiones abiertas por worker (llamadas simultáneas al servicio)
+INDEX_SERVICE_POOL = int(os.getenv("INDEX_SERVICE_POOL", "8"))
+# Cuánto espera un worker al arrancar a que el servicio acepte conexiones
+INDEX_SERVICE_CONNECT_TIMEOUT = float(os.getenv("INDEX_SERVICE_CONNECT_TIMEOUT", "120"))
+
+# Operaciones que el servicio acepta; cualquier otro nombre se rechaza
+OPERATIONS = frozenset({
+    "load_embedder", "load_vector_store", "embed", "query_by_embedding", "query_by_embeddings", "find_document_by_hash",
+    "add_document", "get_docs_for_session", "delete_docs_for_session", "delete_single_doc",
+    "backfill_lexical_index", "embedding_cache_stats", "vectordb_stats", "check_catalog", "backfill_catalog",
+    "vector_store_report", "compact_vector_store", "snapshot_vector_store", "warm_vector_store", "reembed",
+})
+
+
+def parse_address(text: str) -> str:
+    """"unix:/ruta" o una ruta → ruta del socket Unix. No se aceptan direcciones TCP."""
+    if text.startswith("unix:"):
+        return text[len("unix:"):]
+    host, sep, port = text.rpartition(":")
+    if sep and port.isdigit():
+        raise ValueError(f"INDEX_SERVICE_ADDRESS solo admite sockets Unix (unix:/ruta), no {text!r}")
+    return text
+
+
+def require_authkey(authkey: bytes) -> bytes:
+    if not authkey:
+        raise RuntimeError("INDEX_SERVICE_AUTHKEY es obligatoria cuando se usa el servicio de índice")
+    return authkey
+
+
+class LocalIndex:
+    """Embeddings e índice en este proceso (modo de un solo worker y lado servidor del servicio)."""
+
+    remote = False
+
+    def __init__(self):
+        import rag
+        self._rag = rag
+
+    def load_embedder(self) -> bool:
+        return self._rag.get_embedder() is not None
+
+    def load_vector_store(self) -> bool:
+        return self._rag.get_partitions() is not None
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        return self._rag._embed(texts)
+
+    def query_by_embedding(self, embedding, client_id, top_k=4, question=None):
+        return self._rag.query_by_embedding(embedding, client_id, top_k=top_k, question=question)
+
+    def query_by_embeddings(self, embeddings, client_id, top_k=4, questions=None):
+        return self._rag.query_by_embeddings(embeddings, client_id, top_k=top_k, questions=questions)
+
+    def find_document_by_hash(self, client_id, file_hash):
+        return self._rag.find_document_by_hash(client_id, file_hash)
+
+    def add_document(self, file_path, client_id, original_filename=None, progress=None):
+        return self._rag.add_document(file_path, client_id, original_filename=original_filename, progress=progress)
+
+    def get_docs_for_session(self, session_id, details=False):
+        return self._rag.get_docs_for_session(session_id, details=details)
+
+    def delete_docs_for_session(self, session_id):
+        return self._rag.delete_docs_for_session(session_id)
+
+    def delete_single_doc(self, session_id, filename):
+        return self._rag.delete_single_doc(session_id, filename)
+
+    def backfill_lexical_index(self) -> int:
+        return self._rag.backfill_lexical_index()
+
+    def check_catalog(self, fix=False) -> dict:
+        return self._rag.check_catalog(fix=fix)
+
+    def backfill_catalog(self):
+        return self._rag.backfill_catalog()
+
+    def vector_store_report(self, session_id=None, probes=20) -> dict:
+        import vector_maintenance
+        return vector_maintenance.report(session_id, probes=probes)
+
+    def compact_vector_store(self, session_id=None, force=False, min_deleted=None) -> dict:
+        import vector_maintenance
+        if min_deleted is None:
+            min_deleted = vector_maintenance.VECTOR_COMPACT_MIN_DELETED
+        return vector_maintenance.compact(session_id, force=force, min_deleted=min_deleted)
+
+    def snapshot_vector_store(self, include_uploads=True, archive=False, dest=None) -> dict:
+        import vector_maintenance
+        return vector_maintenance.snapshot(dest or vector_maintenance.SNAPSHOT_DIR, include_uploads=include_uploads,
+                                           archive=archive)
+
+    def warm_vector_store(self) -> dict:
+        import vector_maintenance
+        return vector_maintenance.warm()
+
+    def reembed(self, session_id=None, force=False, batch=None) -> int:
+        import embed_tools
+        return embed_tools.reembed_collections(session_id, force=force, batch=batch or self._rag.EMBED_BATCH)
+
+    def embedding_cache_stats(self) -> dict:
+        return self._rag.embedding_cache.stats()
+
+    def vectordb_stats(self) -> dict:
+        partitions = self._rag.get_partitions()
+        return partitions.stats() if partitions else {"available": False}
+
+    def stats(self) -> dict:
+        return {"mode": "local", "pid": os.getpid()}
+
+
+class RemoteIndex:
+    """Cliente del servicio: mismas operaciones que LocalIndex, ejecutadas en el proceso del servicio."""
+
+    remote = True
+
+    def __init__(self, address: str = INDEX_SERVICE_ADDRESS, authkey: bytes = INDEX_SERVICE_AUTHKEY,
+                 pool_size: int = INDEX_SERVICE_POOL):
+        self.address = parse_address(address)
+        self.authkey = require_authkey(authkey)
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max(1, pool_size))
+        self.pool_size = max(1, pool_size)
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "errors": 0, "connects": 0, "busy_ms": 0.0}
+
+    def _connect(self):
+        conn = Client(self.address, authkey=self.authkey)
+        with self._lock:
+            self._stats["connects"] += 1
+        return conn
+
+    def wait_available(self, timeout: float = INDEX_SERVICE_CONNECT_TIMEOUT) -> bool:
+        """Reintenta conectar hasta que el servicio arranque (los workers pueden iniciar antes)."""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self._idle.put(self._connect())
+                return True
+            except (OSError, EOFError) as e:
+                if time.monotonic() >= deadline:
+                    print(f"[INDEX] Servicio en {self.address} no disponible: {e}")
+                    return False
+                time.sleep(0.5)
+
+    def call(self, op: str, *args, progress=None, **kwargs):
+        self._slots.acquire()
+        start = time.perf_counter()
+        try:
+            kind, payload = self._roundtrip(op, args, kwargs, progress)
+        finally:
+            with self._lock:
+                self._stats["calls"] += 1
+                self._stats["busy_ms"] += (time.perf_counter() - start) * 1000
+            self._slots.release()
+        if kind == "error":
+            error_type, message = payload
+            raise (ValueError if error_type == "ValueError" else RuntimeError)(f"{op}: {message}")
+        return payload
+
+    def _roundtrip(self, op: str, args, kwargs, progress) -> tuple:
+        while True:
+            try:
+                conn, reused = self._idle.get_nowait(), True
+            except queue.Empty:
+                conn, reused = self._connect(), False
+            answered = False
+            try:
+                conn.send((op, args, kwargs, progress is not None))
+                while True:
+                    kind, payload = conn.recv()
+                    answered = True
+                    if kind != "progress":
+                        break
+                    progress(**payload)
+            except BaseException as e:
+                # Una respuesta a medio leer deja la conexión inservible
+                conn.close()
+                with self._lock:
+                    self._stats["errors"] += 1
+                # Conexión del pool que quedó muerta (el servicio se reinició): se reintenta con una nueva,
+                # salvo en la ingesta, que pudo haber avanzado
+                if reused and not answered and op != "add_document" and isinstance(e, (EOFError, OSError)):
+                    continue
+                raise
+            self._idle.put(conn)
+            return kind, payload
+
+    def __getattr__(self, name: str):
+        if name in OPERATIONS:
+            return lambda *args, **kwargs: self.call(name, *args, **kwargs)
+        raise AttributeError(name)
+
+    def load_embedder(self) -> bool:
+        return self.wait_available() and self.call("load_embedder")
+
+    def load_vector_store(self) -> bool:
+        return self.wait_available() and self.call("load_vector_store")
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["busy_ms"] = round(stats["busy_ms"], 1)
+        return {"mode": "remote", "address": str(self.address), "pool_size": self.pool_size,
+                "idle_connections": self._idle.qsize(), **stats}
+
+
+# --- Servidor ---
+
+def _handle(conn, local: LocalIndex):
+    try:
+        while True:
+            try:
+                op, args, kwargs, wants_progress = conn.recv()
+            except (EOFError, OSError):
+                return
+            if op not in OPERATIONS:
+                conn.send(("error", ("ValueError", f"operación desconocida: {op}")))
+                continue
+            if wants_progress:
+                kwargs["progress"] = lambda **fields: conn.send(("progress", fields))
+            try:
+                result = getattr(local, op)(*args, **kwargs)
+            except Exception as e:
+                print(f"[INDEX] Error en {op}:\n", traceback.format_exc())
+                conn.send(("error", (type(e).__name__, str(e))))
+                continue
+            try:
+                conn.send(("ok", result))
+            except (EOFError, OSError):
+                raise
+            except Exception as e:
+                # Resultado que no se puede serializar: se informa sin cortar la conexión
+                conn.send(("error", (type(e).__name__, str(e))))
+    except (EOFError, OSError):
+        return
+    finally:
+        conn.close()
+
+
+def serve(address: str, authkey: bytes = INDEX_SERVICE_AUTHKEY):
+    addr = parse_address(address)
+    require_authkey(authkey)
+    os.makedirs(os.path.dirname(os.path.abspath(addr)), exist_ok=True)
+    if os.path.exists(addr):
+        os.remove(addr)  # socket de una ejecución anterior
+    local = LocalIndex()
+
+    def preload():
+        start = time.perf_counter()
+        embedder, store = local.load_embedder(), local.load_vector_store()
+        print(f"[INDEX] Embeddings {'ok' if embedder else 'NO disponible'}, Chroma {'ok' if store else 'NO disponible'} "
+              f"({time.perf_counter() - start:.2f}s)")
+        if store:
+            try:
+                local.backfill_lexical_index()
+            except Exception as e:
+                print(f"[LEXICAL] No se pudo reconstruir el índice BM25: {e}")
+            try:
+                local.backfill_catalog()
+            except Exception as e:
+                print(f"[CATALOG] No se pudo reconstruir el catálogo de documentos: {e}")
+
+    # Se aceptan conexiones mientras cargan los modelos: load_* esperan la carga en curso
+    threading.Thread(target=preload, name="index-preload", daemon=True).start()
+    with Listener(addr, family="AF_UNIX", authkey=authkey) as listener:
+        os.chmod(addr, 0o600)
+        print(f"[INDEX] Servicio escuchando en {address} (pid {os.getpid()})")
+        while True:
+            try:
+                conn = listener.accept()
+            except (OSError, EOFError) as e:
+                # Cliente que falla la autenticación o corta durante el handshake
+                print(f"[INDEX] Conexión rechazada: {e}")
+                continue
+            threading.Thread(target=_handle, args=(conn, local), name="index-conn", daemon=True).start()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--address", default=INDEX_SERVICE_ADDRESS or "unix:storage/index.sock")
+    args = parser.parse_args(argv)
+    serve(args.address)
+
+
+index = RemoteIndex() if INDEX_SERVICE_ADDRESS else LocalIndex()
+
+
+def cli_target(command: str, offline: bool, hint: str = "", routable: bool = True):
+    """Dónde corre una CLI que escribe en Chroma: el servicio de índice o este mismo proceso.
+
+    Las escrituras solo se coordinan (gate, handles abiertos) dentro del proceso dueño de Chroma. Con
+    INDEX_SERVICE_ADDRESS la operación se envía al servicio si `routable`; si no lo es, se rechaza
+    mientras el servicio responda. Sin servicio solo corre aquí con --offline, que declara el backend
+    detenido. Devuelve el cliente del servicio o None (ejecutar aquí); sale con un mensaje si no es seguro.
+    """
+    if index.remote and routable:
+        if offline:
+            sys.exit("--offline no aplica con INDEX_SERVICE_ADDRESS: la operación corre en el servicio de índice")
+        if not index.wait_available(timeout=10):
+            sys.exit("El servicio de índice no responde")
+        return index
+    if index.remote and index.wait_available(timeout=2):
+        sys.exit(f"{command}: el servicio de índice en {INDEX_SERVICE_ADDRESS} está en marcha y es el dueño de "
+                 "Chroma; detenerlo (y el backend) antes")
+    if not offline:
+        sys.exit(f"{command} escribe en Chroma fuera del proceso dueño del índice. {hint}"
+                 "Con el backend detenido, repetir con --offline")
+    return None
+
+
+if __name__ == "__main__":
+    main()
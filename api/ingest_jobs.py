@@ -0,0 +1,335 @@
+"""Cola de ingesta en background para /upload_pdf.
+
+La subida solo guarda el archivo y encola un job; un pool acotado de workers ejecuta
+rag.add_document fuera del request. El estado vive en SQLite (junto a CHROMA_DIR), así los jobs
+sobreviven a reinicios: los que quedaron en curso se vuelven a encolar al arrancar y los fallidos
+pueden reintentarse sin volver a subir el archivo.
+
+Con varios workers de uvicorn cada job queda asignado al proceso que lo recibió (owner_pid); al
+arrancar, un proceso solo retoma jobs propios o de procesos que ya no existen, y el paso a
+'running' es condicional para que dos procesos nunca ejecuten el mismo job.
+"""
+import os
+import time
+import uuid
+import sqlite3
+import asyncio
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import rag
+from index_service import index
+from doc_catalog import doc_catalog
+from metrics import metrics
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+JOBS_DB = os.getenv("JOBS_DB", os.path.join(os.path.dirname(rag.CHROMA_DIR) or ".", "jobs.db"))
+# Intervalo mínimo entre escrituras de progreso de un mismo job
+PROGRESS_FLUSH_SECONDS = 1.0
+
+JOB_FIELDS = (
+    "id", "session_id", "file_path", "original_filename", "status", "attempts", "error",
+    "pages_total", "pages_parsed", "chunks_total", "chunks_embedded", "chunks_reused",
+    "created_at", "started_at", "finished_at",
+)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class IngestQueue:
+    def __init__(self, db_path: str = JOBS_DB, workers: int = INGEST_WORKERS):
+        self.db_path = db_path
+        self.workers = max(1, workers)
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self._queue: asyncio.Queue | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._executor: ThreadPoolExecutor | None = None
+        self._live: dict[str, dict] = {}  # progreso en memoria de los jobs en curso
+        self._last_flush: dict[str, float] = {}
+        self._listeners = []
+
+    # --- Persistencia ---
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    session_id TEXT NOT NULL,
+                    file_path TEXT NOT NULL,
+                    original_filename TEXT,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    pages_total INTEGER,
+                    pages_parsed INTEGER NOT NULL DEFAULT 0,
+                    chunks_total INTEGER,
+                    chunks_embedded INTEGER NOT NULL DEFAULT 0,
+                    chunks_reused INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    owner_pid INTEGER
+                )"""
+            )
+            # Bases creadas antes de registrar fragmentos reutilizados o el proceso dueño
+            for column in ("chunks_reused INTEGER NOT NULL DEFAULT 0", "owner_pid INTEGER"):
+                try:
+                    self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column}")
+                except sqlite3.OperationalError:
+                    pass
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_session ON jobs(session_id, created_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status)")
+            self._conn.commit()
+        return self._conn
+
+    def _update(self, job_id: str, **fields):
+        cols = ", ".join(f"{k} = ?" for k in fields)
+        with self._lock:
+            db = self._db()
+            db.execute(f"UPDATE jobs SET {cols} WHERE id = ?", (*fields.values(), job_id))
+            db.commit()
+
+    def _row(self, job_id: str) -> dict | None:
+        with self._lock:
+            row = self._db().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    # --- API pública ---
+
+    def on_done(self, fn):
+        """Registra un callback fn(job) que se llama cuando un documento termina de indexarse."""
+        self._listeners.append(fn)
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ingest")
+        # Jobs interrumpidos por un reinicio vuelven a la cola (los de otros workers vivos no se tocan)
+        me = os.getpid()
+        pending = []
+        with self._lock:
+            db = self._db()
+            rows = db.execute(
+                "SELECT id, status, owner_pid FROM jobs WHERE status IN ('queued', 'running') ORDER BY created_at"
+            ).fetchall()
+            for row in rows:
+                owner = row["owner_pid"]
+                if owner is not None and owner != me and _pid_alive(owner):
+                    continue
+                cur = db.execute(
+                    "UPDATE jobs SET status = 'queued', owner_pid = ? WHERE id = ? AND status = ? AND owner_pid IS ?",
+                    (me, row["id"], row["status"], owner),
+                )
+                if cur.rowcount:
+                    pending.append(row["id"])
+            db.commit()
+        for job_id in pending:
+            self._queue.put_nowait(job_id)
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+        if pending:
+            print(f"[INGEST] {len(pending)} jobs pendientes reencolados")
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def submit(self, file_path: str, session_id: str, original_filename: str | None = None) -> dict:
+        if not self._tasks:
+            await self.start()
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT INTO jobs (id, session_id, file_path, original_filename, status, created_at, owner_pid) "
+                "VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+                (job_id, session_id, file_path, original_filename, time.time(), os.getpid()),
+            )
+            db.commit()
+        await self._queue.put(job_id)
+        return self.get(job_id)
+
+    async def retry(self, job_id: str) -> dict | None:
+        """Reencola un job fallido; devuelve None si no existe."""
+        job = self._row(job_id)
+        if job is None:
+            return None
+        if job["status"] != "failed":
+            raise ValueError(f"Solo se pueden reintentar jobs fallidos (estado actual: {job['status']})")
+        if not os.path.exists(job["file_path"]):
+            raise ValueError("El archivo del job ya no existe; hay que subirlo nuevamente")
+        if not self._tasks:
+            await self.start()
+        self._update(job_id, status="queued", error=None, pages_parsed=0, chunks_embedded=0, chunks_reused=0,
+                     pages_total=None, chunks_total=None, started_at=None, finished_at=None, owner_pid=os.getpid())
+        await self._queue.put(job_id)
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> dict | None:
+        job = self._row(job_id)
+        if job is None:
+            return None
+        job.update(self._live.get(job_id, {}))
+        return self._describe(job)
+
+    def list(self, session_id: str, limit: int = 50) -> list[dict]:
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT * FROM jobs WHERE session_id = ? ORDER BY created_at DESC LIMIT ?", (session_id, limit)
+            ).fetchall()
+        out = []
+        for row in rows:
+            job = dict(row)
+            job.update(self._live.get(job["id"], {}))
+            out.append(self._describe(job))
+        return out
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._db().execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "running": len(self._live),
+            "by_status": {r["status"]: r["n"] for r in rows},
+        }
+
+    # --- Workers ---
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job_id = await self._queue.get()
+            now = time.time()
+            job = self._claim(job_id, now)
+            if job is None:
+                continue
+            self._live[job_id] = {"status": "running", "started_at": now}
+            try:
+                if not os.path.exists(job["file_path"]):
+                    raise FileNotFoundError("El archivo fue eliminado antes de procesarse")
+                chunks = await loop.run_in_executor(
+                    self._executor, self._run, job_id, job["file_path"], job["session_id"], job["original_filename"]
+                )
+                live = self._live.get(job_id, {})
+                finished = time.time()
+                self._update(
+                    job_id, status="done", finished_at=finished,
+                    pages_total=live.get("pages_total"), pages_parsed=live.get("pages_parsed", 0),
+                    chunks_total=chunks, chunks_embedded=chunks, chunks_reused=live.get("chunks_reused", 0),
+                )
+                metrics.inc("ingest_jobs_total", status="done")
+                metrics.inc("ingest_pages_total", live.get("pages_parsed", 0))
+                metrics.inc("ingest_chunks_total", chunks)
+                metrics.inc("ingest_chunks_reused_total", live.get("chunks_reused", 0))
+                metrics.observe("ingest_job_seconds", finished - now)
+                for fn in self._listeners:
+                    try:
+                        fn(job)
+                    except Exception:
+                        print(f"[INGEST] Error en callback de job {job_id}:\n", traceback.format_exc())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[INGEST] Job {job_id} falló:\n", traceback.format_exc())
+                self._flush(job_id)
+                self._update(job_id, status="failed", error=str(e), finished_at=time.time())
+                doc_catalog.set_status(os.path.basename(job["file_path"]), "failed")
+                metrics.inc("ingest_jobs_total", status="failed")
+            finally:
+                self._live.pop(job_id, None)
+                self._last_flush.pop(job_id, None)
+
+    def _claim(self, job_id: str, now: float) -> dict | None:
+        """Pasa el job de 'queued' a 'running' si nadie lo tomó antes; None si ya no está en cola."""
+        with self._lock:
+            db = self._db()
+            cur = db.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, error = NULL, owner_pid = ? "
+                "WHERE id = ? AND status = 'queued'",
+                (now, os.getpid(), job_id),
+            )
+            db.commit()
+            if not cur.rowcount:
+                return None
+            return dict(db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def _run(self, job_id: str, file_path: str, session_id: str, original_filename: str | None) -> int:
+        def progress(**fields):
+            live = self._live.setdefault(job_id, {})
+            live.update(fields)
+            if time.time() - self._last_flush.get(job_id, 0) >= PROGRESS_FLUSH_SECONDS:
+                self._flush(job_id)
+        return index.add_document(file_path, session_id, original_filename=original_filename, progress=progress)
+
+    def _flush(self, job_id: str):
+        live = {k: v for k, v in self._live.get(job_id, {}).items() if k in JOB_FIELDS and k not in ("status", "started_at")}
+        self._last_flush[job_id] = time.time()
+        if live:
+            self._update(job_id, **live)
+
+    # --- Presentación ---
+
+    @staticmethod
+    def _describe(job: dict) -> dict:
+        """Agrega fase, porcentaje y ETA estimada a partir de las tasas observadas."""
+        now = time.time()
+        eta = None
+        phase = job["status"]
+        if job["status"] == "running":
+            # Extracción, fragmentado y embedding avanzan juntos página a página: la ETA sale del ritmo de páginas
+            phase = "embedding" if job.get("chunks_embedded") else "parsing"
+            done, total = job.get("pages_parsed") or 0, job.get("pages_total")
+            since = job.get("started_at")
+            if total and done and since:
+                rate = done / max(now - since, 1e-6)
+                eta = round((total - done) / rate, 1)
+        elif job["status"] == "done":
+            eta = 0
+        return {
+            "job_id": job["id"],
+            "session_id": job["session_id"],
+            "filename": os.path.basename(job["file_path"]),
+            "original_filename": job.get("original_filename"),
+            "status": job["status"],
+            "phase": phase,
+            "attempts": job.get("attempts") or 0,
+            "error": job.get("error"),
+            "pages_total": job.get("pages_total"),
+            "pages_parsed": job.get("pages_parsed") or 0,
+            "chunks_total": job.get("chunks_total"),
+            "chunks_embedded": job.get("chunks_embedded") or 0,
+            "chunks_reused": job.get("chunks_reused") or 0,
+            "eta_seconds": eta,
+            "created_at": job.get("created_at"),
+            "started_at": job.get("started_at"),
+            "finished_at": job.get("finished_at"),
+        }
+
+
+ingest_queue = IngestQueue()
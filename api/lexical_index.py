@@ -0,0 +1,167 @@
+"""Índice invertido BM25 sobre los mismos fragmentos que se guardan en Chroma.
+
+Complementa la búsqueda vectorial en coincidencias exactas (códigos de producto, nombres, números)
+que los embeddings suelen perder. Se persiste en SQLite junto a CHROMA_DIR y se mantiene en
+add_document y en las eliminaciones de documentos.
+"""
+import os
+import re
+import math
+import sqlite3
+import threading
+import unicodedata
+from collections import Counter
+
+LEXICAL_DB = os.getenv("LEXICAL_DB", os.path.join(os.path.dirname(os.getenv("CHROMA_DIR", "storage/vectordb")) or ".", "lexical.db"))
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+STOPWORDS = frozenset("""
+a al algo ante con contra de del desde donde e el ella ellas ellos en entre era es esa ese eso esta este esto
+fue ha hay la las le les lo los mas me mi muy no nos o para pero por que quien se sea segun ser si sin sobre
+son su sus tambien te tiene tu un una uno unos y ya cual cuales como cuando
+""".split())
+
+# Palabras y códigos tipo "AB-123", "v2.5" o "12/03/2024"
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-./][a-z0-9]+)*")
+
+
+def tokenize(text: str) -> list[str]:
+    text = unicodedata.normalize("NFD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    tokens = []
+    for tok in _TOKEN_RE.findall(text):
+        if tok in STOPWORDS:
+            continue
+        tokens.append(tok)
+        # Los códigos compuestos también se indexan por sus partes
+        if not tok.isalnum():
+            tokens.extend(p for p in re.split(r"[-./]", tok) if p and p not in STOPWORDS)
+    return tokens
+
+
+class LexicalIndex:
+    def __init__(self, db_path: str = LEXICAL_DB):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS chunks (
+                    chunk_id TEXT PRIMARY KEY,
+                    client_id TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    length INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS chunks_client_source ON chunks(client_id, source);
+                CREATE TABLE IF NOT EXISTS postings (
+                    client_id TEXT NOT NULL,
+                    term TEXT NOT NULL,
+                    chunk_id TEXT NOT NULL,
+                    tf INTEGER NOT NULL,
+                    PRIMARY KEY (client_id, term, chunk_id)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS postings_chunk ON postings(chunk_id);
+                CREATE TABLE IF NOT EXISTS client_stats (
+                    client_id TEXT PRIMARY KEY,
+                    n_chunks INTEGER NOT NULL,
+                    total_length INTEGER NOT NULL
+                );
+                """
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _remove_chunks(self, db: sqlite3.Connection, client_id: str, chunk_ids: list[str]):
+        for i in range(0, len(chunk_ids), 500):
+            part = chunk_ids[i:i + 500]
+            marks = ",".join("?" * len(part))
+            rows = db.execute(f"SELECT COUNT(*), COALESCE(SUM(length), 0) FROM chunks WHERE chunk_id IN ({marks})", part).fetchone()
+            if not rows[0]:
+                continue
+            db.execute(f"DELETE FROM postings WHERE chunk_id IN ({marks})", part)
+            db.execute(f"DELETE FROM chunks WHERE chunk_id IN ({marks})", part)
+            db.execute("UPDATE client_stats SET n_chunks = n_chunks - ?, total_length = total_length - ? WHERE client_id = ?",
+                       (rows[0], rows[1], client_id))
+
+    def add(self, client_id: str, source: str, items: list[tuple[str, str]]):
+        """Indexa (chunk_id, texto); reindexar un chunk_id existente lo reemplaza."""
+        if not items:
+            return
+        chunk_rows, posting_rows = [], []
+        total = 0
+        for chunk_id, text in items:
+            terms = Counter(tokenize(text))
+            length = sum(terms.values())
+            total += length
+            chunk_rows.append((chunk_id, client_id, source, length))
+            posting_rows.extend((client_id, term, chunk_id, tf) for term, tf in terms.items())
+        with self._lock:
+            db = self._db()
+            self._remove_chunks(db, client_id, [c for c, _ in items])
+            db.executemany("INSERT INTO chunks (chunk_id, client_id, source, length) VALUES (?, ?, ?, ?)", chunk_rows)
+            db.executemany("INSERT INTO postings (client_id, term, chunk_id, tf) VALUES (?, ?, ?, ?)", posting_rows)
+            db.execute(
+                """INSERT INTO client_stats (client_id, n_chunks, total_length) VALUES (?, ?, ?)
+                   ON CONFLICT(client_id) DO UPDATE SET n_chunks = n_chunks + excluded.n_chunks,
+                   total_length = total_length + excluded.total_length""",
+                (client_id, len(chunk_rows), total),
+            )
+            db.commit()
+
+    def delete_source(self, client_id: str, source: str):
+        with self._lock:
+            db = self._db()
+            ids = [r[0] for r in db.execute("SELECT chunk_id FROM chunks WHERE client_id = ? AND source = ?", (client_id, source))]
+            self._remove_chunks(db, client_id, ids)
+            db.commit()
+
+    def delete_client(self, client_id: str):
+        with self._lock:
+            db = self._db()
+            db.execute("DELETE FROM postings WHERE client_id = ?", (client_id,))
+            db.execute("DELETE FROM chunks WHERE client_id = ?", (client_id,))
+            db.execute("DELETE FROM client_stats WHERE client_id = ?", (client_id,))
+            db.commit()
+
+    def count(self, client_id: str | None = None) -> int:
+        with self._lock:
+            db = self._db()
+            if client_id is None:
+                return db.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+            row = db.execute("SELECT n_chunks FROM client_stats WHERE client_id = ?", (client_id,)).fetchone()
+            return row[0] if row else 0
+
+    def search(self, client_id: str, query: str, top_k: int = 10) -> list[tuple[str, float]]:
+        """Top-k (chunk_id, score BM25) de la sesión para la consulta."""
+        terms = Counter(tokenize(query))
+        if not terms:
+            return []
+        with self._lock:
+            db = self._db()
+            stats = db.execute("SELECT n_chunks, total_length FROM client_stats WHERE client_id = ?", (client_id,)).fetchone()
+            if not stats or not stats[0]:
+                return []
+            marks = ",".join("?" * len(terms))
+            rows = db.execute(
+                f"""SELECT p.term, p.chunk_id, p.tf, c.length FROM postings p JOIN chunks c ON c.chunk_id = p.chunk_id
+                    WHERE p.client_id = ? AND p.term IN ({marks})""",
+                (client_id, *terms),
+            ).fetchall()
+        n, avgdl = stats[0], stats[1] / stats[0] or 1.0
+        df = Counter(term for term, _, _, _ in rows)
+        scores: dict[str, float] = {}
+        for term, chunk_id, tf, length in rows:
+            idf = math.log(1 + (n - df[term] + 0.5) / (df[term] + 0.5))
+            norm = tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avgdl))
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * norm * terms[term]
+        return sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:top_k]
+
+
+lexical_index = LexicalIndex()
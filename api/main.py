@@ -2,128 +2,238 @@
 
 
 import os
+import time
 import uuid
-import shutil
-import httpx
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Response, Body
+import hashlib
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Response, Query
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from dotenv import load_dotenv
+from readiness import readiness
 import rag
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse
 
 load_dotenv()
 
-OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434")
-DEFAULT_MODEL = os.getenv("MODEL_NAME", "qwen2.5:1.5b")  # actualizado default
+from ollama_client import ollama
+from embedding_service import embeddings
+from ingest_jobs import ingest_queue
+from answer_cache import answer_cache
+from context_packer import pack_context
+from reranker import reranker, RERANK_CANDIDATES, RERANK_TOP_N
+from metrics import metrics, RequestTimings, record_ollama
+from settings_store import settings, DEFAULT_MODEL
+from index_service import index
+from doc_catalog import doc_catalog
+from admission import admission, AdmissionRejected, PRIORITY_CHAT, PRIORITY_BACKGROUND
+from model_residency import residency, MODEL_KEEP_ALIVE
+from vector_maintenance import VECTOR_WARMUP_ENABLED
+
+def invalidate_session(session_id: str):
+    # La versión del corpus vive en el store compartido: los demás workers invalidan al detectar el cambio
+    settings.incr(f"corpus_version:{session_id}")
+
+@settings.on_change
+def _on_setting_changed(key: str, value: str):
+    if key.startswith("corpus_version:"):
+        answer_cache.invalidate(key.split(":", 1)[1])
+
+# Un documento recién indexado cambia las respuestas posibles de su sesión
+ingest_queue.on_done(lambda job: invalidate_session(job["session_id"]))
+# Fragmentos recuperados por pregunta (la búsqueda híbrida permite menos que los 12 de antes)
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "6"))
 
 app = FastAPI(title="Chat PDF + Ollama")
 
+# Duración por ruta (hasta que empieza la respuesta; en streaming, el resto queda en stage_seconds)
+@app.middleware("http")
+async def observe_request(request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    metrics.observe("http_request_duration_seconds", time.perf_counter() - start,
+                    path=getattr(route, "path", "sin_ruta"), method=request.method, status=response.status_code)
+    return response
+
 # Precalentar modelo seleccionado al iniciar el backend (en background)
 import asyncio
 
-# --- Keep Alive del modelo ---
-MODEL_KEEPALIVE_ENABLED = os.getenv("MODEL_KEEPALIVE_ENABLED", "true").lower() in ("1", "true", "yes")
-MODEL_KEEPALIVE_INTERVAL = int(os.getenv("MODEL_KEEPALIVE_INTERVAL", "300"))  # segundos (default 5 min)
+async def _warmup_selected_model():
+    # Carga sin generar tokens; la residencia posterior la maneja model_residency
+    model = settings.selected_model()
+    if not settings.claim("lease:warmup", 60):
+        print(f"[STARTUP] Precalentamiento de {model} ya iniciado por otro worker")
+        return
+    if not await residency.preload(model):
+        raise RuntimeError(f"No se pudo precalentar el modelo {model}")
+
+async def _load_component(loader, label: str):
+    # Hilo del pool por defecto: no ocupa los workers de embeddings mientras carga
+    if not await asyncio.get_running_loop().run_in_executor(None, loader):
+        raise RuntimeError(f"{label} no disponible, revisar los logs")
 
-async def _ping_model(model: str):
+async def _backfill_lexical_index():
+    # Con el servicio de índice compartido, la reconstrucción la hace ese proceso al arrancar
+    if index.remote or not await readiness.wait("chroma", timeout=None):
+        return
     try:
-        async with httpx.AsyncClient(timeout=30) as client:
-            await client.post(f"{OLLAMA_URL}/api/chat", json={
-                "model": model,
-                "messages": [{"role": "user", "content": "ping"}]
-            })
+        await embeddings.run(index.backfill_lexical_index)
     except Exception as e:
-        print(f"[KEEPALIVE] Falló ping a {model}: {e}")
-
-async def _keepalive_loop():
-    # Lee siempre el modelo actual (por si cambió)
-    while True:
-        try:
-            model_path = os.path.join(os.path.dirname(__file__), "model_selected.txt")
-            if os.path.exists(model_path):
-                with open(model_path, "r", encoding="utf-8") as f:
-                    model = f.read().strip()
-            else:
-                model = DEFAULT_MODEL
-            await _ping_model(model)
-        except Exception as e:
-            print(f"[KEEPALIVE] Error general: {e}")
-        await asyncio.sleep(MODEL_KEEPALIVE_INTERVAL)
+        print(f"[LEXICAL] No se pudo reconstruir el índice BM25: {e}")
+    try:
+        await embeddings.run(index.backfill_catalog)
+    except Exception as e:
+        print(f"[CATALOG] No se pudo reconstruir el catálogo de documentos: {e}")
 
-def warmup_selected_model_background():
-    async def warmup():
-        try:
-            model_path = os.path.join(os.path.dirname(__file__), "model_selected.txt")
-            if os.path.exists(model_path):
-                with open(model_path, "r", encoding="utf-8") as f:
-                    model = f.read().strip()
-            else:
-                model = DEFAULT_MODEL
-            async with httpx.AsyncClient(timeout=60) as client:
-                await client.post(f"{OLLAMA_URL}/api/chat", json={
-                    "model": model,
-                    "messages": [{"role": "user", "content": "Hola"}]
-                })
-        except Exception as e:
-            print(f"[WARN] No se pudo precalentar el modelo {model}: {e}")
+async def _warm_vector_store():
+    # Páginas del índice en memoria y consultas sintéticas antes de que /ready informe listo
+    if not await readiness.wait("chroma", timeout=None):
+        raise RuntimeError("Chroma no disponible")
     try:
-        loop = asyncio.get_event_loop()
-        loop.create_task(warmup())
-    except RuntimeError:
-        # Si no hay loop, ignora (esto solo ocurre en contextos muy raros)
-        pass
+        await asyncio.to_thread(index.warm_vector_store)
+    except Exception as e:
+        # Sin precalentamiento la API funciona igual, solo con las primeras consultas más lentas
+        print(f"[WARMUP] No se pudo precalentar el índice: {e}")
 
 @app.on_event("startup")
-def on_startup():
-    warmup_selected_model_background()
-    if MODEL_KEEPALIVE_ENABLED:
-        try:
-            loop = asyncio.get_event_loop()
-            loop.create_task(_keepalive_loop())
-            print(f"[KEEPALIVE] Activado cada {MODEL_KEEPALIVE_INTERVAL}s")
-        except RuntimeError:
-            print("[KEEPALIVE] No se pudo iniciar la tarea background")
+async def on_startup():
+    await settings.start()
+    await ollama.start()
+    await embeddings.start()
+    await ingest_queue.start()
+    reranker.preload()
+    # Chroma y el modelo de embeddings cargan en background (o en el servicio de índice): /health y /models responden desde ya
+    readiness.track("chroma", _load_component(index.load_vector_store, "Chroma"))
+    readiness.track("embedder", _load_component(index.load_embedder, "Modelo de embeddings"))
+    readiness.track("ollama_warmup", _warmup_selected_model())
+    if VECTOR_WARMUP_ENABLED:
+        readiness.require("vector_warmup")
+        readiness.track("vector_warmup", _warm_vector_store())
+    asyncio.get_running_loop().create_task(_backfill_lexical_index())
+    await residency.start()
+    print(f"[STARTUP] API disponible en {readiness.uptime():.2f}s, componentes cargando en background")
 
+@app.on_event("shutdown")
+async def on_shutdown():
+    await residency.close()
+    await ollama.close()
+    await ingest_queue.close()
+    await embeddings.close()
+    await settings.close()
 
-# Registrar routers
+
+# Registrar routers (GET/POST /selected_model viven en routers/model.py)
 from routers import model as model_router
 app.include_router(model_router.router)
 
-# Endpoint para obtener el modelo seleccionado globalmente
-@app.get("/selected_model")
-def get_selected_model():
-    try:
-        with open(os.path.join(os.path.dirname(__file__), "model_selected.txt"), "r", encoding="utf-8") as f:
-            model = f.read().strip()
-        return {"selected_model": model}
-    except Exception as e:
-        return {"selected_model": DEFAULT_MODEL, "error": str(e)}
-
-# Endpoint para actualizar el modelo seleccionado globalmente
-@app.post("/selected_model")
-def set_selected_model(model: str = Body(..., embed=True)):
-    try:
-        with open(os.path.join(os.path.dirname(__file__), "model_selected.txt"), "w", encoding="utf-8") as f:
-            f.write(model.strip())
-        return {"ok": True, "selected_model": model.strip()}
-    except Exception as e:
-        return {"ok": False, "error": str(e)}
-
 # Endpoint para listar modelos descargados en Ollama
 @app.get("/models")
 async def list_available_models():
     try:
-        async with httpx.AsyncClient(timeout=10) as client:
-            r = await client.get(f"{OLLAMA_URL}/api/tags")
-            r.raise_for_status()
-            data = r.json()
+        data = await ollama.get_json("/api/tags", timeout=10)
         # Extraer solo el nombre del modelo descargado
         models = [m["name"] for m in data.get("models", [])]
         return {"models": models}
     except Exception as e:
         return Response(content=f"Error consultando modelos: {e}", status_code=500)
 
+# Estado del pool de conexiones hacia Ollama (para detectar saturación)
+@app.get("/ollama/stats")
+def ollama_stats():
+    return ollama.stats()
+
+# Modelos cargados en Ollama, vencimiento de su keep_alive y presupuesto de memoria
+@app.get("/models/resident")
+def resident_models():
+    return residency.stats()
+
+# Admisión por modelo: límite, cola, esperas y rechazos (para dimensionar capacidad)
+@app.get("/admission/stats")
+def admission_stats():
+    return admission.stats()
+
+# Aciertos de la caché de respuestas de /chat
+@app.get("/answer_cache/stats")
+def answer_cache_stats():
+    return answer_cache.stats()
+
+# Re-ranking con cross-encoder (latencia por par y caídas al orden de recuperación)
+@app.get("/rerank/stats")
+def rerank_stats():
+    return reranker.stats()
+
+# Colecciones de Chroma por sesión (handles abiertos y migración desde "docs")
+@app.get("/vectordb/stats")
+def vectordb_stats():
+    return index.vectordb_stats()
+
+# El mantenimiento corre en el pool por defecto: no ocupa los threads de embeddings y consultas
+@app.get("/vectordb/report")
+async def vectordb_report(session_id: str = Query(None), probes: int = Query(20, ge=0, le=200)):
+    await wait_until_ready("chroma")
+    return await asyncio.to_thread(index.vector_store_report, session_id, probes=probes)
+
+# Compactación en línea: las consultas siguen respondiendo, las escrituras esperan a que termine
+@app.post("/vectordb/compact")
+async def vectordb_compact(session_id: str = Query(None), force: bool = Query(False)):
+    await wait_until_ready("chroma")
+    return await asyncio.to_thread(index.compact_vector_store, session_id, force=force)
+
+@app.post("/vectordb/snapshot")
+async def vectordb_snapshot(include_uploads: bool = Query(True), archive: bool = Query(False)):
+    await wait_until_ready("chroma")
+    return await asyncio.to_thread(index.snapshot_vector_store, include_uploads=include_uploads, archive=archive)
+
+# Agrupamiento de embeddings de consultas
+@app.get("/embeddings/stats")
+def embeddings_stats():
+    return {**embeddings.stats(), "cache": index.embedding_cache_stats()}
+
+# Modo del índice (en proceso o servicio compartido) y store de configuración de este worker
+@app.get("/index/stats")
+def index_stats():
+    return {**index.stats(), "settings": settings.stats()}
+
+# Métricas en formato de texto de Prometheus
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@metrics.collector
+def component_metrics():
+    """Contadores y estado de cachés, pools y colas, leídos de sus stats() en cada scrape."""
+    a = answer_cache.stats()
+    for result, key in (("exact_hit", "exact_hits"), ("semantic_hit", "semantic_hits"), ("miss", "misses")):
+        yield "answer_cache_lookups_total", "counter", "Búsquedas en la caché de respuestas", {"result": result}, a[key]
+    yield "answer_cache_entries", "gauge", "Respuestas en caché", {}, a["entries"]
+    e = index.embedding_cache_stats()
+    for result, key in (("memory_hit", "memory_hits"), ("disk_hit", "disk_hits"), ("miss", "misses")):
+        yield "embedding_cache_lookups_total", "counter", "Búsquedas en la caché de embeddings", {"result": result}, e[key]
+    r = reranker.stats()
+    yield "rerank_total", "counter", "Consultas re-rankeadas", {}, r["reranked"]
+    for reason in ("budget", "timeout", "unavailable"):
+        yield "rerank_fallbacks_total", "counter", "Consultas que usaron el orden de recuperación", {"reason": reason}, r[f"fallback_{reason}"]
+    o = ollama.stats()
+    yield "ollama_in_flight", "gauge", "Requests en curso hacia Ollama", {}, o["in_flight"]
+    yield "ollama_waiting", "gauge", "Requests esperando un slot de Ollama", {}, o["waiting"]
+    yield "ollama_requests_total", "counter", "Requests hacia Ollama", {}, o["requests"]
+    yield "ollama_retries_total", "counter", "Reintentos hacia Ollama", {}, o["retries"]
+    yield "ollama_errors_total", "counter", "Errores hablando con Ollama", {}, o["errors"]
+    for model, r in residency.stats()["resident"].items():
+        yield "model_resident_bytes", "gauge", "Memoria de los modelos cargados en Ollama (/api/ps)", {"model": model}, r["size_mb"] * (1 << 20)
+        yield "model_resident_expires_seconds", "gauge", "Segundos hasta que Ollama descargue el modelo", {"model": model}, r["expires_in"]
+    for model, g in admission.stats()["models"].items():
+        yield "admission_queued", "gauge", "Requests esperando lugar en el modelo", {"model": model}, g["queued"]
+        yield "admission_active", "gauge", "Generaciones en curso por modelo", {"model": model}, g["active"]
+        yield "admission_limit", "gauge", "Generaciones simultáneas permitidas por modelo", {"model": model}, g["limit"]
+    q = embeddings.stats()
+    yield "query_embeddings_total", "counter", "Consultas embebidas", {}, q["queries"]
+    yield "query_embedding_batches_total", "counter", "Lotes de embeddings de consultas", {}, q["batches"]
+    j = ingest_queue.stats()
+    yield "ingest_queued", "gauge", "Jobs de ingesta en cola", {}, j["queued"]
+    yield "ingest_running", "gauge", "Jobs de ingesta en ejecución", {}, j["running"]
+
 
 
 # Prompt configurable desde .env o variable de entorno, o valor por defecto editable aquí
@@ -142,27 +252,44 @@ app.mount("/storage/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
 UPLOAD_DIR = os.path.abspath(rag.UPLOAD_DIR)
 app.mount("/storage/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
 
-from fastapi import Query
-
-# Endpoint para listar documentos de una sesión
+# Endpoint para listar documentos de una sesión (desde el catálogo, con estado, páginas y fragmentos)
 @app.get("/context/docs")
 def get_context_docs(session_id: str = Query("global")):
-    docs = rag.get_docs_for_session(session_id)
-    return {"docs": docs}
+    documents = doc_catalog.list_session(session_id)
+    return {"docs": [d["stored_name"] for d in documents], "documents": documents}
+
+# Reconciliación del catálogo con el directorio de subidas y Chroma (fix=true corrige)
+@app.post("/catalog/check")
+async def check_catalog(fix: bool = Query(False)):
+    await wait_until_ready("chroma")
+    return await embeddings.run(index.check_catalog, fix=fix)
+
+@app.get("/catalog/stats")
+def catalog_stats():
+    return doc_catalog.stats()
 
 # Endpoint para eliminar todos los documentos de una sesión
 @app.delete("/context/docs")
 def delete_all_docs(session_id: str = Query("global")):
-    rag.delete_docs_for_session(session_id)
+    index.delete_docs_for_session(session_id)
+    invalidate_session(session_id)
     return {"ok": True, "message": f"Todos los documentos de la sesión '{session_id}' han sido eliminados."}
 
 # Endpoint para eliminar un documento específico de una sesión
 @app.delete("/context/docs/{filename}")
 def delete_doc(session_id: str = Query("global"), filename: str = ""):
+    # La versión del corpus sube después de borrar: un chat que empiece antes ya no puede
+    # cachear una respuesta con el documento bajo la versión nueva
     try:
-        rag.delete_single_doc(session_id, filename)
+        if not index.delete_single_doc(session_id, filename):
+            # No existe o es de otra sesión: no se borró nada
+            return JSONResponse(status_code=404, content={
+                "ok": False, "message": f"El documento '{filename}' no existe en la sesión '{session_id}'."})
+        invalidate_session(session_id)
         return {"ok": True, "message": f"Documento '{filename}' eliminado de la sesión '{session_id}'."}
     except Exception as e:
+        # El borrado pudo quedar a medias: se invalida igual
+        invalidate_session(session_id)
         # Siempre devolver éxito para evitar error en frontend, pero loguear el error
         print(f"Error eliminando documento: {e}")
         return {"ok": True, "message": f"Documento '{filename}' eliminado de la sesión '{session_id}' (con advertencia)."}
@@ -182,55 +309,156 @@ class ChatIn(BaseModel):
     locale: str | None = None
     max_tokens: int | None = None
     score_threshold: float | None = None
+    use_cache: bool = True  # False para forzar una respuesta nueva del modelo
 
 @app.get("/")
 def root():
-    return {"ok": True, "service": "Chat PDF + Ollama", "endpoints": ["/health", "/upload_pdf", "/chat", "/docs"]}
+    return {"ok": True, "service": "Chat PDF + Ollama", "endpoints": ["/health", "/ready", "/upload_pdf", "/jobs/{job_id}", "/chat", "/chat/stream", "/chat/batch", "/docs"]}
 
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
+# Readiness: 200 cuando el modelo de embeddings y Chroma están cargados, 503 mientras tanto
+@app.get("/ready")
+def ready():
+    snapshot = readiness.snapshot()
+    return JSONResponse(snapshot, status_code=200 if snapshot["ready"] else 503)
+
+def admission_error(e: AdmissionRejected) -> HTTPException:
+    return HTTPException(status_code=e.status_code, detail=e.detail, headers=e.headers())
+
+def check_admission(body: "ChatIn"):
+    """429 antes de recuperar contexto si la cola del modelo ya está llena."""
+    try:
+        admission.precheck(chat_options(body)[0])
+    except AdmissionRejected as e:
+        raise admission_error(e)
+
+async def wait_until_ready(*components: str):
+    """Espera a que carguen los componentes; si no están a tiempo responde 503 con Retry-After."""
+    if not await readiness.wait(*components):
+        raise HTTPException(status_code=503, detail="El servicio está iniciando, reintentar en unos segundos",
+                            headers={"Retry-After": "5"})
+
 
 @app.post("/upload_pdf")
 async def upload_pdf(session_id: str = Form(None), file: UploadFile = File(...)):
     session_id = session_id or "global"
     if not file.filename.lower().endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Solo se aceptan archivos PDF")
+    # Sin Chroma no se puede verificar duplicados ni indexar: se responde 503 antes de guardar nada
+    await wait_until_ready("chroma")
     upload_dir = rag.UPLOAD_DIR
     os.makedirs(upload_dir, exist_ok=True)
-    # Guardar con el nombre original, anteponiendo el session_id y evitando colisiones
+    # Guardar con el nombre original, anteponiendo el session_id; el catálogo reserva un nombre libre
     orig_name = os.path.basename(file.filename)
-    base_name, ext = os.path.splitext(orig_name)
-    safe_name = f"{session_id}_{base_name}{ext}"
+    safe_name = doc_catalog.reserve_name(session_id, orig_name, upload_dir)
     file_path = os.path.join(upload_dir, safe_name)
-    counter = 1
-    while os.path.exists(file_path):
-        safe_name = f"{session_id}_{base_name}_{counter}{ext}"
-        file_path = os.path.join(upload_dir, safe_name)
-        counter += 1
+    digest = hashlib.sha256()
+    size = 0
     try:
         with open(file_path, "wb") as f:
-            shutil.copyfileobj(file.file, f)
+            for block in iter(lambda: file.file.read(1 << 20), b""):
+                digest.update(block)
+                size += len(block)
+                f.write(block)
     except Exception as e:
+        doc_catalog.remove(safe_name)
         raise HTTPException(status_code=500, detail=f"Error guardando PDF: {e}")
+    doc_catalog.mark_uploaded(safe_name, size, digest.hexdigest())
+    # Mismo contenido ya indexado en la sesión: no se guarda otra copia ni se reindexa
     try:
-        num_chunks = rag.add_document(file_path, session_id, original_filename=orig_name)
+        existing = await embeddings.run(index.find_document_by_hash, session_id, digest.hexdigest())
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error procesando PDF: {e}")
-    return {"ok": True, "session_id": session_id, "chunks": num_chunks, "filename": os.path.basename(file_path), "original_filename": orig_name}
+        print(f"[UPLOAD] No se pudo verificar duplicados: {e}")
+        existing = None
+    if existing:
+        os.remove(file_path)
+        doc_catalog.remove(safe_name)
+        return {"ok": True, "session_id": session_id, "duplicate": True, "status": "done", "filename": existing.get("source"), "original_filename": existing.get("original_filename") or orig_name}
+    # La indexación corre en background; el progreso se consulta en /jobs/{job_id}
+    try:
+        job = await ingest_queue.submit(file_path, session_id, original_filename=orig_name)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error encolando PDF: {e}")
+    return {"ok": True, "session_id": session_id, "job_id": job["job_id"], "status": job["status"], "filename": os.path.basename(file_path), "original_filename": orig_name}
+
 
+@app.get("/jobs")
+def list_jobs(session_id: str = Query("global"), limit: int = Query(50, ge=1, le=500)):
+    return {"jobs": ingest_queue.list(session_id, limit=limit)}
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = ingest_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job no encontrado")
+    return job
+
+@app.post("/jobs/{job_id}/retry")
+async def retry_job(job_id: str):
+    try:
+        job = await ingest_queue.retry(job_id)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job no encontrado")
+    return job
 
-from fastapi.responses import PlainTextResponse
+
+from fastapi.responses import PlainTextResponse, StreamingResponse
 
 import re
+import json
+import random
 from typing import List
+from ollama_client import OllamaStream
 
 ACK_PATTERNS: List[str] = [
     r"^(si|sí|ok|vale|dale|claro|perfecto|entendido|entiendo|listo|ya)$",
     r"^(gracias|gracias\s+!*|muchas\s+gracias)!*$",
 ]
 
+# Saludos o preguntas de cortesía simples que se responden sin consultar al modelo
+CORTESIAS: List[str] = [
+    r"^hola[!.¡\s,;:]*$",
+    r"^buen[oa]s? (d[ií]as|tardes|noches)[!.¡\s,;:]*$",
+    r"^¿?c[oó]mo est[aá]s?\??$",
+    r"^¿?qu[eé] tal\??$",
+    r"^hey[!.¡\s,;:]*$",
+    r"^saludos[!.¡\s,;:]*$",
+    r"^qué haces\??$",
+    r"^cómo te va\??$",
+    r"^est[aá]s ah[ií]\??$",
+    r"^est[aá]s bien\??$",
+    r"^todo bien\??$",
+    r"^cómo va todo\??$",
+    r"^cómo puedo ayudarte\??$",
+    r"^ayuda[!.¡\s,;:]*$",
+]
+
+# Respuestas interactivas, sin markdown ni mención a IA
+RESPUESTAS_CORTESIA: List[str] = [
+    "¡Hola! Estoy muy bien, gracias por preguntar. ¿En qué puedo ayudarte hoy?",
+    "¡Hola! ¿Sobre qué tema te gustaría conversar o necesitas ayuda?",
+    "¡Hola! ¿En qué puedo ayudarte? Si tienes alguna consulta, dime sin problema.",
+]
+
+RESPUESTA_ACK = "Perfecto. Dime qué te interesa: historia de la empresa, servicios, clientes, certificaciones, contacto u otro tema."
+
+# Respuestas placeholder o que replican instrucciones
+PLACEHOLDER_PATTERNS: List[str] = [
+    r"^respuesta final\s*:",
+    r"\[aquí va la respuesta solicitada",
+    r"^\s*\[?respuesta\s+final\]?",
+]
+
+RETRY_REMINDER = "Responde ahora con el dato solicitado o indica claramente que no está en el contexto. Evita cualquier plantilla."
+
+# Caracteres iniciales que /chat/stream retiene antes de decidir si la respuesta es un placeholder
+STREAM_PLACEHOLDER_WINDOW = int(os.getenv("STREAM_PLACEHOLDER_WINDOW", "48"))
+
 def is_ack(text: str) -> bool:
     t = text.strip().lower()
     for pat in ACK_PATTERNS:
@@ -238,6 +466,19 @@ def is_ack(text: str) -> bool:
             return True
     return False
 
+def canned_reply(message: str) -> str | None:
+    """Respuesta fija para saludos y confirmaciones cortas; None si hay que consultar al modelo."""
+    texto = (message or "").strip().lower()
+    if any(re.match(pat, texto) for pat in CORTESIAS):
+        return random.choice(RESPUESTAS_CORTESIA)
+    # Mensajes cortos de confirmación / continuación
+    if is_ack(texto):
+        return RESPUESTA_ACK
+    return None
+
+def is_placeholder(content: str) -> bool:
+    return any(re.search(pat, content, re.IGNORECASE) for pat in PLACEHOLDER_PATTERNS) or len(content) < 8
+
 def strip_markdown(text: str) -> str:
     # Quitar encabezados
     text = re.sub(r"^#+\\s+", "", text, flags=re.MULTILINE)
@@ -254,47 +495,146 @@ def strip_markdown(text: str) -> str:
     text = re.sub(r"\n{3,}", "\n\n", text)
     return text.strip()
 
-@app.post("/chat", response_class=PlainTextResponse)
-async def chat(body: ChatIn):
-    session_id = getattr(body, "session_id", None) or "global"
-    # Detectar saludos o preguntas de cortesía simples
-    cortesias = [
-        r"^hola[!.¡\s,;:]*$",
-        r"^buen[oa]s? (d[ií]as|tardes|noches)[!.¡\s,;:]*$",
-        r"^¿?c[oó]mo est[aá]s?\??$",
-        r"^¿?qu[eé] tal\??$",
-        r"^hey[!.¡\s,;:]*$",
-        r"^saludos[!.¡\s,;:]*$",
-        r"^qué haces\??$",
-        r"^cómo te va\??$",
-        r"^est[aá]s ah[ií]\??$",
-        r"^est[aá]s bien\??$",
-        r"^todo bien\??$",
-        r"^cómo va todo\??$",
-        r"^cómo puedo ayudarte\??$",
-        r"^ayuda[!.¡\s,;:]*$",
-    ]
-    texto = (body.message or "").strip().lower()
-    if any(re.match(pat, texto) for pat in cortesias):
-        # Respuesta interactiva, sin markdown ni mención a IA
-        respuestas = [
-            "¡Hola! Estoy muy bien, gracias por preguntar. ¿En qué puedo ayudarte hoy?",
-            "¡Hola! ¿Sobre qué tema te gustaría conversar o necesitas ayuda?",
-            "¡Hola! ¿En qué puedo ayudarte? Si tienes alguna consulta, dime sin problema.",
-        ]
-        import random
-        return random.choice(respuestas)
-    # Mensajes cortos de confirmación / continuación
-    if is_ack(texto):
-        return (
-            "Perfecto. Dime qué te interesa: historia de la empresa, servicios, clientes, certificaciones, contacto u otro tema."
-        )
+def clean_answer(content: str) -> str:
+    content = strip_markdown(content)
+    # Último filtro: eliminar prefijos residuales
+    return re.sub(r"^(respuesta final\s*:\s*)", "", content, flags=re.IGNORECASE).strip()
+
+
+class MarkdownStreamCleaner:
+    """Versión incremental de strip_markdown para respuestas en streaming.
+
+    Retiene la línea en curso hasta un espacio en el que los marcadores * y _ estén balanceados,
+    así un **negrita** partido entre tokens se limpia igual que sobre la respuesta completa.
+    """
 
-    # ...existing code para contexto documental...
+    # Si una línea crece sin marcadores balanceados se emite igual para no frenar el stream
+    MAX_PENDING = 400
+
+    def __init__(self):
+        self._line = ""
+        self._line_started = False
+        self._tail = ""
+        self._emitted = False
+
+    def feed(self, text: str) -> str:
+        out = []
+        self._line += text
+        while "\n" in self._line:
+            line, self._line = self._line.split("\n", 1)
+            out.append(self._emit(self._clean(line, whole_line=True) + "\n"))
+            self._line_started = False
+        cut = self._safe_cut(self._line)
+        if cut:
+            segment, self._line = self._line[:cut], self._line[cut:]
+            out.append(self._emit(self._clean(segment, whole_line=False)))
+            self._line_started = True
+        return "".join(out)
+
+    def flush(self) -> str:
+        line, self._line = self._line, ""
+        return self._emit(self._clean(line, whole_line=True)) if line else ""
+
+    def _safe_cut(self, line: str) -> int:
+        stars = unders = 0
+        cut = last_space = 0
+        for i, ch in enumerate(line):
+            if ch == "*":
+                stars += 1
+            elif ch == "_":
+                unders += 1
+            elif ch.isspace():
+                last_space = i + 1
+                if stars % 2 == 0 and unders % 2 == 0:
+                    cut = i + 1
+        if not cut and len(line) > self.MAX_PENDING:
+            cut = last_space
+        return cut
+
+    def _clean(self, text: str, whole_line: bool) -> str:
+        at_start = not self._line_started
+        if at_start:
+            text = re.sub(r"^#+\\s+", "", text)
+        text = re.sub(r"(\*\*|__)(.*?)\1", r"\2", text)
+        text = re.sub(r"(\*|_)(.*?)\1", r"\2", text)
+        if at_start:
+            text = re.sub(r"^[\-*+]\\s+", "", text)
+        text = text.replace("```", "").replace("`", "")
+        if at_start and whole_line:
+            text = re.sub(r"^---+$", "", text)
+        return text
+
+    def _emit(self, text: str) -> str:
+        # Los espacios finales se retienen hasta saber si viene más texto (equivale al strip final)
+        pending = self._tail + text
+        body = pending.rstrip()
+        self._tail = pending[len(body):]
+        if not body:
+            return ""
+        if not self._emitted:
+            body = body.lstrip()
+            self._emitted = True
+        return re.sub(r"\n{3,}", "\n\n", body)
+
+
+def chat_options(body: ChatIn) -> tuple[str, str, str]:
+    """(modelo, answer_mode, locale) efectivos del request."""
+    answer_mode = (body.answer_mode or "breve").lower()
+    if answer_mode not in {"breve", "detallado", "paso-a-paso"}:
+        answer_mode = "breve"
+    return body.model or DEFAULT_MODEL, answer_mode, body.locale or "es-AR"
+
+async def lookup_cached_answer(body: ChatIn, session_id: str, timings: RequestTimings) -> tuple[str | None, list[float]]:
+    """Busca la respuesta en caché (pregunta exacta y luego por similitud).
+
+    Devuelve (respuesta o None, embedding de la consulta); el embedding se reutiliza para la recuperación.
+    """
+    model, answer_mode, locale = chat_options(body)
+    if body.use_cache:
+        with timings.span("cache"):
+            hit = answer_cache.get(session_id, model, answer_mode, locale, body.message)
+        if hit is not None:
+            return hit, None
     try:
-        relevant_chunks = rag.query_relevant(body.message, session_id, top_k=12)
+        with timings.span("embed"):
+            query_embedding = await embeddings.embed_query(body.message)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error consultando contexto: {e}")
+    if body.use_cache:
+        with timings.span("cache"):
+            hit = answer_cache.get(session_id, model, answer_mode, locale, body.message, embedding=query_embedding)
+        if hit is not None:
+            return hit, query_embedding
+    return None, query_embedding
+
+def remember_answer(body: ChatIn, session_id: str, answer: str, query_embedding: list[float] | None, corpus_version: int):
+    model, answer_mode, locale = chat_options(body)
+    answer_cache.put(session_id, model, answer_mode, locale, body.message, answer,
+                     embedding=query_embedding, version=corpus_version)
+
+def retrieval_top_k() -> int:
+    return RERANK_CANDIDATES if reranker.enabled else RAG_TOP_K
+
+async def build_chat_messages(body: ChatIn, session_id: str, query_embedding: list[float],
+                              timings: RequestTimings) -> list[dict]:
+    """Recupera el contexto documental de la sesión y arma los mensajes para Ollama."""
+    try:
+        with timings.span("retrieve"):
+            relevant_chunks = await embeddings.run(index.query_by_embedding, query_embedding, session_id,
+                                                   top_k=retrieval_top_k(), question=body.message)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error consultando contexto: {e}")
+    return await compose_chat_messages(body, relevant_chunks, timings)
+
+async def compose_chat_messages(body: ChatIn, relevant_chunks: list[dict], timings: RequestTimings) -> list[dict]:
+    """Reordena (si hay reranker) los fragmentos recuperados y arma los mensajes para Ollama."""
+    if reranker.enabled:
+        try:
+            with timings.span("rerank"):
+                relevant_chunks = await reranker.rerank(body.message, relevant_chunks, top_n=RERANK_TOP_N)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error consultando contexto: {e}")
+    context_start = time.perf_counter()
     context_chunks = []
     for idx, c in enumerate(relevant_chunks):
         meta = c.get("meta", {})
@@ -309,29 +649,10 @@ async def chat(body: ChatIn):
             "text": c.get("text", ""),
             "score": score,
         })
-    answer_mode = (body.answer_mode or "breve").lower()
-    if answer_mode not in {"breve", "detallado", "paso-a-paso"}:
-        answer_mode = "breve"
-    locale = body.locale or "es-AR"
-    # Construir contexto en texto plano (evitar JSON que el modelo ignore)
-    def format_context(chunks: list[dict], limit_chars: int = 13000) -> str:
-        parts = []
-        total = 0
-        for i, ch in enumerate(chunks, start=1):
-            txt = ch.get("text", "").strip().replace("\n", " ")
-            if not txt:
-                continue
-            # Truncar cada chunk solo si es muy largo
-            if len(txt) > 700:
-                txt = txt[:700].rsplit(" ", 1)[0] + "…"
-            segment = f"[{i}] Fuente: {ch.get('source')} pág {ch.get('page')} -> {txt}"
-            if total + len(segment) > limit_chars:
-                break
-            parts.append(segment)
-            total += len(segment)
-        return "\n".join(parts) if parts else "(sin fragmentos relevantes)"
-
-    contexto_plano = format_context(context_chunks)
+    model, answer_mode, locale = chat_options(body)
+
+    # Contexto en texto plano (evitar JSON que el modelo ignore), dentro del presupuesto de tokens del modelo
+    contexto_plano = pack_context(context_chunks, model, score_threshold=body.score_threshold)
 
     system_prompt = (
         "Eres un asistente virtual conversacional en español, amable y profesional. "
@@ -348,51 +669,384 @@ async def chat(body: ChatIn):
         "Si la información solicitada no está presente, responde: 'No encuentro esa información en los documentos disponibles.' y ofrece otra ayuda relacionada. "
         "No repitas la pregunta, no uses markdown, no agregues etiquetas internas ni explicaciones de proceso."
     )
+    timings.add("context", time.perf_counter() - context_start)
+    timings.info["chunks"] = len(context_chunks)
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_message_composed},
+    ]
+
+def build_payload(body: ChatIn, messages: list[dict], extra_system: str | None = None, stream: bool = False) -> dict:
+    messages = list(messages)
+    if extra_system:
+        messages.append({"role": "system", "content": extra_system})
+    payload = {
+        "model": chat_options(body)[0],
+        "messages": messages,
+        "stream": stream,
+        # Cada chat renueva la residencia del modelo: el tráfico real reemplaza a los pings
+        "keep_alive": MODEL_KEEP_ALIVE,
+    }
+    if body.max_tokens:
+        payload["options"] = {"num_predict": body.max_tokens}
+    return payload
 
-    def build_payload(extra_system: str | None = None):
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_message_composed},
-        ]
-        if extra_system:
-            messages.append({"role": "system", "content": extra_system})
-        return {
-            "model": body.model or DEFAULT_MODEL,
-            "messages": messages,
-            "stream": False
-        }
-
-    payload = build_payload()
+async def generate_answer(body: ChatIn, messages: list[dict], timings: RequestTimings,
+                          priority: int = PRIORITY_CHAT) -> str:
+    """Respuesta completa (no streaming) de Ollama, con un reintento si es un placeholder.
+
+    AdmissionRejected se propaga para que cada llamador decida si responde 429/503 o reintenta.
+    """
     try:
-        async with httpx.AsyncClient(timeout=120) as client:
-            r = await client.post(f"{OLLAMA_URL}/api/chat", json=payload)
-            r.raise_for_status()
-            data = r.json()
+        with timings.span("ollama"):
+            data = await ollama.post_json("/api/chat", build_payload(body, messages), timeout=120, priority=priority)
+    except AdmissionRejected:
+        raise
     except Exception as e:
         raise HTTPException(status_code=502, detail=f"Error hablando con Ollama: {e}")
+    record_ollama(data, timings)
     content = (data.get("message") or {}).get("content", "").strip()
     if not content:
         raise HTTPException(status_code=500, detail="Respuesta vacía del modelo")
-    # Detectar respuesta placeholder o que replica instrucciones
-    placeholder_patterns = [
-        r"^respuesta final\s*:",
-        r"\[aquí va la respuesta solicitada",
-        r"^\s*\[?respuesta\s+final\]?",
-    ]
-    if any(re.search(pat, content, re.IGNORECASE) for pat in placeholder_patterns) or len(content) < 8:
+    if is_placeholder(content):
         # Reintentar con recordatorio más directo
-        retry_payload = build_payload("Responde ahora con el dato solicitado o indica claramente que no está en el contexto. Evita cualquier plantilla.")
+        retry_payload = build_payload(body, messages, RETRY_REMINDER)
         try:
-            async with httpx.AsyncClient(timeout=60) as client:
-                r2 = await client.post(f"{OLLAMA_URL}/api/chat", json=retry_payload)
-                r2.raise_for_status()
-                data2 = r2.json()
-                retry_content = (data2.get("message") or {}).get("content", "").strip()
-                if retry_content:
-                    content = retry_content
+            with timings.span("retry"):
+                data2 = await ollama.post_json("/api/chat", retry_payload, timeout=60, priority=priority)
+            record_ollama(data2, timings)
+            retry_content = (data2.get("message") or {}).get("content", "").strip()
+            if retry_content:
+                content = retry_content
         except Exception:
             pass
-    content = strip_markdown(content)
-    # Último filtro: eliminar prefijos residuales
-    content = re.sub(r"^(respuesta final\s*:\s*)", "", content, flags=re.IGNORECASE).strip()
-    return content
+    return clean_answer(content)
+
+@app.post("/chat", response_class=PlainTextResponse)
+async def chat(body: ChatIn):
+    session_id = getattr(body, "session_id", None) or "global"
+    canned = canned_reply(body.message)
+    if canned is not None:
+        return canned
+
+    timings = RequestTimings("/chat")
+    try:
+        check_admission(body)
+        with timings.span("wait_ready"):
+            await wait_until_ready()
+        corpus_version = answer_cache.version(session_id)
+        cached, query_embedding = await lookup_cached_answer(body, session_id, timings)
+        if cached is not None:
+            timings.info["cache"] = "hit"
+            return PlainTextResponse(cached, headers={"X-Answer-Cache": "hit", **timings.header()})
+        messages = await build_chat_messages(body, session_id, query_embedding, timings)
+        try:
+            answer = await generate_answer(body, messages, timings)
+        except AdmissionRejected as e:
+            raise admission_error(e)
+        remember_answer(body, session_id, answer, query_embedding, corpus_version)
+        return PlainTextResponse(answer, headers=timings.header())
+    except HTTPException as e:
+        timings.info["status"] = e.status_code
+        raise
+    finally:
+        timings.finish(session_id=session_id)
+
+
+async def _iter_ollama_tokens(response: OllamaStream, final: dict | None = None):
+    # Ollama entrega NDJSON: una línea por token con {"message": {"content": ...}, "done": bool};
+    # la última trae los tiempos y conteos de tokens, que se copian en `final`
+    async for line in response.aiter_lines():
+        if not line.strip():
+            continue
+        data = json.loads(line)
+        if data.get("error"):
+            raise RuntimeError(data["error"])
+        piece = (data.get("message") or {}).get("content", "")
+        if piece:
+            yield piece
+        if data.get("done"):
+            if final is not None:
+                final.update(data)
+            break
+
+async def _read_head(tokens) -> str:
+    """Acumula los primeros tokens hasta tener texto suficiente para detectar placeholders."""
+    head = ""
+    async for piece in tokens:
+        head += piece
+        if len(head.strip()) >= STREAM_PLACEHOLDER_WINDOW:
+            break
+    return head
+
+async def _open_answer_stream(body: ChatIn, messages: list[dict], timings: RequestTimings):
+    """Abre el stream de Ollama y lee el inicio, reintentando una vez si es un placeholder.
+
+    Devuelve (stream, iterador de tokens, texto inicial, dict que recibirá la línea final).
+    """
+    final: dict = {}
+    upstream = None
+    try:
+        with timings.span("first_token"):
+            upstream = await ollama.open_stream("/api/chat", build_payload(body, messages, stream=True), timeout=120)
+            tokens = _iter_ollama_tokens(upstream, final)
+            head = await _read_head(tokens)
+    except AdmissionRejected as e:
+        raise admission_error(e)
+    except Exception as e:
+        if upstream is not None:
+            await upstream.aclose()
+        raise HTTPException(status_code=502, detail=f"Error hablando con Ollama: {e}")
+    if not head.strip():
+        await upstream.aclose()
+        raise HTTPException(status_code=500, detail="Respuesta vacía del modelo")
+
+    if is_placeholder(head.strip()):
+        # Reintentar con recordatorio más directo. El stream original sigue abierto hasta que el
+        # reintento tenga un inicio útil: si falla o llega vacío se continúa el original, como /chat
+        retry_final: dict = {}
+        retry = None
+        try:
+            with timings.span("retry"):
+                retry = await ollama.open_stream("/api/chat", build_payload(body, messages, RETRY_REMINDER, stream=True), timeout=60)
+                retry_tokens = _iter_ollama_tokens(retry, retry_final)
+                retry_head = await _read_head(retry_tokens)
+        except Exception as e:
+            print(f"[STREAM] Reintento fallido, se continúa la respuesta original: {e}")
+            retry_head = ""
+        if retry_head.strip():
+            await upstream.aclose()
+            return retry, retry_tokens, retry_head, retry_final
+        if retry is not None:
+            await retry.aclose()
+    return upstream, tokens, head, final
+
+@app.post("/chat/stream")
+async def chat_stream(body: ChatIn):
+    """Igual que /chat pero reenvía los tokens a medida que Ollama los genera (texto plano chunked)."""
+    session_id = getattr(body, "session_id", None) or "global"
+    canned = canned_reply(body.message)
+    if canned is not None:
+        return PlainTextResponse(canned)
+
+    timings = RequestTimings("/chat/stream")
+    try:
+        check_admission(body)
+        with timings.span("wait_ready"):
+            await wait_until_ready()
+        corpus_version = answer_cache.version(session_id)
+        cached, query_embedding = await lookup_cached_answer(body, session_id, timings)
+        if cached is not None:
+            timings.finish(session_id=session_id, cache="hit")
+            return PlainTextResponse(cached, headers={"X-Answer-Cache": "hit", **timings.header()})
+        messages = await build_chat_messages(body, session_id, query_embedding, timings)
+        upstream, tokens, head, final = await _open_answer_stream(body, messages, timings)
+    except HTTPException as e:
+        timings.finish(session_id=session_id, status=e.status_code)
+        raise
+
+    async def generate():
+        cleaner = MarkdownStreamCleaner()
+        sent = []
+        complete = False
+        stream_start = time.perf_counter()
+        try:
+            first = re.sub(r"^(respuesta final\s*:\s*)", "", head.lstrip(), flags=re.IGNORECASE)
+            out = cleaner.feed(first)
+            if out:
+                sent.append(out)
+                yield out
+            if tokens is not None:
+                async for piece in tokens:
+                    out = cleaner.feed(piece)
+                    if out:
+                        sent.append(out)
+                        yield out
+            complete = True
+        except Exception as e:
+            print(f"[STREAM] Error leyendo respuesta de Ollama: {e}")
+        finally:
+            if upstream is not None:
+                await upstream.aclose()
+            timings.add("stream", time.perf_counter() - stream_start)
+            record_ollama(final, timings)
+            timings.finish(session_id=session_id, complete=complete)
+        out = cleaner.flush()
+        if out:
+            sent.append(out)
+            yield out
+        # Solo se cachean respuestas que llegaron completas
+        if complete:
+            remember_answer(body, session_id, "".join(sent), query_embedding, corpus_version)
+
+    # Server-Timing solo puede llevar lo medido hasta el primer token; el resto va al log y a /metrics
+    return StreamingResponse(
+        generate(),
+        media_type="text/plain; charset=utf-8",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", **timings.header()},
+    )
+
+
+# --- Lotes de preguntas (evaluaciones, pregeneración de FAQ) ---
+
+BATCH_CHAT_MAX_ITEMS = int(os.getenv("BATCH_CHAT_MAX_ITEMS", "500"))
+# Generaciones simultáneas de un lote; el resto espera su turno sin ocupar la cola de admisión
+BATCH_CHAT_CONCURRENCY = int(os.getenv("BATCH_CHAT_CONCURRENCY", "2"))
+# Reintentos de un ítem rechazado por la admisión (los chats interactivos tienen prioridad)
+BATCH_ADMISSION_RETRIES = int(os.getenv("BATCH_ADMISSION_RETRIES", "3"))
+
+
+class ChatBatchIn(BaseModel):
+    items: List[ChatIn]
+    concurrency: int | None = None
+
+
+def _batch_result(index_: int, session_id: str, timings: RequestTimings, **fields) -> dict:
+    timings.finish(session_id=session_id, item=index_, **{k: v for k, v in fields.items() if k in ("cache", "status")})
+    return {
+        "index": index_,
+        "session_id": session_id,
+        "ok": "error" not in fields,
+        **fields,
+        "timings_ms": {**{k: round(v * 1000, 1) for k, v in timings.spans.items()},
+                       "total": round(timings.elapsed() * 1000, 1)},
+    }
+
+
+async def answer_batch(items: List[ChatIn], concurrency: int = BATCH_CHAT_CONCURRENCY):
+    """Responde muchas preguntas compartiendo embeddings y recuperación; genera resultados en orden de finalización.
+
+    Las consultas se embeben en una sola llamada al modelo y la recuperación es una consulta a Chroma
+    por sesión con todas sus preguntas. Las generaciones corren con concurrencia acotada y prioridad
+    de lote, así los chats interactivos pasan primero. Cada resultado trae `index` (posición en
+    `items`) y sus propios tiempos; los tiempos compartidos (embed, retrieve) se repiten en cada ítem.
+    """
+    pending = []  # (posición, body, sesión, timings, versión del corpus)
+    for i, body in enumerate(items):
+        session_id = body.session_id or "global"
+        timings = RequestTimings("/chat/batch")
+        canned = canned_reply(body.message)
+        if canned is not None:
+            yield _batch_result(i, session_id, timings, answer=canned, cache="canned")
+            continue
+        corpus_version = answer_cache.version(session_id)
+        if body.use_cache:
+            model, answer_mode, locale = chat_options(body)
+            with timings.span("cache"):
+                hit = answer_cache.get(session_id, model, answer_mode, locale, body.message)
+            if hit is not None:
+                yield _batch_result(i, session_id, timings, answer=hit, cache="hit")
+                continue
+        pending.append((i, body, session_id, timings, corpus_version))
+    if not pending:
+        return
+
+    # Un solo encode para todas las preguntas (las repetidas se codifican una vez)
+    unique = list(dict.fromkeys(body.message for _, body, _, _, _ in pending))
+    start = time.perf_counter()
+    try:
+        vectors = dict(zip(unique, await embeddings.run(index.embed, unique)))
+    except Exception as e:
+        for i, _, session_id, timings, _ in pending:
+            yield _batch_result(i, session_id, timings, status=500, error=f"Error consultando contexto: {e}")
+        return
+    embed_seconds = time.perf_counter() - start
+    metrics.observe("stage_seconds", embed_seconds, endpoint="/chat/batch", stage="embed")
+
+    remaining = []
+    for item in pending:
+        i, body, session_id, timings, _ = item
+        timings.add("embed", embed_seconds, observe=False)
+        if body.use_cache:
+            model, answer_mode, locale = chat_options(body)
+            with timings.span("cache"):
+                hit = answer_cache.get(session_id, model, answer_mode, locale, body.message, embedding=vectors[body.message])
+            if hit is not None:
+                yield _batch_result(i, session_id, timings, answer=hit, cache="hit")
+                continue
+        remaining.append(item)
+
+    # Una consulta a Chroma por sesión con todas sus preguntas
+    by_session: dict[str, list] = {}
+    for item in remaining:
+        by_session.setdefault(item[2], []).append(item)
+
+    async def retrieve(session_id: str, group: list):
+        start = time.perf_counter()
+        try:
+            chunks = await embeddings.run(index.query_by_embeddings, [vectors[body.message] for _, body, _, _, _ in group],
+                                          session_id, top_k=retrieval_top_k(),
+                                          questions=[body.message for _, body, _, _, _ in group])
+        except Exception as e:
+            chunks = e
+        return group, chunks, time.perf_counter() - start
+
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async def generate(item, relevant_chunks):
+        i, body, session_id, timings, corpus_version = item
+        async with sem:
+            try:
+                messages = await compose_chat_messages(body, relevant_chunks, timings)
+                for attempt in range(BATCH_ADMISSION_RETRIES + 1):
+                    try:
+                        answer = await generate_answer(body, messages, timings, priority=PRIORITY_BACKGROUND)
+                        break
+                    except AdmissionRejected as e:
+                        if attempt == BATCH_ADMISSION_RETRIES:
+                            raise admission_error(e)
+                        with timings.span("admission_retry"):
+                            await asyncio.sleep(e.retry_after)
+            except HTTPException as e:
+                return _batch_result(i, session_id, timings, status=e.status_code, error=e.detail)
+        remember_answer(body, session_id, answer, vectors[body.message], corpus_version)
+        return _batch_result(i, session_id, timings, answer=answer, cache="miss", chunks=timings.info.get("chunks", 0))
+
+    tasks = []
+    try:
+        for group, chunks, seconds in await asyncio.gather(*(retrieve(sid, g) for sid, g in by_session.items())):
+            metrics.observe("stage_seconds", seconds, endpoint="/chat/batch", stage="retrieve")
+            if isinstance(chunks, Exception):
+                for i, _, session_id, timings, _ in group:
+                    timings.add("retrieve", seconds, observe=False)
+                    yield _batch_result(i, session_id, timings, status=500, error=f"Error consultando contexto: {chunks}")
+                continue
+            for item, relevant_chunks in zip(group, chunks):
+                item[3].add("retrieve", seconds, observe=False)
+                tasks.append(asyncio.create_task(generate(item, relevant_chunks)))
+        for done in asyncio.as_completed(tasks):
+            yield await done
+    finally:
+        # Cliente desconectado: no seguir generando respuestas que nadie va a leer
+        for task in tasks:
+            task.cancel()
+
+
+@app.post("/chat/batch")
+async def chat_batch(body: ChatBatchIn):
+    """Muchas preguntas en un request; responde NDJSON, una línea por pregunta en orden de finalización.
+
+    La última línea es un resumen {"done": true, ...}.
+    """
+    if not body.items:
+        raise HTTPException(status_code=400, detail="El lote no tiene preguntas")
+    if len(body.items) > BATCH_CHAT_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"El lote supera el máximo de {BATCH_CHAT_MAX_ITEMS} preguntas")
+    await wait_until_ready()
+    concurrency = min(body.concurrency or BATCH_CHAT_CONCURRENCY, BATCH_CHAT_CONCURRENCY)
+
+    async def stream():
+        start = time.perf_counter()
+        counts = {"ok": 0, "errors": 0, "cache_hits": 0}
+        async for result in answer_batch(body.items, concurrency=concurrency):
+            counts["ok" if result["ok"] else "errors"] += 1
+            counts["cache_hits"] += result.get("cache") == "hit"
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+        yield json.dumps({"done": True, "items": len(body.items), **counts,
+                          "elapsed_ms": round((time.perf_counter() - start) * 1000, 1)}) + "\n"
+
+    return StreamingResponse(
+        stream(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
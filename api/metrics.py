@@ -0,0 +1,202 @@
+"""Tiempos por etapa de cada request y métricas en formato de texto de Prometheus.
+
+RequestTimings acumula spans (embedding de la consulta, Chroma, contexto, Ollama...) de un request;
+al terminar se devuelven en el header Server-Timing, se loguean como una línea JSON y alimentan los
+histogramas de /metrics. El registro también lleva contadores (ingesta, tokens de Ollama) y
+colectores que leen al momento del scrape los stats de las cachés y pools.
+"""
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+METRICS_PREFIX = os.getenv("METRICS_PREFIX", "iarag")
+SERVER_TIMING_HEADER = os.getenv("SERVER_TIMING_HEADER", "true").lower() in ("1", "true", "yes")
+TIMING_LOG = os.getenv("TIMING_LOG", "true").lower() in ("1", "true", "yes")
+
+# Límites de los buckets en segundos: desde búsquedas de milisegundos hasta generaciones de minutos
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _labels(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _fmt_labels(labels: tuple, extra: tuple = ()) -> str:
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    body = ",".join('{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in items)
+    return "{" + body + "}"
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class Metrics:
+    def __init__(self, prefix: str = METRICS_PREFIX):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._help: dict[str, tuple[str, str]] = {}
+        self._counters: dict[str, dict[tuple, float]] = {}
+        self._histograms: dict[str, dict[tuple, Histogram]] = {}
+        self._collectors = []
+
+    def _name(self, name: str) -> str:
+        return f"{self.prefix}_{name}" if self.prefix else name
+
+    def describe(self, name: str, kind: str, help_text: str):
+        self._help[self._name(name)] = (kind, help_text)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(self._name(name), {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = _labels(labels)
+        with self._lock:
+            series = self._histograms.setdefault(self._name(name), {})
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(seconds)
+
+    def collector(self, fn):
+        """Registra una función que devuelve [(nombre, tipo, ayuda, {labels}, valor)] al momento del scrape."""
+        self._collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        lines: list[str] = []
+
+        def header(name, kind):
+            help_text = self._help.get(name, (kind, ""))[1]
+            if help_text:
+                lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                header(name, "counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{_fmt_labels(key)} {value:g}")
+            for name, series in sorted(self._histograms.items()):
+                header(name, "histogram")
+                for key, hist in series.items():
+                    cumulative = 0
+                    for bound, n in zip(hist.buckets, hist.counts):
+                        cumulative += n
+                        lines.append(f"{name}_bucket{_fmt_labels(key, (('le', f'{bound:g}'),))} {cumulative}")
+                    lines.append(f"{name}_bucket{_fmt_labels(key, (('le', '+Inf'),))} {hist.count}")
+                    lines.append(f"{name}_sum{_fmt_labels(key)} {hist.sum:.6f}")
+                    lines.append(f"{name}_count{_fmt_labels(key)} {hist.count}")
+        grouped: dict[str, list] = {}
+        for fn in self._collectors:
+            try:
+                for name, kind, help_text, labels, value in fn():
+                    if value is None:
+                        continue
+                    full = self._name(name)
+                    self._help.setdefault(full, (kind, help_text))
+                    grouped.setdefault(full, []).append((kind, _labels(labels), value))
+            except Exception as e:
+                print(f"[METRICS] Error en colector {getattr(fn, '__name__', fn)}: {e}")
+        for name, samples in sorted(grouped.items()):
+            header(name, samples[0][0])
+            for _, key, value in samples:
+                lines.append(f"{name}{_fmt_labels(key)} {float(value):g}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+metrics.describe("stage_seconds", "histogram", "Duración de cada etapa de /chat y /chat/stream")
+metrics.describe("http_request_duration_seconds", "histogram", "Duración de los requests HTTP por ruta")
+metrics.describe("ollama_prompt_eval_duration_seconds", "histogram", "prompt_eval_duration informado por Ollama")
+metrics.describe("ollama_eval_duration_seconds", "histogram", "eval_duration informado por Ollama")
+metrics.describe("ollama_load_duration_seconds", "histogram", "load_duration informado por Ollama")
+metrics.describe("ollama_prompt_eval_tokens_total", "counter", "Tokens de prompt evaluados por Ollama")
+metrics.describe("ollama_eval_tokens_total", "counter", "Tokens generados por Ollama (eval_count)")
+metrics.describe("ingest_jobs_total", "counter", "Jobs de ingesta terminados por estado")
+metrics.describe("ingest_pages_total", "counter", "Páginas extraídas por la ingesta")
+metrics.describe("ingest_chunks_total", "counter", "Fragmentos indexados por la ingesta")
+metrics.describe("ingest_chunks_reused_total", "counter", "Fragmentos con embedding reutilizado de la caché")
+metrics.describe("ingest_job_seconds", "histogram", "Duración de los jobs de ingesta")
+
+
+def record_ollama(data: dict, timings: "RequestTimings | None" = None):
+    """Registra los campos de duración y conteo de tokens de la respuesta final de Ollama."""
+    if not data:
+        return
+    model = data.get("model") or "desconocido"
+    for field, metric, span in (("prompt_eval_duration", "ollama_prompt_eval_duration_seconds", "prompt_eval"),
+                                ("eval_duration", "ollama_eval_duration_seconds", "eval"),
+                                ("load_duration", "ollama_load_duration_seconds", "load")):
+        ns = data.get(field)
+        if ns:
+            metrics.observe(metric, ns / 1e9, model=model)
+            if timings is not None:
+                timings.add(span, ns / 1e9, observe=False)
+    if data.get("prompt_eval_count"):
+        metrics.inc("ollama_prompt_eval_tokens_total", data["prompt_eval_count"], model=model)
+    if data.get("eval_count"):
+        metrics.inc("ollama_eval_tokens_total", data["eval_count"], model=model)
+        if timings is not None:
+            timings.info["eval_count"] = data["eval_count"]
+
+
+class RequestTimings:
+    """Spans de un request. Las etapas repetidas (por ejemplo, el reintento) se suman."""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.start = time.perf_counter()
+        self.spans: dict[str, float] = {}
+        self.info: dict = {}
+
+    def add(self, name: str, seconds: float, observe: bool = True):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+        if observe:
+            metrics.observe("stage_seconds", seconds, endpoint=self.endpoint, stage=name)
+
+    @contextmanager
+    def span(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def header(self) -> dict:
+        """Header Server-Timing con los spans hasta el momento (vacío si está desactivado)."""
+        if not SERVER_TIMING_HEADER:
+            return {}
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.spans.items()]
+        parts.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return {"Server-Timing": ", ".join(parts)}
+
+    def finish(self, **info):
+        """Cierra el request: histograma del total y una línea de log estructurada."""
+        total = self.elapsed()
+        metrics.observe("stage_seconds", total, endpoint=self.endpoint, stage="total")
+        if TIMING_LOG:
+            record = {"endpoint": self.endpoint, "total_ms": round(total * 1000, 1),
+                      "spans_ms": {k: round(v * 1000, 1) for k, v in self.spans.items()}, **self.info, **info}
+            print("[TIMING] " + json.dumps(record, ensure_ascii=False))
@@ -0,0 +1,213 @@
+"""Residencia de modelos en Ollama: los modelos en uso quedan cargados sin generar tokens de prueba.
+
+Reemplaza el ping periódico (una generación completa cada MODEL_KEEPALIVE_INTERVAL) y el "Hola" de
+precalentamiento. Los modelos se cargan con una llamada a /api/generate sin prompt (Ollama solo carga
+el modelo) y `keep_alive`, y los chats envían el mismo `keep_alive`, con lo que el tráfico real ya
+mantiene el modelo en memoria. Cada MODEL_RESIDENCY_CHECK_SECONDS un solo worker consulta /api/ps
+(qué está cargado y cuándo expira) y solo recarga los modelos a los que les quedan menos de
+MODEL_REFRESH_MARGIN segundos. Se mantienen el modelo seleccionado y los de RESIDENT_MODELS, en ese
+orden, mientras entren en MODEL_MEMORY_BUDGET_MB; los que no entran se descargan (keep_alive 0).
+"""
+import os
+import re
+import time
+import asyncio
+from datetime import datetime
+
+from ollama_client import ollama
+from admission import AdmissionRejected, PRIORITY_BACKGROUND, PRIORITY_KEEPALIVE
+from settings_store import settings
+
+MODEL_KEEPALIVE_ENABLED = os.getenv("MODEL_KEEPALIVE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Duración de Ollama ("30m", "2h", segundos; "-1" = sin expiración) enviada en cargas y chats
+MODEL_KEEP_ALIVE = os.getenv("MODEL_KEEP_ALIVE", "30m")
+# Modelos adicionales a mantener cargados, en orden de preferencia
+RESIDENT_MODELS = [m.strip() for m in os.getenv("RESIDENT_MODELS", "").split(",") if m.strip()]
+MODEL_MEMORY_BUDGET_MB = float(os.getenv("MODEL_MEMORY_BUDGET_MB", "0"))  # 0 = sin límite
+MODEL_RESIDENCY_CHECK_SECONDS = float(os.getenv("MODEL_RESIDENCY_CHECK_SECONDS", "60"))
+MODEL_REFRESH_MARGIN = float(os.getenv("MODEL_REFRESH_MARGIN", "180"))
+
+_FRACTION_RE = re.compile(r"(\.\d{6})\d+")
+
+
+def parse_expires_at(value: str | None) -> float | None:
+    """expires_at de /api/ps (RFC 3339 con nanosegundos) como timestamp; None si no expira o no se entiende."""
+    if not value:
+        return None
+    try:
+        ts = datetime.fromisoformat(_FRACTION_RE.sub(r"\1", value.replace("Z", "+00:00"))).timestamp()
+    except ValueError:
+        return None
+    # keep_alive negativo: Ollama informa una fecha lejana
+    return None if ts - time.time() > 10 * 365 * 86400 else ts
+
+
+class ModelResidency:
+    def __init__(self, keep_alive: str = MODEL_KEEP_ALIVE, extra_models: list[str] | None = None,
+                 budget_mb: float = MODEL_MEMORY_BUDGET_MB, check_seconds: float = MODEL_RESIDENCY_CHECK_SECONDS,
+                 refresh_margin: float = MODEL_REFRESH_MARGIN):
+        self.keep_alive = keep_alive
+        self.extra_models = list(RESIDENT_MODELS if extra_models is None else extra_models)
+        self.budget_mb = budget_mb
+        self.check_seconds = max(5.0, check_seconds)
+        self.refresh_margin = refresh_margin
+        self._task: asyncio.Task | None = None
+        self._resident: dict[str, dict] = {}  # último /api/ps
+        self._sizes: dict[str, int] = {}  # bytes en memoria observados (o tamaño en disco de /api/tags)
+        self._loading: dict[str, asyncio.Task] = {}
+        self._last_check: float | None = None
+        self._counts = {"loads": 0, "refreshes": 0, "unloads": 0, "skipped_busy": 0, "errors": 0}
+
+    # --- Operaciones sobre Ollama ---
+
+    async def _generate(self, model: str, keep_alive, priority: int):
+        # Sin prompt Ollama no genera: solo carga (o con keep_alive 0, descarga) el modelo
+        await ollama.request("POST", "/api/generate", json={"model": model, "keep_alive": keep_alive},
+                             timeout=300, priority=priority)
+
+    async def preload(self, model: str, refresh: bool = False) -> bool:
+        """Carga el modelo (o renueva su keep_alive) sin generar tokens. Una sola carga en curso por modelo."""
+        task = self._loading.get(model)
+        if task is None:
+            task = self._loading[model] = asyncio.get_running_loop().create_task(self._load(model, refresh))
+        # shield: si el request que pidió la carga se cancela, la carga sigue para los demás
+        return await asyncio.shield(task)
+
+    async def _load(self, model: str, refresh: bool) -> bool:
+        start = time.perf_counter()
+        try:
+            # Renovar un modelo cargado nunca espera detrás de los chats: si está ocupado, ya está vigente
+            await self._generate(model, self.keep_alive, PRIORITY_KEEPALIVE if refresh else PRIORITY_BACKGROUND)
+        except AdmissionRejected as e:
+            self._counts["skipped_busy"] += 1
+            if refresh:
+                return True
+            # Una primera carga rechazada no dejó el modelo en memoria: se reintenta en el próximo ciclo
+            print(f"[RESIDENCY] Carga de {model} postergada: {e}")
+            return False
+        except Exception as e:
+            self._counts["errors"] += 1
+            print(f"[RESIDENCY] No se pudo cargar {model}: {e}")
+            return False
+        finally:
+            self._loading.pop(model, None)
+        self._counts["refreshes" if refresh else "loads"] += 1
+        print(f"[RESIDENCY] {model} {'renovado' if refresh else 'cargado'} en {time.perf_counter() - start:.2f}s "
+              f"(keep_alive {self.keep_alive})")
+        return True
+
+    async def unload(self, model: str):
+        try:
+            await self._generate(model, 0, PRIORITY_BACKGROUND)
+            self._counts["unloads"] += 1
+            print(f"[RESIDENCY] {model} descargado (fuera del presupuesto de memoria)")
+        except Exception as e:
+            print(f"[RESIDENCY] No se pudo descargar {model}: {e}")
+
+    async def refresh_state(self) -> dict[str, dict]:
+        data = await ollama.get_json("/api/ps", timeout=10)
+        resident = {}
+        for m in data.get("models", []):
+            name = m.get("name") or m.get("model")
+            resident[name] = {"size": m.get("size") or 0, "size_vram": m.get("size_vram") or 0,
+                              "expires_at": parse_expires_at(m.get("expires_at"))}
+            if resident[name]["size"]:
+                self._sizes[name] = resident[name]["size"]
+        self._resident = resident
+        self._last_check = time.time()
+        return resident
+
+    async def _disk_sizes(self):
+        # Antes de la primera carga el tamaño en memoria se aproxima con el del archivo del modelo
+        missing = [m for m in self.wanted() if m not in self._sizes]
+        if not missing or not self.budget_mb:
+            return
+        try:
+            data = await ollama.get_json("/api/tags", timeout=10)
+        except Exception:
+            return
+        for m in data.get("models", []):
+            if m.get("name") in missing and m.get("size"):
+                self._sizes[m["name"]] = m["size"]
+
+    # --- Plan ---
+
+    def wanted(self) -> list[str]:
+        return list(dict.fromkeys([settings.selected_model(), *self.extra_models]))
+
+    def plan(self) -> tuple[list[str], list[str]]:
+        """(modelos que entran en el presupuesto, modelos que no)."""
+        keep, drop, used = [], [], 0.0
+        for model in self.wanted():
+            size_mb = self._sizes.get(model, 0) / (1 << 20)
+            # El seleccionado siempre se mantiene, aunque solo no entre en el presupuesto
+            if not keep or not self.budget_mb or used + size_mb <= self.budget_mb:
+                keep.append(model)
+                used += size_mb
+            else:
+                drop.append(model)
+        return keep, drop
+
+    async def check(self):
+        """Carga lo que falta, renueva lo que está por expirar y descarga lo que no entra."""
+        resident = await self.refresh_state()
+        await self._disk_sizes()
+        keep, drop = self.plan()
+        # Primero se libera memoria, después se carga
+        for model in drop:
+            if model in resident:
+                await self.unload(model)
+        now = time.time()
+        for model in keep:
+            state = resident.get(model)
+            if state is None:
+                await self.preload(model)
+            elif state["expires_at"] is not None and state["expires_at"] - now < self.refresh_margin:
+                await self.preload(model, refresh=True)
+
+    # --- Ciclo ---
+
+    async def start(self):
+        if self._task is None and MODEL_KEEPALIVE_ENABLED:
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+            print(f"[RESIDENCY] Activado: revisión cada {self.check_seconds:.0f}s, keep_alive {self.keep_alive}")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.check_seconds)
+            try:
+                # Con varios workers revisa uno solo por intervalo
+                if settings.claim("lease:residency", self.check_seconds * 0.9):
+                    await self.check()
+            except Exception as e:
+                self._counts["errors"] += 1
+                print(f"[RESIDENCY] Error revisando modelos: {e}")
+
+    def stats(self) -> dict:
+        now = time.time()
+        keep, drop = self.plan()
+        return {
+            "keep_alive": self.keep_alive,
+            "budget_mb": self.budget_mb or None,
+            "wanted": keep,
+            "over_budget": drop,
+            "resident": {
+                name: {"size_mb": round(s["size"] / (1 << 20), 1), "size_vram_mb": round(s["size_vram"] / (1 << 20), 1),
+                       "expires_in": round(s["expires_at"] - now, 1) if s["expires_at"] is not None else None}
+                for name, s in self._resident.items()
+            },
+            "last_check_age": round(now - self._last_check, 1) if self._last_check else None,
+            **self._counts,
+        }
+
+
+residency = ModelResidency()
@@ -0,0 +1,217 @@
+"""Cliente HTTP compartido para todo el tráfico hacia Ollama.
+
+Un único httpx.AsyncClient con pool de conexiones acotado (keep-alive entre llamadas),
+timeouts por llamada, límite de concurrencia y reintentos con backoff ante errores de conexión.
+La app lo abre en el startup y lo cierra en el shutdown; si se usa antes se crea en forma perezosa.
+Los requests que llevan "model" pasan además por la admisión por modelo (admission.py).
+"""
+import os
+import time
+import random
+import asyncio
+import httpx
+
+from admission import admission, PRIORITY_CHAT
+
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434")
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "20"))
+OLLAMA_MAX_KEEPALIVE = int(os.getenv("OLLAMA_MAX_KEEPALIVE", "10"))
+OLLAMA_CONCURRENCY = int(os.getenv("OLLAMA_CONCURRENCY", "8"))
+OLLAMA_RETRIES = int(os.getenv("OLLAMA_RETRIES", "2"))
+OLLAMA_RETRY_BACKOFF = float(os.getenv("OLLAMA_RETRY_BACKOFF", "0.5"))  # segundos, se duplica en cada intento
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "120"))
+
+# Solo se reintenta lo que no llegó a generar: fallos de conexión y respuestas de gateway
+RETRY_EXCEPTIONS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout, httpx.RemoteProtocolError)
+RETRY_STATUS = {502, 503, 504}
+
+
+class OllamaStream:
+    """Respuesta en streaming que mantiene ocupado un slot de concurrencia hasta cerrarse."""
+
+    def __init__(self, response: httpx.Response, release):
+        self.response = response
+        self._release = release
+        self._closed = False
+
+    def aiter_lines(self):
+        return self.response.aiter_lines()
+
+    async def aclose(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            await self.response.aclose()
+        finally:
+            self._release()
+
+
+class OllamaClient:
+    def __init__(self, base_url: str = OLLAMA_URL, max_connections: int = OLLAMA_MAX_CONNECTIONS,
+                 max_keepalive: int = OLLAMA_MAX_KEEPALIVE, concurrency: int = OLLAMA_CONCURRENCY,
+                 retries: int = OLLAMA_RETRIES, backoff: float = OLLAMA_RETRY_BACKOFF):
+        self.base_url = base_url.rstrip("/")
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self._client: httpx.AsyncClient | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+        # Contadores para /ollama/stats
+        self._in_flight = 0
+        self._waiting = 0
+        self._peak_in_flight = 0
+        self._requests = 0
+        self._retried = 0
+        self._errors = 0
+        self._acquisitions = 0
+        self._wait_total = 0.0
+
+    async def start(self):
+        self._ensure()
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+        self._client = None
+        self._semaphore = None
+
+    def _ensure(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_keepalive),
+                timeout=httpx.Timeout(OLLAMA_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT),
+            )
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._client
+
+    async def _admit(self, payload: dict | None, priority: int):
+        """Lugar en la cola del modelo (antes del semáforo global); devuelve la función que lo libera."""
+        model = (payload or {}).get("model")
+        if not model:
+            return lambda: None
+        return await admission.acquire(model, priority)
+
+    async def _acquire(self):
+        self._ensure()
+        start = time.perf_counter()
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+        self._acquisitions += 1
+        self._wait_total += time.perf_counter() - start
+        self._in_flight += 1
+        self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+
+    def _release(self):
+        self._in_flight -= 1
+        self._semaphore.release()
+
+    def _timeout(self, timeout: float | None):
+        if timeout is None:
+            return httpx.USE_CLIENT_DEFAULT
+        return httpx.Timeout(timeout, connect=min(timeout, OLLAMA_CONNECT_TIMEOUT))
+
+    async def _send(self, request: httpx.Request, stream: bool = False) -> httpx.Response:
+        """Envía con reintentos y backoff exponencial; debe llamarse con un slot tomado."""
+        client = self._ensure()
+        attempt = 0
+        while True:
+            self._requests += 1
+            try:
+                response = await client.send(request, stream=stream)
+                if response.status_code in RETRY_STATUS and attempt < self.retries:
+                    await response.aclose()
+                else:
+                    if response.status_code >= 400:
+                        if stream:
+                            await response.aread()
+                            await response.aclose()
+                        response.raise_for_status()
+                    return response
+            except RETRY_EXCEPTIONS:
+                if attempt >= self.retries:
+                    self._errors += 1
+                    raise
+            except Exception:
+                self._errors += 1
+                raise
+            attempt += 1
+            self._retried += 1
+            await asyncio.sleep(self.backoff * (2 ** (attempt - 1)) * (1 + random.random() * 0.25))
+
+    async def request(self, method: str, path: str, json: dict | None = None, timeout: float | None = None,
+                      priority: int = PRIORITY_CHAT) -> httpx.Response:
+        request = self._ensure().build_request(method, path, json=json, timeout=self._timeout(timeout))
+        admitted = await self._admit(json, priority)
+        try:
+            await self._acquire()
+            try:
+                return await self._send(request)
+            finally:
+                self._release()
+        finally:
+            admitted()
+
+    async def post_json(self, path: str, payload: dict, timeout: float | None = None, priority: int = PRIORITY_CHAT) -> dict:
+        r = await self.request("POST", path, json=payload, timeout=timeout, priority=priority)
+        return r.json()
+
+    async def get_json(self, path: str, timeout: float | None = None) -> dict:
+        r = await self.request("GET", path, timeout=timeout)
+        return r.json()
+
+    async def open_stream(self, path: str, payload: dict, timeout: float | None = None,
+                          priority: int = PRIORITY_CHAT) -> OllamaStream:
+        """Abre una respuesta en streaming; el slot (y el lugar del modelo) se liberan al llamar a aclose()."""
+        request = self._ensure().build_request("POST", path, json=payload, timeout=self._timeout(timeout))
+        admitted = await self._admit(payload, priority)
+        try:
+            await self._acquire()
+        except BaseException:
+            admitted()
+            raise
+        try:
+            response = await self._send(request, stream=True)
+        except BaseException:
+            self._release()
+            admitted()
+            raise
+
+        def release():
+            self._release()
+            admitted()
+        return OllamaStream(response, release)
+
+    def stats(self) -> dict:
+        pool = {"connections": None, "idle": None}
+        try:
+            # httpx no expone el pool públicamente; se lee del transporte de httpcore si está disponible
+            conns = self._client._transport._pool.connections if self._client is not None else []
+            pool = {"connections": len(conns), "idle": sum(1 for c in conns if c.is_idle())}
+        except Exception:
+            pass
+        return {
+            "base_url": self.base_url,
+            "max_connections": self.max_connections,
+            "max_keepalive": self.max_keepalive,
+            "concurrency_limit": self.concurrency,
+            "in_flight": self._in_flight,
+            "waiting": self._waiting,
+            "peak_in_flight": self._peak_in_flight,
+            "requests": self._requests,
+            "retries": self._retried,
+            "errors": self._errors,
+            "avg_wait_ms": round(self._wait_total * 1000 / max(1, self._acquisitions), 2),
+            "pool": pool,
+            "saturated": self._in_flight >= self.concurrency,
+        }
+
+
+ollama = OllamaClient()
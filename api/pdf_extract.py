@@ -0,0 +1,102 @@
+"""Extracción de texto de PDF por páginas, en paralelo y en streaming.
+
+Los rangos de páginas se reparten en un pool de procesos (pypdf es Python puro y no libera el GIL)
+y se entregan en orden como (número de página, texto) a medida que terminan, con una ventana
+acotada de rangos en vuelo para que la memoria no crezca con el tamaño del documento.
+Este módulo solo depende de pypdf para que los procesos hijos arranquen livianos.
+"""
+import os
+import threading
+import traceback
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from pypdf import PdfReader
+
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "8"))
+# Por debajo de este número de páginas no compensa el costo de repartir entre procesos
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "24"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: no heredar threads de torch/uvicorn del proceso padre
+            _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _extract_range(path: str, start: int, end: int) -> list[tuple[int, str]]:
+    """Extrae las páginas [start, end) de un PDF (se ejecuta en un proceso hijo)."""
+    out = []
+    try:
+        reader = PdfReader(path)
+        for i in range(start, end):
+            try:
+                out.append((i + 1, reader.pages[i].extract_text() or ""))
+            except Exception:
+                print(f"Warning: fallo extrayendo página {i + 1} de {path}:\n", traceback.format_exc())
+                out.append((i + 1, ""))
+    except Exception:
+        print(f"Warning: fallo abriendo PDF {path} (páginas {start + 1}-{end}):\n", traceback.format_exc())
+        out = [(i + 1, "") for i in range(start, end)]
+    return out
+
+
+def iter_pdf_pages(path: str, progress=None):
+    """Genera (número de página, texto) en orden; `progress` recibe pages_total y pages_parsed."""
+    try:
+        reader = PdfReader(path)
+        total = len(reader.pages)
+    except Exception:
+        print(f"Warning: fallo extrayendo texto de PDF {path}:\n", traceback.format_exc())
+        return
+    if progress is not None:
+        progress(pages_total=total)
+
+    if total < PDF_PARALLEL_MIN_PAGES or PDF_WORKERS <= 1:
+        for i in range(total):
+            page_no, text = _extract_page(reader, path, i)
+            yield page_no, text
+            if progress is not None:
+                progress(pages_parsed=i + 1)
+        return
+
+    pool = _get_pool()
+    ranges = iter([(s, min(s + PDF_PAGES_PER_TASK, total)) for s in range(0, total, PDF_PAGES_PER_TASK)])
+    in_flight = deque()
+    for _ in range(PDF_WORKERS * 2):
+        r = next(ranges, None)
+        if r is None:
+            break
+        in_flight.append(pool.submit(_extract_range, path, *r))
+    parsed = 0
+    try:
+        while in_flight:
+            pages = in_flight.popleft().result()
+            r = next(ranges, None)
+            if r is not None:
+                in_flight.append(pool.submit(_extract_range, path, *r))
+            for page_no, text in pages:
+                yield page_no, text
+            parsed += len(pages)
+            if progress is not None:
+                progress(pages_parsed=parsed)
+    finally:
+        # Si el consumidor abandona el generador no se siguen extrayendo páginas
+        for fut in in_flight:
+            fut.cancel()
+
+
+def _extract_page(reader: PdfReader, path: str, i: int) -> tuple[int, str]:
+    try:
+        return i + 1, reader.pages[i].extract_text() or ""
+    except Exception:
+        print(f"Warning: fallo extrayendo página {i + 1} de {path}:\n", traceback.format_exc())
+        return i + 1, ""
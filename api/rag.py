@@ -1,26 +1,54 @@
 import os
+import time
 import traceback
-import chromadb
-from chromadb.config import Settings
-from sentence_transformers import SentenceTransformer
-from pypdf import PdfReader
+import threading
+import hashlib
+from pdf_extract import iter_pdf_pages
+from embedding_cache import EmbeddingCache
+from embed_backends import EMBED_BACKEND, embedding_key, load_embedder
+from chunker import CHUNK_STRATEGY, CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS, iter_token_chunks, tokenizer_counter, estimate_counter
+from lexical_index import lexical_index
+from doc_catalog import doc_catalog
+from vector_partitions import SessionCollections, GENERATION_FILE
 
 
 # Elimina todos los documentos PDF y su contexto para una sesión
 def delete_docs_for_session(session_id: str):
-    # Eliminar archivos PDF
-    for fname in os.listdir(UPLOAD_DIR):
-        if fname.endswith(".pdf") and fname.startswith(f"{session_id}_"):
-            try:
-                os.remove(os.path.join(UPLOAD_DIR, fname))
-            except Exception as e:
-                print(f"Error eliminando archivo {fname}: {e}")
-    # Eliminar del vector DB
-    if _collection:
-        _collection.delete(where={"client_id": session_id})
+    # Eliminar archivos PDF (los que registra el catálogo para la sesión)
+    for fname in doc_catalog.remove_session(session_id):
+        try:
+            path = os.path.join(UPLOAD_DIR, fname)
+            if os.path.exists(path):
+                os.remove(path)
+        except Exception as e:
+            print(f"Error eliminando archivo {fname}: {e}")
+    # Eliminar del vector DB: se borra la colección de la sesión
+    partitions = get_partitions()
+    if partitions:
+        with partitions.gate.write():
+            partitions.drop(session_id)
+    lexical_index.delete_client(session_id)
 
 # Elimina un documento PDF y su contexto de una sesión
+def _owns_document(session_id: str, filename: str) -> bool:
+    """La sesión dueña sale del catálogo o, si el archivo no está catalogado, de los fragmentos en Chroma.
+
+    El nombre del archivo no sirve: los session_id pueden contener "_" ("a" no es dueña de "a_b_informe.pdf").
+    """
+    row = doc_catalog.get(filename)
+    if row is not None:
+        return row["session_id"] == session_id
+    partitions = get_partitions()
+    col = partitions.get(session_id) if partitions else None
+    # La colección es solo de la sesión: si tiene fragmentos del archivo, el archivo es suyo
+    return bool(col is not None and col.get(where={"source": filename}, limit=1, include=[]).get("ids"))
+
+
 def delete_single_doc(session_id: str, filename: str):
+    # Solo se aceptan archivos de la propia sesión
+    if os.path.basename(filename) != filename or not _owns_document(session_id, filename):
+        print(f"Warning: {filename} no pertenece a la sesión {session_id}, no se elimina")
+        return False
     # Eliminar archivo PDF
     file_path = os.path.join(UPLOAD_DIR, filename)
     try:
@@ -28,76 +56,158 @@ def delete_single_doc(session_id: str, filename: str):
             os.remove(file_path)
     except Exception as e:
         print(f"Error eliminando archivo {filename}: {e}")
-    # Eliminar del vector DB (por metadatos)
+    # Eliminar del vector DB (por metadatos, dentro de la colección de la sesión)
     try:
-        if _collection:
-            # ChromaDB espera solo un campo en where, usamos 'source' para eliminar el documento específico
-            _collection.delete(where={"source": filename})
+        partitions = get_partitions()
+        col = partitions.get(session_id) if partitions else None
+        if col is not None:
+            with partitions.gate.write():
+                col.delete(where={"source": filename})
     except Exception as e:
         print(f"Error eliminando del vector DB {filename}: {e}")
+    try:
+        lexical_index.delete_source(session_id, filename)
+    except Exception as e:
+        print(f"Error eliminando del índice léxico {filename}: {e}")
+    doc_catalog.remove(filename)
     return True
 
-# Devuelve la lista de documentos PDF subidos para una sesión
-def get_docs_for_session(session_id: str):
-    docs = []
-    if not os.path.exists(UPLOAD_DIR):
-        return docs
-    for fname in os.listdir(UPLOAD_DIR):
-        if fname.endswith(".pdf") and fname.startswith(f"{session_id}_"):
-            docs.append(fname)
-    return docs
+# Devuelve los documentos subidos para una sesión (del catálogo; sin las subidas a medio escribir)
+def get_docs_for_session(session_id: str, details: bool = False):
+    docs = doc_catalog.list_session(session_id)
+    return docs if details else [d["stored_name"] for d in docs]
 
 
 EMBED_MODEL = os.getenv("EMBED_MODEL", "sentence-transformers/all-mpnet-base-v2")
+# Modelo + backend (torch, onnx, onnx-int8): identifica los vectores en la caché y en la metadata
+EMBED_KEY = embedding_key(EMBED_MODEL, EMBED_BACKEND)
 CHROMA_DIR = os.getenv("CHROMA_DIR", "storage/vectordb")
 UPLOAD_DIR = os.getenv("UPLOAD_DIR", "storage/uploads")
+# Colección única anterior a la partición por sesión; sus fragmentos se migran a demanda
 COLLECTION = "docs"
+# Chunks por lote de embedding/inserción durante la ingesta
+EMBED_BATCH = int(os.getenv("EMBED_BATCH", "64"))
+# Búsqueda híbrida: vectorial + BM25 fusionadas por reciprocal rank fusion
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "true").lower() in ("1", "true", "yes")
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Candidatos por lista antes de fusionar, como múltiplo de top_k
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "3"))
 
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(CHROMA_DIR, exist_ok=True)
 
+# Chroma y el modelo de embeddings se inicializan en el primer uso (o en background al arrancar la API):
+# importar este módulo no bloquea el arranque del servidor
 _client = None
-_collection = None
+_partitions = None
+_vector_store_loaded = False
+_vector_store_lock = threading.Lock()
 _embedder = None
+_embedder_loaded = False
+_embedder_lock = threading.Lock()
+# Fragmentos repetidos entre sesiones/versiones y preguntas frecuentes no vuelven a pasar por el modelo
+embedding_cache = EmbeddingCache(EMBED_KEY)
 
-try:
-    _client = chromadb.PersistentClient(path=CHROMA_DIR, settings=Settings(allow_reset=False))
-    _collection = _client.get_or_create_collection(COLLECTION, metadata={"hnsw:space": "cosine"})
-except Exception:
-    print("Warning: fallo inicializando chromadb persistent client, usando cliente en memoria.\n", traceback.format_exc())
-    try:
-        _client = chromadb.Client(Settings())
-        _collection = _client.get_or_create_collection(COLLECTION, metadata={"hnsw:space": "cosine"})
-    except Exception:
-        print("Error: no se pudo inicializar chroma client:\n", traceback.format_exc())
-        _collection = None
 
-try:
-    _embedder = SentenceTransformer(EMBED_MODEL, device="cpu")
-except Exception:
-    print("Warning: fallo cargando modelo de embeddings:\n", traceback.format_exc())
-    _embedder = None
+def get_partitions() -> SessionCollections | None:
+    """Colecciones por sesión; abre Chroma la primera vez. None si no se pudo inicializar."""
+    global _client, _partitions, _vector_store_loaded
+    if _vector_store_loaded:
+        return _partitions
+    with _vector_store_lock:
+        if _vector_store_loaded:
+            return _partitions
+        import chromadb
+        from chromadb.config import Settings
+        try:
+            _client = chromadb.PersistentClient(path=CHROMA_DIR, settings=Settings(allow_reset=False))
+        except Exception:
+            print("Warning: fallo inicializando chromadb persistent client, usando cliente en memoria.\n", traceback.format_exc())
+            try:
+                _client = chromadb.Client(Settings())
+            except Exception:
+                print("Error: no se pudo inicializar chroma client:\n", traceback.format_exc())
+                _client = None
+        # Una colección por sesión, abiertas a demanda
+        _partitions = SessionCollections(_client, legacy_name=COLLECTION,
+                                         generation_path=os.path.join(CHROMA_DIR, GENERATION_FILE)) if _client is not None else None
+        _vector_store_loaded = True
+    return _partitions
 
 
-def _embed(texts: list[str]) -> list[list[float]]:
+def get_embedder():
+    """SentenceTransformer (backend EMBED_BACKEND) cargado en el primer uso. None si no se pudo cargar."""
+    global _embedder, _embedder_loaded
+    if _embedder_loaded:
+        return _embedder
+    with _embedder_lock:
+        if _embedder_loaded:
+            return _embedder
+        try:
+            _embedder = load_embedder(EMBED_MODEL, EMBED_BACKEND)
+        except Exception:
+            print("Warning: fallo cargando modelo de embeddings:\n", traceback.format_exc())
+            _embedder = None
+        _embedder_loaded = True
+    return _embedder
+
+
+def _encode(texts: list[str]) -> list[list[float]]:
     """Genera embeddings usando SentenceTransformer cargado; lanza excepción clara si no está disponible."""
-    if _embedder is None:
+    embedder = get_embedder()
+    if embedder is None:
         raise RuntimeError("Embedding model not loaded. Check server logs for errors when loading SentenceTransformer.")
     try:
-        return _embedder.encode(texts, normalize_embeddings=True).tolist()
+        return embedder.encode(texts, normalize_embeddings=True).tolist()
     except Exception as e:
         tb = traceback.format_exc()
         raise RuntimeError(f"Error generating embeddings: {e}\n{tb}")
 
 
-def pdf_to_text(path: str) -> str:
+def _embed_cached(texts: list[str]) -> tuple[list[list[float]], int]:
+    """Embeddings pasando por la caché (memoria + disco); devuelve (vectores, servidos desde caché)."""
+    return embedding_cache.embed(texts, _encode)
+
+
+def _embed(texts: list[str]) -> list[list[float]]:
+    return _embed_cached(texts)[0]
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def find_document_by_hash(client_id: str, file_hash: str) -> dict | None:
+    """Metadatos de un documento ya indexado en la sesión con el mismo contenido, si existe."""
+    doc = doc_catalog.find_by_hash(client_id, file_hash)
+    if doc is not None:
+        return {"source": doc["stored_name"], "original_filename": doc["original_filename"], "file_hash": file_hash}
+    # Documentos indexados antes del catálogo y todavía sin reconciliar
+    partitions = get_partitions()
+    col = partitions.get(client_id) if partitions else None
+    if col is None:
+        return None
+    res = col.get(where={"file_hash": file_hash}, limit=1, include=["metadatas"])
+    metas = res.get("metadatas") or []
+    return metas[0] if metas else None
+
+
+def _report(progress, **fields):
+    """Notifica avance de ingesta al callback opcional sin dejar que sus errores corten la ingesta."""
+    if progress is None:
+        return
     try:
-        with open(path, "rb") as f:
-            reader = PdfReader(f)
-            return "\n".join(page.extract_text() or "" for page in reader.pages)
+        progress(**fields)
     except Exception:
-        print(f"Warning: fallo extrayendo texto de PDF {path}:\n", traceback.format_exc())
-        return ""
+        print("Warning: fallo reportando progreso de ingesta:\n", traceback.format_exc())
+
+
+def pdf_to_text(path: str, progress=None) -> str:
+    return "\n".join(text for _, text in iter_pdf_pages(path, progress=lambda **f: _report(progress, **f)))
 
 
 def chunk(text: str, size: int = 400, overlap: int = 100) -> list[str]:
@@ -117,52 +227,317 @@ def chunk(text: str, size: int = 400, overlap: int = 100) -> list[str]:
     return [c for c in chunks if len(c.split()) > 10]
 
 
-def add_document(file_path: str, client_id: str, original_filename: str = None) -> int:
-    if file_path.lower().endswith(".pdf"):
-        text = pdf_to_text(file_path)
-    else:
-        try:
-            with open(file_path, "r", encoding="utf-8", errors="ignore") as fh:
-                text = fh.read()
-        except Exception:
-            print(f"Warning: fallo leyendo archivo de texto {file_path}:\n", traceback.format_exc())
-            text = ""
+def iter_chunks(pages, size: int = 400, overlap: int = 100):
+    """Versión en streaming de chunk: consume (página, texto) y genera (fragmento, página de inicio).
 
-    # Fragmentar con tamaño y solapamiento óptimos
-    pieces = chunk(text, size=150, overlap=30)
-    if not pieces:
-        return 0
+    Produce las mismas ventanas que chunk() sobre el texto concatenado, pero solo retiene en memoria
+    las palabras de la ventana en curso.
+    """
+    step = size - overlap
+    words: list[str] = []
+    word_pages: list[int] = []
+    for page_no, text in pages:
+        for w in text.split():
+            words.append(w)
+            word_pages.append(page_no)
+        while len(words) >= size:
+            if size > 10:
+                yield " ".join(words[:size]), word_pages[0]
+            del words[:step]
+            del word_pages[:step]
+    # Ventanas finales (más cortas), igual que el último tramo de chunk()
+    while words:
+        if len(words) > 10:
+            yield " ".join(words[:size]), word_pages[0]
+        del words[:step]
+        del word_pages[:step]
+
+
+def token_counter():
+    """Cuenta tokens con el tokenizer del modelo de embeddings (estimación si no está disponible)."""
+    tokenizer = getattr(get_embedder(), "tokenizer", None)
+    return tokenizer_counter(tokenizer) if tokenizer is not None else estimate_counter
+
+
+def document_chunks(pages, count=None):
+    """Fragmentos (texto, página) según CHUNK_STRATEGY: por tokens y oraciones, o ventanas de palabras.
+
+    `count` reemplaza al contador de tokens del embedder cargado (procesos que solo fragmentan).
+    """
+    if CHUNK_STRATEGY == "words":
+        return iter_chunks(pages, size=150, overlap=30)
+    return iter_token_chunks(pages, max_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS, count=count or token_counter())
 
-    if _collection is None:
-        raise RuntimeError("Chroma collection not initialized. Check server logs for initialization errors.")
 
-    ids = [f"{client_id}_{os.path.basename(file_path)}_{i}" for i in range(len(pieces))]
+def _read_pages(file_path: str, progress=None):
+    if file_path.lower().endswith(".pdf"):
+        yield from iter_pdf_pages(file_path, progress=lambda **f: _report(progress, **f))
+        return
+    try:
+        with open(file_path, "r", encoding="utf-8", errors="ignore") as fh:
+            yield 1, fh.read()
+    except Exception:
+        print(f"Warning: fallo leyendo archivo de texto {file_path}:\n", traceback.format_exc())
+
+
+def chunk_records(client_id: str, source: str, original_filename: str | None, file_hash: str, start: int,
+                  pages: list[int]) -> tuple[list[str], list[dict]]:
+    """Ids y metadatos de los fragmentos start.. de un documento (ids deterministas: reindexar no duplica)."""
+    ids = [f"{client_id}_{source}_{start + i}" for i in range(len(pages))]
     metas = [{
         "client_id": client_id,
-        "source": os.path.basename(file_path),
-        "original_filename": original_filename or os.path.basename(file_path),
-        "chunk": i
-    } for i in range(len(pieces))]
-    embs = _embed(pieces)
+        "source": source,
+        "original_filename": original_filename or source,
+        "chunk": start + i,
+        "page": page,
+        "file_hash": file_hash,
+        "embed_key": EMBED_KEY,
+    } for i, page in enumerate(pages)]
+    return ids, metas
+
+
+def store_chunks(collection, client_id: str, source: str, ids: list[str], pieces: list[str],
+                 embeddings: list[list[float]], metas: list[dict]):
+    """Guarda fragmentos ya embebidos en Chroma y en el índice BM25."""
     try:
-        _collection.add(documents=pieces, embeddings=embs, metadatas=metas, ids=ids)
-    except Exception as e:
+        # upsert para que reintentar un job no duplique fragmentos
+        collection.upsert(documents=pieces, embeddings=embeddings, metadatas=metas, ids=ids)
+    except Exception:
         print("Error añadiendo documentos a chroma:\n", traceback.format_exc())
         raise
-    return len(pieces)
+    lexical_index.add(client_id, source, list(zip(ids, pieces)))
+
+
+def add_document(file_path: str, client_id: str, original_filename: str = None, progress=None, file_hash: str = None) -> int:
+    """Indexa un archivo en Chroma en streaming: páginas -> fragmentos -> lotes de EMBED_BATCH embeddings.
+
+    Los fragmentos cuyo texto ya fue embebido (en cualquier sesión o versión) reutilizan el embedding
+    guardado. `progress` recibe pages_total/pages_parsed/chunks_embedded/chunks_reused durante la
+    ingesta y chunks_total al final.
+    """
+    partitions = get_partitions()
+    if partitions is None:
+        raise RuntimeError("Chroma collection not initialized. Check server logs for initialization errors.")
+
+    # Un snapshot o una compactación en curso esperan a que termine la ingesta (y viceversa)
+    with partitions.gate.write():
+        return _add_document(partitions, file_path, client_id, original_filename, progress, file_hash)
+
+
+def _add_document(partitions, file_path: str, client_id: str, original_filename: str | None, progress,
+                  file_hash: str | None) -> int:
+    collection = partitions.get(client_id, create=True)
+    source = os.path.basename(file_path)
+    file_hash = file_hash or file_sha256(file_path)
+    batch: list[tuple[str, int]] = []
+    count = 0
+    reused = 0
+    pages = {"pages_total": None, "last": 0}
+
+    def report(**fields):
+        if "pages_total" in fields:
+            pages["pages_total"] = fields["pages_total"]
+        _report(progress, **fields)
+
+    def flush():
+        pieces = [text for text, _ in batch]
+        ids, metas = chunk_records(client_id, source, original_filename, file_hash, count, [page for _, page in batch])
+        embs, batch_reused = _embed_cached(pieces)
+        store_chunks(collection, client_id, source, ids, pieces, embs, metas)
+        return batch_reused
+
+    for piece in document_chunks(_read_pages(file_path, report)):
+        pages["last"] = max(pages["last"], piece[1] or 0)
+        batch.append(piece)
+        if len(batch) >= EMBED_BATCH:
+            reused += flush()
+            count += len(batch)
+            batch = []
+            _report(progress, chunks_embedded=count, chunks_reused=reused)
+    if batch:
+        reused += flush()
+        count += len(batch)
+    _report(progress, chunks_total=count, chunks_embedded=count, chunks_reused=reused)
+    doc_catalog.record_indexed(client_id, source, original_filename, file_hash, os.path.getsize(file_path),
+                               pages["pages_total"] or pages["last"] or None, count)
+    if reused:
+        print(f"[INGEST] {source}: {reused}/{count} fragmentos reutilizados del almacén de embeddings")
+    return count
 
 
 def query_relevant(question: str, client_id: str, top_k: int = 4) -> list[dict]:
-    res = _collection.query(
-        query_embeddings=_embed([question]),
-        n_results=top_k,
-        where={"client_id": client_id},
+    return query_by_embedding(_embed([question])[0], client_id, top_k=top_k, question=question)
+
+
+def query_by_embedding(embedding: list[float], client_id: str, top_k: int = 4, question: str = None) -> list[dict]:
+    """Igual que query_relevant pero con el embedding de la consulta ya calculado.
+
+    Si se pasa `question` (y HYBRID_SEARCH está activo) los resultados vectoriales se fusionan con los
+    del índice BM25 por reciprocal rank fusion. meta["score"] es siempre la similitud coseno.
+    """
+    return query_by_embeddings([embedding], client_id, top_k=top_k, questions=[question])[0]
+
+
+def query_by_embeddings(embeddings: list[list[float]], client_id: str, top_k: int = 4,
+                        questions: list[str | None] | None = None) -> list[list[dict]]:
+    """query_by_embedding para varias consultas de una sesión con una sola consulta a Chroma."""
+    partitions = get_partitions()
+    collection = partitions.get(client_id) if partitions else None
+    if collection is None or not embeddings:
+        return [[] for _ in embeddings]
+    questions = list(questions or [None] * len(embeddings))
+    hybrid = HYBRID_SEARCH and any(questions)
+    n_candidates = top_k * HYBRID_CANDIDATES if hybrid else top_k
+    # La colección es solo de la sesión: no hace falta filtrar por client_id
+    res = collection.query(
+        query_embeddings=embeddings,
+        n_results=n_candidates,
+        include=["documents", "metadatas", "distances"],
     )
-    docs = res.get("documents", [[]])[0]
-    metas = res.get("metadatas", [[]])[0]
-    out = []
-    for d, m in zip(docs, metas):
-        out.append({"text": d, "meta": m})
-    return out
+    results: list[dict[str, dict]] = []
+    for q in range(len(embeddings)):
+        hits: dict[str, dict] = {}
+        for cid, d, m, dist in zip(res["ids"][q], res["documents"][q], res["metadatas"][q], res["distances"][q]):
+            meta = dict(m or {})
+            meta["score"] = round(1 - float(dist), 4)
+            hits[cid] = {"id": cid, "text": d, "meta": meta}
+        results.append(hits)
+
+    ranked: list[list[str]] = []
+    for q, hits in enumerate(results):
+        if not (HYBRID_SEARCH and questions[q]):
+            ranked.append(list(hits)[:top_k])
+            continue
+        fused: dict[str, float] = {}
+        for rank, cid in enumerate(hits):
+            fused[cid] = 1 / (RRF_K + rank + 1)
+        for rank, (cid, _) in enumerate(lexical_index.search(client_id, questions[q], top_k=n_candidates)):
+            fused[cid] = fused.get(cid, 0.0) + 1 / (RRF_K + rank + 1)
+        ranked.append(sorted(fused, key=fused.get, reverse=True)[:top_k])
+
+    # Los que solo encontró BM25 se completan desde Chroma con su similitud real (un solo get para todas)
+    missing = list(dict.fromkeys(cid for q, best in enumerate(ranked) for cid in best if cid not in results[q]))
+    if missing:
+        extra = collection.get(ids=missing, include=["documents", "metadatas", "embeddings"])
+        found = {cid: (d, m, e) for cid, d, m, e in zip(extra["ids"], extra["documents"], extra["metadatas"], extra["embeddings"])}
+        for q, best in enumerate(ranked):
+            for cid in best:
+                if cid in results[q] or cid not in found:
+                    continue
+                d, m, e = found[cid]
+                meta = dict(m or {})
+                meta["score"] = round(float(sum(a * b for a, b in zip(embeddings[q], e))), 4)
+                results[q][cid] = {"id": cid, "text": d, "meta": meta}
+    return [[results[q][cid] for cid in best if cid in results[q]] for q, best in enumerate(ranked)]
+
+
+def backfill_lexical_index(page_size: int = 1000) -> int:
+    """Construye el índice BM25 desde Chroma si está vacío (colecciones indexadas antes de tenerlo)."""
+    partitions = get_partitions()
+    if partitions is None or lexical_index.count() > 0:
+        return 0
+    total = 0
+    for collection in partitions.all_collections():
+        offset = 0
+        while True:
+            res = collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+            ids = res.get("ids") or []
+            if not ids:
+                break
+            groups: dict[tuple[str, str], list[tuple[str, str]]] = {}
+            for cid, d, m in zip(ids, res["documents"], res["metadatas"]):
+                m = m or {}
+                groups.setdefault((m.get("client_id", ""), m.get("source", "")), []).append((cid, d or ""))
+            for (client_id, source), items in groups.items():
+                lexical_index.add(client_id, source, items)
+            total += len(ids)
+            offset += len(ids)
+    if total:
+        print(f"[LEXICAL] Índice BM25 reconstruido con {total} fragmentos")
+    return total
+
+
+
+
+def _vector_documents(page_size: int = 1000) -> dict[tuple[str, str], dict]:
+    """(sesión, archivo) -> fragmentos y metadatos, recorriendo todas las colecciones de Chroma."""
+    partitions = get_partitions()
+    found: dict[tuple[str, str], dict] = {}
+    if partitions is None:
+        return found
+    for collection in partitions.all_collections():
+        offset = 0
+        while True:
+            res = collection.get(include=["metadatas"], limit=page_size, offset=offset)
+            ids = res.get("ids") or []
+            if not ids:
+                break
+            for m in res["metadatas"]:
+                m = m or {}
+                doc = found.setdefault((m.get("client_id", ""), m.get("source", "")), {
+                    "chunks": 0, "pages": 0, "original_filename": m.get("original_filename"), "file_hash": m.get("file_hash")})
+                doc["chunks"] += 1
+                doc["pages"] = max(doc["pages"], m.get("page") or 0)
+            offset += len(ids)
+    return found
+
+
+def check_catalog(fix: bool = False, sample: int = 50) -> dict:
+    """Compara catálogo, directorio de subidas y Chroma. Con fix=True:
+
+    - fragmentos sin fila en el catálogo: se registran con la sesión de su metadata (client_id) si el
+      archivo existe, si no se eliminan;
+    - archivos sin fila ni fragmentos (subidas que nunca se indexaron): solo se informan, porque no hay
+      de dónde tomar su sesión (el nombre no la identifica);
+    - filas cuyo archivo ya no existe: se eliminan junto con sus fragmentos;
+    - filas 'indexed' sin fragmentos en Chroma: pasan a 'failed' para poder reindexarse.
+    """
+    catalog = doc_catalog.all_names()
+    files = set(os.listdir(UPLOAD_DIR)) if os.path.isdir(UPLOAD_DIR) else set()
+    vectors = _vector_documents()
+    vector_names = {name for _, name in vectors}
+    now = time.time()
+    report = {"untracked_vectors": [], "untracked_files": [], "missing_files": [], "missing_vectors": []}
+
+    for (session_id, name), doc in vectors.items():
+        if name in catalog:
+            continue
+        report["untracked_vectors"].append(name)
+        if not fix or not session_id:
+            continue
+        path = os.path.join(UPLOAD_DIR, name)
+        if os.path.exists(path):
+            doc_catalog.record_indexed(session_id, name, doc["original_filename"], doc["file_hash"] or file_sha256(path),
+                                       os.path.getsize(path), doc["pages"] or None, doc["chunks"])
+        else:
+            delete_single_doc(session_id, name)
+    for name in sorted(files - set(catalog) - vector_names):
+        if not name.lower().endswith(".pdf"):
+            continue
+        report["untracked_files"].append(name)
+    for name, row in catalog.items():
+        if name in files:
+            if row["status"] == "indexed" and name not in vector_names and row["chunks"]:
+                report["missing_vectors"].append(name)
+                if fix:
+                    doc_catalog.set_status(name, "failed")
+            continue
+        # Una subida en curso todavía no tiene archivo completo
+        if row["status"] == "uploading" and now - row["uploaded_at"] < 3600:
+            continue
+        report["missing_files"].append(name)
+        if fix:
+            delete_single_doc(row["session_id"], name)
+    summary = {key: len(names) for key, names in report.items()}
+    print(f"[CATALOG] Revisión de consistencia{' (con corrección)' if fix else ''}: {summary}")
+    return {"fixed": fix, "catalog": len(catalog), "files": len(files), "vector_documents": len(vectors),
+            "counts": summary, **{key: names[:sample] for key, names in report.items()}}
 
 
+def backfill_catalog() -> dict | None:
+    """Primer arranque con catálogo: registra los documentos subidos e indexados antes de tenerlo."""
+    if doc_catalog.count() > 0:
+        return None
+    if not (os.path.isdir(UPLOAD_DIR) and os.listdir(UPLOAD_DIR)) and get_partitions() is None:
+        return None
+    return check_catalog(fix=True)
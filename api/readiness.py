@@ -0,0 +1,98 @@
+"""Estado de arranque de los componentes pesados (modelo de embeddings, Chroma, precalentamiento de Ollama).
+
+La API empieza a responder apenas arranca uvicorn; estos componentes se cargan en background y cada
+uno registra su estado y cuánto tardó. /ready lo expone para los probes, y los endpoints que los
+necesitan esperan a que estén listos (hasta READY_WAIT_TIMEOUT) en lugar de fallar.
+"""
+import os
+import time
+import asyncio
+
+READY_WAIT_TIMEOUT = float(os.getenv("READY_WAIT_TIMEOUT", "120"))  # segundos
+
+
+class Readiness:
+    def __init__(self, required: tuple[str, ...] = ("embedder", "chroma")):
+        # Los componentes requeridos definen si la API está lista; el resto es informativo
+        self.required = required
+        self._t0 = time.perf_counter()
+        self._components: dict[str, dict] = {}
+        self._events: dict[str, asyncio.Event] = {}
+        self._summary_logged = False
+        for name in required:
+            self._entry(name)
+
+    def require(self, name: str):
+        """Agrega un componente a los que definen si la API está lista."""
+        if name not in self.required:
+            self.required = (*self.required, name)
+        self._entry(name)
+
+    def _entry(self, name: str) -> dict:
+        if name not in self._components:
+            self._components[name] = {"state": "pending", "seconds": None, "error": None}
+            self._events[name] = asyncio.Event()
+        return self._components[name]
+
+    def track(self, name: str, coro) -> asyncio.Task:
+        """Ejecuta `coro` en background registrando estado y duración del componente `name`."""
+        entry = self._entry(name)
+
+        async def runner():
+            entry["state"] = "loading"
+            start = time.perf_counter()
+            try:
+                await coro
+                entry["state"] = "ready"
+            except Exception as e:
+                entry["state"] = "failed"
+                entry["error"] = str(e)
+            finally:
+                entry["seconds"] = round(time.perf_counter() - start, 2)
+                self._events[name].set()
+            if entry["state"] == "ready":
+                print(f"[STARTUP] {name} listo en {entry['seconds']}s")
+            else:
+                print(f"[STARTUP] {name} falló tras {entry['seconds']}s: {entry['error']}")
+            self._log_summary()
+
+        return asyncio.get_running_loop().create_task(runner())
+
+    def _log_summary(self):
+        if self._summary_logged or any(c["state"] in ("pending", "loading") for c in self._components.values()):
+            return
+        self._summary_logged = True
+        parts = ", ".join(f"{name} {c['seconds']}s ({c['state']})" for name, c in self._components.items())
+        print(f"[STARTUP] Arranque completo en {self.uptime():.2f}s: {parts}")
+
+    def uptime(self) -> float:
+        return time.perf_counter() - self._t0
+
+    def is_ready(self, *names: str) -> bool:
+        return all(self._entry(n)["state"] == "ready" for n in (names or self.required))
+
+    async def wait(self, *names: str, timeout: float = READY_WAIT_TIMEOUT) -> bool:
+        """Espera a que terminen de cargar los componentes (por defecto, los requeridos).
+
+        Devuelve True si todos quedaron listos; False si alguno falló o se agotó el timeout.
+        """
+        names = names or self.required
+        for n in names:
+            self._entry(n)
+        pending = [self._events[n].wait() for n in names if not self._events[n].is_set()]
+        if pending:
+            try:
+                await asyncio.wait_for(asyncio.gather(*pending), timeout=timeout)
+            except asyncio.TimeoutError:
+                return False
+        return self.is_ready(*names)
+
+    def snapshot(self) -> dict:
+        return {
+            "ready": self.is_ready(),
+            "uptime_seconds": round(self.uptime(), 2),
+            "components": {name: dict(c) for name, c in self._components.items()},
+        }
+
+
+readiness = Readiness()
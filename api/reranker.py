@@ -0,0 +1,146 @@
+"""Re-ranking opcional de los fragmentos recuperados con un cross-encoder local en CPU.
+
+Se recuperan RERANK_CANDIDATES fragmentos, el cross-encoder puntúa cada par (pregunta, fragmento) en
+un solo batch y se quedan los RERANK_TOP_N mejores: menos contexto y más preciso acorta la evaluación
+del prompt en Ollama. Cada request tiene un presupuesto de latencia (RERANK_BUDGET_MS); si la
+estimación o la ejecución lo exceden se usa el orden de la recuperación. Los puntajes se cachean.
+"""
+import os
+import time
+import asyncio
+import threading
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from embedding_cache import content_hash
+from answer_cache import normalize_question
+
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "false").lower() in ("1", "true", "yes")
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "12"))
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "4"))
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "400"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "20000"))
+RERANK_MAX_LENGTH = int(os.getenv("RERANK_MAX_LENGTH", "256"))
+
+
+class Reranker:
+    def __init__(self, model_name: str = RERANK_MODEL, enabled: bool = RERANK_ENABLED,
+                 budget_ms: float = RERANK_BUDGET_MS, cache_size: int = RERANK_CACHE_SIZE):
+        self.model_name = model_name
+        self.enabled = enabled
+        self.budget = budget_ms / 1000
+        self.cache_size = cache_size
+        self._model = None
+        self._load_failed = False
+        self._loading = False
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+        self._cache: OrderedDict[tuple[str, str], float] = OrderedDict()
+        # Latencia por par (media móvil) para decidir antes de ejecutar si entra en el presupuesto
+        self._per_pair: float | None = None
+        self.reranked = 0
+        self.cache_hits = 0
+        self.fallback_budget = 0
+        self.fallback_timeout = 0
+        self.fallback_unavailable = 0
+
+    def _load(self):
+        try:
+            from sentence_transformers import CrossEncoder
+            start = time.perf_counter()
+            model = CrossEncoder(self.model_name, device="cpu", max_length=RERANK_MAX_LENGTH)
+            print(f"[RERANK] Modelo {self.model_name} cargado en {time.perf_counter() - start:.1f}s")
+            self._model = model
+        except Exception:
+            print(f"Warning: fallo cargando cross-encoder {self.model_name}:\n", traceback.format_exc())
+            self._load_failed = True
+        finally:
+            self._loading = False
+
+    def preload(self):
+        """Carga el modelo en background; mientras tanto las consultas usan el orden de recuperación."""
+        if not self.enabled or self._model is not None or self._load_failed or self._loading:
+            return
+        self._loading = True
+        self._executor.submit(self._load)
+
+    def _score(self, query_key: str, query: str, pending: list[tuple[str, str]]) -> dict[str, float]:
+        start = time.perf_counter()
+        scores = self._model.predict([(query, text) for _, text in pending], batch_size=32, show_progress_bar=False)
+        elapsed = (time.perf_counter() - start) / max(1, len(pending))
+        self._per_pair = elapsed if self._per_pair is None else 0.8 * self._per_pair + 0.2 * elapsed
+        out = {h: float(s) for (h, _), s in zip(pending, scores)}
+        with self._lock:
+            for h, s in out.items():
+                self._cache[(query_key, h)] = s
+                self._cache.move_to_end((query_key, h))
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return out
+
+    async def rerank(self, query: str, candidates: list[dict], top_n: int = RERANK_TOP_N) -> list[dict]:
+        """Reordena `candidates` (dicts con "text") y devuelve los `top_n` mejores."""
+        if not self.enabled or len(candidates) <= 1:
+            return candidates[:top_n]
+        if self._model is None:
+            self.preload()
+            self.fallback_unavailable += 1
+            return candidates[:top_n]
+
+        query_key = normalize_question(query)
+        hashes = [content_hash(c.get("text", "")) for c in candidates]
+        scores: dict[str, float] = {}
+        with self._lock:
+            for h in hashes:
+                s = self._cache.get((query_key, h))
+                if s is not None:
+                    scores[h] = s
+        self.cache_hits += len(scores)
+        pending = [(h, c.get("text", "")) for h, c in zip(hashes, candidates) if h not in scores]
+        pending = list(dict(pending).items())
+        if pending:
+            loop = asyncio.get_running_loop()
+            if self._per_pair is not None and self._per_pair * len(pending) > self.budget:
+                self.fallback_budget += 1
+                # Cada tanto se puntúa igual en background para actualizar la estimación y la caché
+                if self.fallback_budget % 20 == 0:
+                    loop.run_in_executor(self._executor, self._score, query_key, query, pending)
+                return candidates[:top_n]
+            fut = loop.run_in_executor(self._executor, self._score, query_key, query, pending)
+            try:
+                # shield: si se agota el presupuesto el cálculo sigue y sus puntajes quedan en caché
+                scores.update(await asyncio.wait_for(asyncio.shield(fut), timeout=self.budget))
+            except asyncio.TimeoutError:
+                self.fallback_timeout += 1
+                return candidates[:top_n]
+            except Exception:
+                print("Warning: fallo en re-ranking, se usa el orden de recuperación:\n", traceback.format_exc())
+                return candidates[:top_n]
+        self.reranked += 1
+        order = sorted(range(len(candidates)), key=lambda i: scores[hashes[i]], reverse=True)
+        out = []
+        for i in order[:top_n]:
+            c = dict(candidates[i])
+            c["meta"] = {**(c.get("meta") or {}), "rerank_score": round(scores[hashes[i]], 4)}
+            out.append(c)
+        return out
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "model": self.model_name,
+            "loaded": self._model is not None,
+            "budget_ms": self.budget * 1000,
+            "per_pair_ms": round(self._per_pair * 1000, 2) if self._per_pair is not None else None,
+            "reranked": self.reranked,
+            "cache_hits": self.cache_hits,
+            "cache_entries": len(self._cache),
+            "fallback_budget": self.fallback_budget,
+            "fallback_timeout": self.fallback_timeout,
+            "fallback_unavailable": self.fallback_unavailable,
+        }
+
+
+reranker = Reranker()
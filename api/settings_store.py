@@ -0,0 +1,183 @@
+"""Configuración compartida entre los procesos del backend (uvicorn --workers N).
+
+Reemplaza a model_selected.txt: los valores viven en una tabla SQLite junto a CHROMA_DIR y cada
+proceso los sirve desde memoria. Los cambios hechos por otro proceso se detectan consultando
+`PRAGMA data_version` (cambia solo cuando otra conexión confirma una escritura) cada
+SETTINGS_POLL_SECONDS; en ese caso se recarga la tabla y se avisa a los listeners de las claves
+que cambiaron. Las escrituras locales avisan en el momento.
+"""
+import os
+import time
+import sqlite3
+import asyncio
+import threading
+import traceback
+
+import rag
+
+SETTINGS_DB = os.getenv("SETTINGS_DB", os.path.join(os.path.dirname(rag.CHROMA_DIR) or ".", "settings.db"))
+SETTINGS_POLL_SECONDS = float(os.getenv("SETTINGS_POLL_SECONDS", "1"))
+DEFAULT_MODEL = os.getenv("MODEL_NAME", "qwen2.5:1.5b")
+# Archivo usado antes del store; se importa una sola vez si existe
+LEGACY_MODEL_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "model_selected.txt")
+
+
+class SettingsStore:
+    def __init__(self, db_path: str = SETTINGS_DB, poll_seconds: float = SETTINGS_POLL_SECONDS):
+        self.db_path = db_path
+        self.poll_seconds = max(0.1, poll_seconds)
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self._values: dict[str, str] | None = None
+        self._data_version: int | None = None
+        self._listeners = []
+        self._task: asyncio.Task | None = None
+        self._notified = 0
+
+    # --- Persistencia ---
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+            self._migrate_legacy()
+        return self._conn
+
+    def _migrate_legacy(self):
+        if not os.path.exists(LEGACY_MODEL_FILE):
+            return
+        try:
+            with open(LEGACY_MODEL_FILE, "r", encoding="utf-8") as f:
+                model = f.read().strip()
+        except OSError:
+            return
+        if model:
+            # INSERT OR IGNORE: si otro worker ya migró (o se eligió otro modelo) no se pisa
+            self._conn.execute("INSERT OR IGNORE INTO settings (key, value, updated_at) VALUES ('selected_model', ?, ?)",
+                               (model, time.time()))
+            self._conn.commit()
+
+    def _load(self) -> dict[str, str]:
+        """Relee la tabla si otro proceso escribió; devuelve las claves que cambiaron. Requiere _lock."""
+        db = self._db()
+        version = db.execute("PRAGMA data_version").fetchone()[0]
+        if self._values is not None and version == self._data_version:
+            return {}
+        values = dict(db.execute("SELECT key, value FROM settings").fetchall())
+        previous = self._values or {}
+        changed = {k: v for k, v in values.items() if previous.get(k) != v}
+        first = self._values is None
+        self._values, self._data_version = values, version
+        return {} if first else changed
+
+    # --- API pública ---
+
+    def on_change(self, fn):
+        """Registra fn(clave, valor), llamada al cambiar una clave (en este proceso o en otro)."""
+        self._listeners.append(fn)
+        return fn
+
+    def get(self, key: str, default: str | None = None) -> str | None:
+        with self._lock:
+            if self._values is None:
+                self._load()
+            return self._values.get(key, default)
+
+    def set(self, key: str, value: str):
+        with self._lock:
+            # Primero lo que escribieron otros: data_version no cambia con las escrituras propias
+            changed = self._load()
+            db = self._db()
+            db.execute("INSERT OR REPLACE INTO settings (key, value, updated_at) VALUES (?, ?, ?)", (key, value, time.time()))
+            db.commit()
+            if self._values.get(key) != value:
+                changed[key] = value
+            self._values[key] = value
+        self._notify(changed)
+
+    def incr(self, key: str) -> int:
+        """Incrementa un contador compartido de forma atómica y devuelve el nuevo valor."""
+        with self._lock:
+            changed = self._load()
+            db = self._db()
+            db.execute(
+                "INSERT INTO settings (key, value, updated_at) VALUES (?, '1', ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1, updated_at = excluded.updated_at",
+                (key, time.time()),
+            )
+            db.commit()
+            value = db.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()[0]
+            self._values[key] = changed[key] = value
+        self._notify(changed)
+        return int(value)
+
+    def claim(self, key: str, interval: float) -> bool:
+        """True para un solo proceso por intervalo: tareas periódicas que no deben repetirse en cada worker."""
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            cur = db.execute(
+                "INSERT INTO settings (key, value, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at "
+                "WHERE settings.updated_at <= ?",
+                (key, str(os.getpid()), now, now - interval),
+            )
+            db.commit()
+            return cur.rowcount == 1
+
+    def refresh(self):
+        """Aplica los cambios hechos por otros procesos desde la última consulta."""
+        with self._lock:
+            changed = self._load()
+        self._notify(changed)
+
+    def selected_model(self) -> str:
+        return self.get("selected_model") or DEFAULT_MODEL
+
+    def _notify(self, changed: dict[str, str]):
+        for key, value in changed.items():
+            self._notified += 1
+            for fn in self._listeners:
+                try:
+                    fn(key, value)
+                except Exception:
+                    print(f"[SETTINGS] Error en listener de '{key}':\n", traceback.format_exc())
+
+    # --- Sondeo ---
+
+    async def start(self):
+        if self._task is not None:
+            return
+        await asyncio.to_thread(self.refresh)
+        self._task = asyncio.get_running_loop().create_task(self._poll_loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def _poll_loop(self):
+        while True:
+            await asyncio.sleep(self.poll_seconds)
+            try:
+                await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                print(f"[SETTINGS] Error leyendo {self.db_path}: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            keys = len(self._values or {})
+        return {"db": self.db_path, "pid": os.getpid(), "keys": keys, "poll_seconds": self.poll_seconds,
+                "notifications": self._notified}
+
+
+settings = SettingsStore()
@@ -0,0 +1,550 @@
+"""Mantenimiento del almacén vectorial: reporte, compactación, snapshots y precalentamiento.
+
+    python vector_maintenance.py report [--session ID] [--probes 20]
+    python vector_maintenance.py compact [--session ID] [--force] [--offline [--vacuum]]
+    python vector_maintenance.py snapshot [--dest storage/snapshots] [--no-uploads] [--archive] [--offline]
+    python vector_maintenance.py restore storage/snapshots/20250101-120000[.tar.gz] [--force]
+    python vector_maintenance.py warm [--offline]
+
+Chroma marca como borrados los fragmentos eliminados del índice HNSW pero no los quita: el índice de
+una sesión con muchas bajas sigue ocupando (y recorriendo) lo mismo. La compactación copia los
+fragmentos vivos a una colección nueva y la pone en lugar de la anterior; las consultas siguen
+respondiendo durante la copia y solo las escrituras esperan. Se compactan las colecciones con al
+menos VECTOR_COMPACT_MIN_DELETED de elementos borrados (o todas con --force), y el resultado trae
+tamaño, fracción borrada y latencia de consulta antes y después.
+
+Un snapshot copia, con las escrituras detenidas, Chroma, el catálogo, el índice BM25 y (por defecto)
+los archivos subidos, con un manifest.json de sumas SHA-256 para verificarlo en otro nodo. restore
+solo corre offline, con el backend y el servicio de índice detenidos.
+
+Las escrituras solo se detienen dentro del proceso dueño de Chroma. Por eso compact, snapshot y warm
+se ejecutan en el servicio de índice si INDEX_SERVICE_ADDRESS está definida; sin servicio, la CLI
+exige --offline (backend detenido) y si no, hay que usar POST /vectordb/compact o /vectordb/snapshot.
+
+Al arrancar, warm lee las páginas del índice de las sesiones más recientes y ejecuta consultas
+sintéticas (con embeddings guardados) para que /ready no informe listo con el índice en frío.
+"""
+import os
+import sys
+import json
+import time
+import pickle
+import shutil
+import sqlite3
+import hashlib
+import argparse
+import tarfile
+import tempfile
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import rag
+from doc_catalog import doc_catalog, DOC_CATALOG_DB
+from lexical_index import LEXICAL_DB
+from vector_partitions import COLLECTION_METADATA, COMPACT_SUFFIXES, collection_name
+
+VECTOR_COMPACT_MIN_DELETED = float(os.getenv("VECTOR_COMPACT_MIN_DELETED", "0.2"))
+VECTOR_COMPACT_PAGE = int(os.getenv("VECTOR_COMPACT_PAGE", "1000"))
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", os.path.join(os.path.dirname(rag.CHROMA_DIR) or ".", "snapshots"))
+VECTOR_WARMUP_ENABLED = os.getenv("VECTOR_WARMUP_ENABLED", "true").lower() in ("1", "true", "yes")
+VECTOR_WARMUP_COLLECTIONS = int(os.getenv("VECTOR_WARMUP_COLLECTIONS", "16"))  # sesiones más recientes
+VECTOR_WARMUP_QUERIES = int(os.getenv("VECTOR_WARMUP_QUERIES", "3"))  # consultas sintéticas por sesión
+VECTOR_WARMUP_MAX_MB = float(os.getenv("VECTOR_WARMUP_MAX_MB", "512"))  # lectura máxima de archivos
+
+CHROMA_SQLITE = "chroma.sqlite3"
+READ_BLOCK = 1 << 20
+
+
+# --- Inspección ---
+
+def _client():
+    if rag.get_partitions() is None:
+        raise RuntimeError("Chroma no está disponible")
+    return rag._client
+
+
+def _collection_names(client) -> set[str]:
+    # Según la versión de chromadb list_collections devuelve nombres o colecciones
+    return {getattr(c, "name", c) for c in client.list_collections()}
+
+
+def _segment_dir(collection) -> str | None:
+    """Directorio del índice HNSW de la colección (segmento VECTOR en chroma.sqlite3)."""
+    path = os.path.join(rag.CHROMA_DIR, CHROMA_SQLITE)
+    if not os.path.exists(path):
+        return None
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=10)
+        try:
+            row = conn.execute("SELECT id FROM segments WHERE collection = ? AND scope = 'VECTOR'",
+                               (str(collection.id),)).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+    seg = os.path.join(rag.CHROMA_DIR, row[0]) if row else None
+    return seg if seg and os.path.isdir(seg) else None
+
+
+def _dir_size(path: str | None) -> int:
+    if not path:
+        return 0
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _hnsw_counts(segment: str | None) -> tuple[int, int] | None:
+    """(elementos en el índice HNSW, elementos vivos) según los metadatos persistidos por Chroma.
+
+    Chroma los escribe cada cierta cantidad de altas: en colecciones recién modificadas puede ir atrasado.
+    """
+    path = os.path.join(segment, "index_metadata.pickle") if segment else None
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as fh:
+            data = pickle.load(fh)
+        # Puede ser un objeto PersistentData o un dict según la versión de chromadb
+        get = data.get if isinstance(data, dict) else lambda k: getattr(data, k, None)
+        return int(get("total_elements_added") or 0), len(get("id_to_label") or {})
+    except Exception:
+        return None
+
+
+def _probe_embeddings(collection, n: int) -> list:
+    if n <= 0:
+        return []
+    res = collection.get(limit=n, include=["embeddings"])
+    embs = res.get("embeddings")
+    return [list(e) for e in embs] if embs is not None else []
+
+
+def _latency(collection, probes: list, top_k: int = 6) -> dict | None:
+    if not probes:
+        return None
+    n = max(1, min(top_k, collection.count()))
+    times = []
+    for emb in probes:
+        start = time.perf_counter()
+        collection.query(query_embeddings=[emb], n_results=n, include=["metadatas", "distances"])
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return {"queries": len(times), "p50_ms": round(times[len(times) // 2], 2),
+            "p95_ms": round(times[min(len(times) - 1, int(len(times) * 0.95))], 2),
+            "mean_ms": round(sum(times) / len(times), 2)}
+
+
+def _session_names() -> dict[str, str]:
+    sessions = {row["session_id"] for row in doc_catalog.all_names().values()}
+    return {collection_name(s): s for s in sessions}
+
+
+def collection_report(collection, probes: list | None = None, n_probes: int = 20) -> dict:
+    segment = _segment_dir(collection)
+    counts = _hnsw_counts(segment)
+    chunks = collection.count()
+    elements, live = counts if counts else (None, None)
+    deleted = max(0, elements - live) if counts else None
+    fraction = (round(deleted / elements, 4) if elements else 0.0) if counts else None
+    if probes is None:
+        probes = _probe_embeddings(collection, n_probes)
+    return {
+        "name": collection.name,
+        "chunks": chunks,
+        "hnsw_elements": elements,
+        "deleted": deleted,
+        "deleted_fraction": fraction,
+        "index_bytes": _dir_size(segment),
+        "latency": _latency(collection, probes),
+    }
+
+
+def report(session_id: str | None = None, probes: int = 20) -> dict:
+    """Tamaño, fracción borrada y latencia de consulta de cada colección (o de una sesión)."""
+    partitions = rag.get_partitions()
+    if partitions is None:
+        raise RuntimeError("Chroma no está disponible")
+    if session_id:
+        col = partitions.get(session_id)
+        collections = [col] if col is not None else []
+    else:
+        collections = partitions.all_collections()
+    sessions = _session_names()
+    rows = []
+    for col in collections:
+        row = collection_report(col, n_probes=probes)
+        row["session_id"] = sessions.get(col.name)
+        rows.append(row)
+    known = [r for r in rows if r["hnsw_elements"] is not None]
+    elements = sum(r["hnsw_elements"] for r in known)
+    deleted = sum(r["deleted"] for r in known)
+    sqlite_path = os.path.join(rag.CHROMA_DIR, CHROMA_SQLITE)
+    return {
+        "chroma_dir": rag.CHROMA_DIR,
+        "sqlite_bytes": os.path.getsize(sqlite_path) if os.path.exists(sqlite_path) else 0,
+        "index_bytes": sum(r["index_bytes"] for r in rows),
+        "chunks": sum(r["chunks"] for r in rows),
+        "deleted": deleted,
+        "deleted_fraction": round(deleted / elements, 4) if elements else 0.0,
+        "collections": rows,
+    }
+
+
+# --- Compactación ---
+
+def _recover(client, name: str):
+    """Deja en orden lo que haya quedado de una compactación interrumpida."""
+    names = _collection_names(client)
+    if name + "_compact" in names:
+        client.delete_collection(name + "_compact")
+    if name + "_old" in names:
+        if name in names:
+            client.delete_collection(name + "_old")
+        else:
+            # Se cortó entre los dos cambios de nombre: la vieja sigue siendo la completa
+            client.get_collection(name + "_old").modify(name=name)
+            rag.get_partitions().bump_generation()
+
+
+def recover_interrupted() -> int:
+    """Recupera las colecciones de compactaciones cortadas a mitad (al arrancar y antes de compactar)."""
+    client = _client()
+    pending = {n.rsplit("_", 1)[0] for n in _collection_names(client) if n.endswith(COMPACT_SUFFIXES)}
+    for name in pending:
+        _recover(client, name)
+        print(f"[MAINTENANCE] Compactación interrumpida de {name} recuperada")
+    return len(pending)
+
+
+def compact_collection(partitions, name: str, page: int = VECTOR_COMPACT_PAGE) -> int:
+    """Reconstruye la colección `name` solo con sus fragmentos vivos; devuelve cuántos copió."""
+    client = _client()
+    with partitions.gate.exclusive():
+        _recover(client, name)
+        old = client.get_collection(name)
+        fresh = client.create_collection(name + "_compact", metadata=old.metadata or COLLECTION_METADATA)
+        copied = 0
+        try:
+            # Sin escrituras en curso (gate exclusivo) la paginación por offset no saltea fragmentos
+            while True:
+                res = old.get(include=["documents", "metadatas", "embeddings"], limit=page, offset=copied)
+                ids = res.get("ids") or []
+                if not ids:
+                    break
+                fresh.add(ids=ids, documents=res["documents"], metadatas=res["metadatas"], embeddings=res["embeddings"])
+                copied += len(ids)
+            if fresh.count() != old.count():
+                raise RuntimeError(f"{name}: la copia tiene {fresh.count()} fragmentos y el original {old.count()}")
+        except Exception:
+            client.delete_collection(name + "_compact")
+            raise
+        # Las consultas que ya tenían la colección vieja la usan hasta el borrado final
+        old.modify(name=name + "_old")
+        fresh.modify(name=name)
+        client.delete_collection(name + "_old")
+        # Los handles abiertos (en este y en otros procesos) apuntan a la colección borrada
+        partitions.bump_generation()
+    return copied
+
+
+def compact(session_id: str | None = None, force: bool = False, min_deleted: float = VECTOR_COMPACT_MIN_DELETED,
+            probes: int = 20) -> dict:
+    """Compacta las colecciones con suficientes borrados (o la de una sesión) informando antes y después."""
+    partitions = rag.get_partitions()
+    if partitions is None:
+        raise RuntimeError("Chroma no está disponible")
+    recover_interrupted()
+    if session_id:
+        col = partitions.get(session_id)
+        collections = [col] if col is not None else []
+    else:
+        collections = partitions.all_collections()
+    sessions = _session_names()
+    results, skipped = [], 0
+    for col in collections:
+        if col.name == partitions.legacy_name:
+            skipped += 1  # la colección heredada se vacía sola al migrar las sesiones
+            continue
+        probe_set = _probe_embeddings(col, probes)
+        before = collection_report(col, probes=probe_set)
+        fraction = before["deleted_fraction"]
+        if not force and (fraction is None or fraction < min_deleted):
+            skipped += 1
+            continue
+        # El handle viejo cambia de nombre durante el reemplazo
+        name = col.name
+        start = time.perf_counter()
+        copied = compact_collection(partitions, name)
+        after = collection_report(rag._client.get_collection(name), probes=probe_set)
+        seconds = round(time.perf_counter() - start, 2)
+        print(f"[MAINTENANCE] {name}: {copied} fragmentos, índice {before['index_bytes']} → {after['index_bytes']} "
+              f"bytes, borrados {before['deleted_fraction']} → {after['deleted_fraction']} ({seconds}s)")
+        results.append({"name": name, "session_id": sessions.get(name), "chunks": copied,
+                        "seconds": seconds, "before": before, "after": after})
+    return {"compacted": results, "skipped": skipped, "min_deleted": min_deleted, "force": force}
+
+
+def vacuum() -> dict:
+    """VACUUM de chroma.sqlite3 (solo offline: recupera el espacio de las colecciones borradas)."""
+    path = os.path.join(rag.CHROMA_DIR, CHROMA_SQLITE)
+    before = os.path.getsize(path)
+    conn = sqlite3.connect(path, timeout=60)
+    try:
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    after = os.path.getsize(path)
+    print(f"[MAINTENANCE] VACUUM de {path}: {before} → {after} bytes")
+    return {"sqlite_bytes_before": before, "sqlite_bytes_after": after}
+
+
+# --- Snapshots ---
+
+def _backup_sqlite(src: str, dst: str):
+    # API de backup de SQLite: copia consistente aunque otra conexión tenga el archivo abierto (WAL incluido)
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    source = sqlite3.connect(src, timeout=60)
+    target = sqlite3.connect(dst)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+def _copy_store(src: str, dst: str):
+    """Copia un directorio; los .sqlite3/.db con la API de backup, sin sus -wal/-shm."""
+    for root, _, files in os.walk(src):
+        rel = os.path.relpath(root, src)
+        os.makedirs(os.path.join(dst, rel), exist_ok=True)
+        for name in files:
+            if name.endswith(("-wal", "-shm", "-journal")):
+                continue
+            s, d = os.path.join(root, name), os.path.join(dst, rel, name)
+            if name.endswith((".sqlite3", ".db")):
+                _backup_sqlite(s, d)
+            else:
+                shutil.copy2(s, d)
+
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(READ_BLOCK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _checksums(root: str) -> dict[str, str]:
+    out = {}
+    for base, _, files in os.walk(root):
+        for name in files:
+            path = os.path.join(base, name)
+            rel = os.path.relpath(path, root)
+            if rel != "manifest.json":
+                out[rel] = _sha256(path)
+    return out
+
+
+def snapshot(dest: str = SNAPSHOT_DIR, include_uploads: bool = True, archive: bool = False) -> dict:
+    """Copia consistente del almacén (escrituras detenidas mientras se copia; las consultas siguen)."""
+    partitions = rag.get_partitions()
+    if partitions is None:
+        raise RuntimeError("Chroma no está disponible")
+    name = time.strftime("%Y%m%d-%H%M%S")
+    target = os.path.join(dest, name)
+    partial = target + ".partial"
+    start = time.perf_counter()
+    with partitions.gate.exclusive():
+        # Lo que Chroma aún no volcó al índice HNSW está en chroma.sqlite3 y se reaplica al abrir la copia
+        _copy_store(rag.CHROMA_DIR, os.path.join(partial, "vectordb"))
+        if os.path.exists(DOC_CATALOG_DB):
+            _backup_sqlite(DOC_CATALOG_DB, os.path.join(partial, "catalog.db"))
+        if os.path.exists(LEXICAL_DB):
+            _backup_sqlite(LEXICAL_DB, os.path.join(partial, "lexical.db"))
+        if include_uploads and os.path.isdir(rag.UPLOAD_DIR):
+            shutil.copytree(rag.UPLOAD_DIR, os.path.join(partial, "uploads"))
+        chunks = {c.name: c.count() for c in partitions.all_collections()}
+    locked = round(time.perf_counter() - start, 2)
+    manifest = {
+        "name": name,
+        "created_at": time.time(),
+        "embed_key": rag.EMBED_KEY,
+        "collections": chunks,
+        "chunks": sum(chunks.values()),
+        "writes_paused_seconds": locked,
+        "files": _checksums(partial),
+    }
+    with open(os.path.join(partial, "manifest.json"), "w", encoding="utf-8") as fh:
+        json.dump(manifest, fh, ensure_ascii=False, indent=2)
+    os.rename(partial, target)
+    result = {"path": target, "chunks": manifest["chunks"], "files": len(manifest["files"]),
+              "bytes": _dir_size(target), "writes_paused_seconds": locked}
+    if archive:
+        result["archive"] = shutil.make_archive(target, "gztar", root_dir=dest, base_dir=name)
+    print(f"[SNAPSHOT] {target}: {result['chunks']} fragmentos, {result['bytes']} bytes "
+          f"(escrituras detenidas {locked}s)")
+    return result
+
+
+def restore(path: str, force: bool = False) -> dict:
+    """Restaura un snapshot (directorio o .tar.gz) verificando sus sumas. Solo offline."""
+    tmp = None
+    try:
+        if os.path.isfile(path):
+            tmp = tempfile.mkdtemp(prefix="snapshot-")
+            with tarfile.open(path) as tar:
+                if hasattr(tarfile, "data_filter"):
+                    tar.extractall(tmp, filter="data")  # sin rutas absolutas ni enlaces fuera del destino
+                else:
+                    tar.extractall(tmp)
+            entries = os.listdir(tmp)
+            path = os.path.join(tmp, entries[0]) if len(entries) == 1 else tmp
+        with open(os.path.join(path, "manifest.json"), encoding="utf-8") as fh:
+            manifest = json.load(fh)
+        if _checksums(path) != manifest["files"]:
+            raise ValueError(f"{path}: los archivos no coinciden con manifest.json")
+        if manifest.get("embed_key") != rag.EMBED_KEY:
+            print(f"[SNAPSHOT] Aviso: el snapshot usa {manifest.get('embed_key')} y este nodo {rag.EMBED_KEY}")
+        targets = [("vectordb", rag.CHROMA_DIR), ("catalog.db", DOC_CATALOG_DB), ("lexical.db", LEXICAL_DB),
+                   ("uploads", rag.UPLOAD_DIR)]
+        targets = [(src, dst) for src, dst in targets if os.path.exists(os.path.join(path, src))]
+        busy = [dst for _, dst in targets if os.path.exists(dst) and (os.path.isfile(dst) or os.listdir(dst))]
+        if busy and not force:
+            raise RuntimeError(f"Ya existen {', '.join(busy)}; usar --force para reemplazarlos")
+        for src, dst in targets:
+            if os.path.isdir(dst):
+                shutil.rmtree(dst)
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.isfile(dst + suffix):
+                    os.remove(dst + suffix)
+            src = os.path.join(path, src)
+            if os.path.isdir(src):
+                shutil.copytree(src, dst)
+            else:
+                os.makedirs(os.path.dirname(os.path.abspath(dst)), exist_ok=True)
+                shutil.copy2(src, dst)
+        print(f"[SNAPSHOT] Restaurado {manifest['name']}: {manifest['chunks']} fragmentos")
+        return {"name": manifest["name"], "chunks": manifest["chunks"], "restored": [dst for _, dst in targets]}
+    finally:
+        if tmp:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+# --- Precalentamiento ---
+
+def _read_file(path: str, limit: int) -> int:
+    """Lee el archivo (hasta `limit` bytes) para dejarlo en la caché de páginas del sistema."""
+    read = 0
+    try:
+        with open(path, "rb", buffering=0) as fh:
+            while read < limit:
+                block = fh.read(min(READ_BLOCK, limit - read))
+                if not block:
+                    break
+                read += len(block)
+    except OSError:
+        pass
+    return read
+
+
+def warm(max_collections: int = VECTOR_WARMUP_COLLECTIONS, queries: int = VECTOR_WARMUP_QUERIES,
+         max_mb: float = VECTOR_WARMUP_MAX_MB) -> dict:
+    """Lee las páginas del índice de las sesiones recientes y las consulta con embeddings guardados."""
+    partitions = rag.get_partitions()
+    if partitions is None:
+        raise RuntimeError("Chroma no está disponible")
+    start = time.perf_counter()
+    recover_interrupted()
+    budget = int(max_mb * (1 << 20))
+    # chroma.sqlite3 primero: todas las consultas leen de ahí documentos y metadatos
+    read = _read_file(os.path.join(rag.CHROMA_DIR, CHROMA_SQLITE), budget)
+    warmed, latencies = 0, []
+    for session_id in doc_catalog.recent_sessions(max_collections):
+        col = partitions.get(session_id)
+        if col is None:
+            continue
+        segment = _segment_dir(col)
+        for name in sorted(os.listdir(segment)) if segment else []:
+            read += _read_file(os.path.join(segment, name), budget - read)
+        # La primera consulta carga el índice HNSW en memoria; las siguientes miden la latencia en caliente
+        stats = _latency(col, _probe_embeddings(col, queries))
+        if stats:
+            latencies.append(stats["p50_ms"])
+        warmed += 1
+    result = {"collections": warmed, "bytes_read": read, "seconds": round(time.perf_counter() - start, 2),
+              "p50_ms": round(sorted(latencies)[len(latencies) // 2], 2) if latencies else None}
+    print(f"[WARMUP] {warmed} colecciones, {read >> 20} MB leídos en {result['seconds']}s")
+    return result
+
+
+def _owner(args):
+    """El servicio de índice o None (este proceso, con --offline): el gate de escrituras es local a cada
+    proceso y desde la CLI, con el backend en marcha, ni la compactación ni el snapshot lo detendrían."""
+    from index_service import cli_target
+    return cli_target(args.command, args.offline, hint="Con el backend en marcha usar POST /vectordb/compact o "
+                      "/vectordb/snapshot (o INDEX_SERVICE_ADDRESS). ")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("report", help="tamaño, fracción borrada y latencia por colección")
+    p.add_argument("--session")
+    p.add_argument("--probes", type=int, default=20)
+    p = sub.add_parser("compact", help="reconstruir colecciones sin los fragmentos borrados")
+    p.add_argument("--session")
+    p.add_argument("--force", action="store_true", help="compactar aunque tengan pocos borrados")
+    p.add_argument("--min-deleted", type=float, default=VECTOR_COMPACT_MIN_DELETED)
+    p.add_argument("--offline", action="store_true", help="el backend está detenido: compactar desde este proceso")
+    p.add_argument("--vacuum", action="store_true", help="VACUUM de chroma.sqlite3 al terminar (requiere --offline)")
+    p = sub.add_parser("snapshot", help="copia consistente para respaldo o para otro nodo")
+    p.add_argument("--dest", help=f"directorio de destino (por defecto {SNAPSHOT_DIR})")
+    p.add_argument("--no-uploads", action="store_true", help="sin los archivos subidos")
+    p.add_argument("--archive", action="store_true", help="además generar un .tar.gz")
+    p.add_argument("--offline", action="store_true", help="el backend está detenido: copiar desde este proceso")
+    p = sub.add_parser("restore", help="restaurar un snapshot (con el backend detenido)")
+    p.add_argument("path")
+    p.add_argument("--force", action="store_true", help="reemplazar el almacén existente")
+    p = sub.add_parser("warm", help="precalentar el índice de las sesiones recientes")
+    p.add_argument("--offline", action="store_true", help="el backend está detenido: precalentar desde este proceso")
+    args = parser.parse_args(argv)
+
+    if args.command == "report":
+        result = report(args.session, probes=args.probes)
+    elif args.command == "restore":
+        try:
+            result = restore(args.path, force=args.force)
+        except (ValueError, RuntimeError) as e:
+            sys.exit(str(e))
+    else:
+        if args.command == "compact" and args.vacuum and not args.offline:
+            sys.exit("--vacuum requiere --offline, con el backend y el servicio de índice detenidos")
+        service = _owner(args)
+        if args.command == "compact":
+            if service:
+                result = service.compact_vector_store(args.session, force=args.force, min_deleted=args.min_deleted)
+            else:
+                result = compact(args.session, force=args.force, min_deleted=args.min_deleted)
+                if args.vacuum:
+                    result["vacuum"] = vacuum()
+        elif args.command == "snapshot":
+            if service:
+                result = service.snapshot_vector_store(include_uploads=not args.no_uploads, archive=args.archive,
+                                                       dest=os.path.abspath(args.dest) if args.dest else None)
+            else:
+                result = snapshot(args.dest or SNAPSHOT_DIR, include_uploads=not args.no_uploads, archive=args.archive)
+        else:
+            result = service.warm_vector_store() if service else warm()
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
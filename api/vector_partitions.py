@@ -0,0 +1,242 @@
+"""Partición del almacén vectorial: una colección de Chroma por sesión.
+
+Con una sola colección "docs" cada consulta recorría un único índice HNSW con los fragmentos de todas
+las sesiones filtrando por client_id, y las eliminaciones eran barridos por metadatos. Aquí cada sesión
+tiene su propia colección (nombre derivado del session_id), que se abre a demanda y se mantiene en un
+LRU de handles abiertos. Eliminar una sesión es borrar su colección. Los fragmentos que sigan en la
+colección "docs" heredada se mueven a la de su sesión la primera vez que se la usa.
+
+Un handle apunta al id de la colección: si otro proceso la borra o la reemplaza (compactación), el
+handle queda inválido. Quien borra o reemplaza reescribe el archivo de generación en CHROMA_DIR, y
+get() descarta los handles abiertos cuando ve que cambió.
+"""
+import os
+import time
+import hashlib
+import threading
+import traceback
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Cantidad máxima de colecciones abiertas a la vez
+VECTOR_PARTITION_HANDLES = int(os.getenv("VECTOR_PARTITION_HANDLES", "64"))
+PARTITION_PREFIX = "session_"
+COLLECTION_METADATA = {"hnsw:space": "cosine"}
+# Fragmentos por lote al migrar desde la colección heredada
+MIGRATE_PAGE = 500
+# Sufijos de las colecciones temporales de la compactación (vector_maintenance.py)
+COMPACT_SUFFIXES = ("_compact", "_old")
+# Archivo (dentro de CHROMA_DIR) que cambia cada vez que se borra o reemplaza una colección
+GENERATION_FILE = "partitions.generation"
+
+
+def collection_name(session_id: str) -> str:
+    # Chroma solo acepta [a-zA-Z0-9._-] y hasta 63 caracteres: se usa un hash del session_id
+    return PARTITION_PREFIX + hashlib.sha1(session_id.encode("utf-8")).hexdigest()
+
+
+class WriteGate:
+    """Escrituras concurrentes entre sí; el mantenimiento (snapshot, compactación) las excluye a todas.
+
+    Las lecturas no pasan por aquí: las consultas siguen respondiendo durante el mantenimiento.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._writers = 0
+        self._exclusive = False
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            while self._exclusive:
+                self._cond.wait()
+            self._writers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writers -= 1
+                self._cond.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self._cond:
+            while self._exclusive:
+                self._cond.wait()
+            # Marcado antes de esperar: las escrituras nuevas ya no entran
+            self._exclusive = True
+            while self._writers:
+                self._cond.wait()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._exclusive = False
+                self._cond.notify_all()
+
+
+class SessionCollections:
+    def __init__(self, client, legacy_name: str = "docs", max_handles: int = VECTOR_PARTITION_HANDLES,
+                 generation_path: str | None = None):
+        self._client = client
+        self.generation_path = generation_path
+        self._generation = self._read_generation()
+        self.gate = WriteGate()
+        self.legacy_name = legacy_name
+        self.max_handles = max_handles
+        self._handles: OrderedDict[str, object] = OrderedDict()
+        self._lock = threading.Lock()
+        self._migrate_lock = threading.Lock()
+        self._migrated: set[str] = set()
+        self._legacy = None
+        self._legacy_checked = False
+        self.opened = 0
+        self.handle_hits = 0
+        self.migrated_chunks = 0
+        self.invalidations = 0
+
+    def _read_generation(self):
+        if not self.generation_path:
+            return None
+        try:
+            st = os.stat(self.generation_path)
+        except OSError:
+            return None
+        # os.replace crea un inodo nuevo: cambia aunque la resolución del mtime sea gruesa
+        return st.st_ino, st.st_mtime_ns
+
+    def _check_generation(self):
+        """Con self._lock tomado: descarta los handles si otro proceso borró o reemplazó colecciones."""
+        generation = self._read_generation()
+        if generation != self._generation:
+            self._generation = generation
+            if self._handles:
+                self._handles.clear()
+                self.invalidations += 1
+
+    def bump_generation(self):
+        """Avisa a todos los procesos (este incluido) que sus handles abiertos pueden estar vencidos."""
+        with self._lock:
+            self._handles.clear()
+            if not self.generation_path:
+                return
+            tmp = f"{self.generation_path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as fh:
+                fh.write(f"{time.time()} {os.getpid()}\n")
+            os.replace(tmp, self.generation_path)
+            self._generation = self._read_generation()
+
+    def _legacy_collection(self):
+        if not self._legacy_checked:
+            self._legacy_checked = True
+            try:
+                self._legacy = self._client.get_collection(self.legacy_name)
+            except Exception:
+                self._legacy = None
+        return self._legacy
+
+    def _remember(self, name: str, col):
+        self._handles[name] = col
+        self._handles.move_to_end(name)
+        while len(self._handles) > self.max_handles:
+            self._handles.popitem(last=False)
+
+    def _migrate(self, session_id: str):
+        """Mueve los fragmentos de la sesión desde la colección heredada (una vez por proceso)."""
+        if session_id in self._migrated:
+            return
+        with self._migrate_lock:
+            if session_id in self._migrated:
+                return
+            legacy = self._legacy_collection()
+            moved = 0
+            if legacy is not None:
+                target = None
+                while True:
+                    res = legacy.get(where={"client_id": session_id}, limit=MIGRATE_PAGE,
+                                     include=["documents", "metadatas", "embeddings"])
+                    ids = res.get("ids") or []
+                    if not ids:
+                        break
+                    if target is None:
+                        target = self._client.get_or_create_collection(collection_name(session_id), metadata=COLLECTION_METADATA)
+                    # upsert antes de borrar: si el proceso se corta a mitad, reintentar no duplica ni pierde nada
+                    target.upsert(ids=ids, documents=res["documents"], metadatas=res["metadatas"], embeddings=res["embeddings"])
+                    legacy.delete(ids=ids)
+                    moved += len(ids)
+                if moved:
+                    self.migrated_chunks += moved
+                    print(f"[PARTITION] {moved} fragmentos de la sesión {session_id} movidos desde '{self.legacy_name}'")
+                    if legacy.count() == 0:
+                        self._client.delete_collection(self.legacy_name)
+                        self._legacy = None
+                        print(f"[PARTITION] Colección heredada '{self.legacy_name}' vacía, eliminada")
+            self._migrated.add(session_id)
+
+    def get(self, session_id: str, create: bool = False):
+        """Colección de la sesión, o None si todavía no tiene documentos y `create` es False."""
+        name = collection_name(session_id)
+        with self._lock:
+            self._check_generation()
+            col = self._handles.get(name)
+            if col is not None:
+                self._handles.move_to_end(name)
+                self.handle_hits += 1
+                return col
+        self._migrate(session_id)
+        try:
+            if create:
+                col = self._client.get_or_create_collection(name, metadata=COLLECTION_METADATA)
+            else:
+                col = self._client.get_collection(name)
+        except Exception:
+            if create:
+                raise
+            return None
+        with self._lock:
+            self._remember(name, col)
+            self.opened += 1
+        return col
+
+    def drop(self, session_id: str):
+        """Elimina todos los fragmentos de la sesión borrando su colección."""
+        name = collection_name(session_id)
+        with self._lock:
+            self._handles.pop(name, None)
+        legacy = self._legacy_collection()
+        if legacy is not None:
+            legacy.delete(where={"client_id": session_id})
+        try:
+            self._client.delete_collection(name)
+        except Exception:
+            # La sesión no tenía colección
+            return
+        self.bump_generation()
+
+    def all_collections(self) -> list:
+        """Todas las colecciones de sesión más la heredada, si existe (para reconstrucciones)."""
+        out = []
+        for c in self._client.list_collections():
+            # Según la versión de chromadb list_collections devuelve nombres o colecciones
+            name = getattr(c, "name", c)
+            if name.endswith(COMPACT_SUFFIXES):
+                continue
+            if name.startswith(PARTITION_PREFIX) or name == self.legacy_name:
+                try:
+                    out.append(c if hasattr(c, "get") else self._client.get_collection(name))
+                except Exception:
+                    print(f"Warning: no se pudo abrir la colección {name}:\n", traceback.format_exc())
+        return out
+
+    def stats(self) -> dict:
+        legacy = self._legacy_collection()
+        return {
+            "open_handles": len(self._handles),
+            "max_handles": self.max_handles,
+            "opened": self.opened,
+            "handle_hits": self.handle_hits,
+            "migrated_chunks": self.migrated_chunks,
+            "invalidations": self.invalidations,
+            "legacy_chunks": legacy.count() if legacy is not None else 0,
+        }
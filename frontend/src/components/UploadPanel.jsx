@@ -12,7 +12,12 @@ export default function UploadPanel({ sessionId, onUpload }) {
     setInfo("");
     try {
       const data = await uploadPdf({ file, session_id: sessionId });
-      setInfo(`PDF subido. Caracteres extraídos: ${data.chars}`);
+      if (data.duplicate) {
+        // Mismo contenido ya indexado en la sesión: no hay job de ingesta
+        setInfo(`"${data.original_filename}" ya estaba indexado en esta sesión.`);
+      } else {
+        setInfo(`PDF subido. Indexando en segundo plano (job ${data.job_id}).`);
+      }
       if (onUpload) onUpload();
     } catch (e) {
       setInfo("Error: " + e.message);